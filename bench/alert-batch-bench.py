@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+########################################
+#
+# alert-batch-bench.py - Alert batch size benchmark
+#
+########################################
+
+import os
+import sys
+from optparse import OptionParser
+import time
+import datetime
+import random
+import uuid
+import imp
+import logging
+import pymongo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.severity import SEVERITY_CODE, CRITICAL, MAJOR, MINOR, WARNING, NORMAL
+from alerta.timestamp import utcnow
+
+__version__ = '1.0.0'
+
+SERVER = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'bin', 'alerta.py')
+
+SEVERITIES = [ CRITICAL, MAJOR, MINOR, WARNING, NORMAL ]
+
+def make_alert(resources, events):
+
+    now = utcnow()
+    severity = random.choice(SEVERITIES)
+    event = random.choice(events)
+
+    alert = dict()
+    alert['id']               = str(uuid.uuid4())
+    alert['resource']         = 'bench%04d' % random.randint(1, resources)
+    alert['event']            = event
+    alert['group']            = 'Bench'
+    alert['value']            = str(random.randint(0, 100))
+    alert['severity']         = severity
+    alert['severityCode']     = SEVERITY_CODE[severity]
+    alert['environment']      = ['BENCH']
+    alert['service']          = ['Bench']
+    alert['text']             = 'benchmark alert'
+    alert['type']             = 'exceptionAlert'
+    alert['tags']             = list()
+    alert['summary']          = 'BENCH - %s %s on %s' % (severity, event, alert['resource'])
+    alert['origin']           = 'alert-batch-bench'
+    alert['thresholdInfo']    = 'n/a'
+    alert['timeout']          = 86400
+    alert['correlatedEvents'] = events
+
+    return (alert, now, now, now + datetime.timedelta(seconds=alert['timeout']))
+
+def main():
+
+    parser = OptionParser(
+                      version="%prog " + __version__,
+                      description="Measure alert save throughput against batch size using a local MongoDB",
+                      epilog="alert-batch-bench.py --count 10000 --resources 500 --batch 1,10,50,100")
+    parser.add_option("-c",
+                      "--count",
+                      type="int",
+                      dest="count",
+                      default=5000,
+                      help="Number of alerts to save for each batch size (default: 5000)")
+    parser.add_option("-r",
+                      "--resources",
+                      type="int",
+                      dest="resources",
+                      default=200,
+                      help="Number of distinct resources (default: 200)")
+    parser.add_option("-b",
+                      "--batch",
+                      dest="batch",
+                      default="1,5,10,25,50,100",
+                      help="Comma-separated list of batch sizes (default: 1,5,10,25,50,100)")
+    parser.add_option("-d",
+                      "--database",
+                      dest="database",
+                      default="alerta_bench",
+                      help="Scratch database, dropped before each run (default: alerta_bench)")
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = imp.load_source('alerta_server', SERVER)
+    mongo = pymongo.Connection()
+
+    events = ['BenchUp', 'BenchDown', 'BenchFlap']
+
+    print "%10s %12s %12s" % ('batch', 'alerts/sec', 'ms/alert')
+    for size in [int(b) for b in options.batch.split(',')]:
+        mongo.drop_database(options.database)
+        server.db = mongo[options.database]
+        server.alerts = server.db.alerts
+        server.mgmt = server.db.status
+        server.ensure_indexes(server.db)
+        server.metrics = server.Metrics(server.mgmt)
+        server.index = server.AlertIndex(server.INDEX_SIZE)
+
+        random.seed(0)
+        prepared = [make_alert(options.resources, events) for i in range(options.count)]
+
+        start = time.time()
+        for i in range(0, len(prepared), size):
+            batch = prepared[i:i+size]
+            if len(batch) == 1:
+                server.save_alert(*batch[0])
+            else:
+                server.save_alerts(batch)
+        elapsed = time.time() - start
+
+        print "%10d %12.1f %12.3f" % (size, options.count / elapsed, elapsed * 1000 / options.count)
+
+    mongo.drop_database(options.database)
+
+if __name__ == '__main__':
+    main()
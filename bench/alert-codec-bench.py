@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+########################################
+#
+# alert-codec-bench.py - Alert decode/encode microbenchmarks
+#
+########################################
+
+import os
+import sys
+from optparse import OptionParser
+import timeit
+import datetime
+import uuid
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.alert import Alert
+from alerta.codec import dumps, loads
+from alerta.timestamp import format_date, parse_date, utc
+
+__version__ = '1.0.0'
+
+# The per-daemon JSON encoder that alerta.codec replaces
+class DateEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, (datetime.date, datetime.datetime)):
+            return obj.replace(microsecond=0).isoformat() + ".%03dZ" % (obj.microsecond//1000)
+        else:
+            return json.JSONEncoder.default(self, obj)
+
+def make_alert():
+
+    now = datetime.datetime.utcnow()
+
+    alert = dict()
+    alert['id']               = str(uuid.uuid4())
+    alert['resource']         = 'bench0001'
+    alert['event']            = 'BenchDown'
+    alert['group']            = 'Bench'
+    alert['value']            = '42'
+    alert['severity']         = 'MAJOR'
+    alert['severityCode']     = 2
+    alert['environment']      = ['BENCH']
+    alert['service']          = ['Bench']
+    alert['text']             = 'benchmark alert'
+    alert['type']             = 'exceptionAlert'
+    alert['tags']             = list()
+    alert['summary']          = 'BENCH - MAJOR BenchDown is 42 on Bench bench0001'
+    alert['createTime']       = now.replace(microsecond=0).isoformat() + ".%03dZ" % (now.microsecond//1000)
+    alert['origin']           = 'alert-codec-bench'
+    alert['thresholdInfo']    = 'n/a'
+    alert['timeout']          = 86400
+    alert['correlatedEvents'] = ['BenchUp', 'BenchDown']
+
+    return alert
+
+def old_parse(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=utc)
+
+def old_format(dt):
+    return dt.replace(microsecond=0).isoformat() + ".%03dZ" % (dt.microsecond//1000)
+
+def main():
+
+    parser = OptionParser(
+                      version="%prog " + __version__,
+                      description="Compare the shared alerta codec, timestamp and alert model against the code it replaced",
+                      epilog="alert-codec-bench.py --number 100000")
+    parser.add_option("-n",
+                      "--number",
+                      type="int",
+                      dest="number",
+                      default=20000,
+                      help="Number of calls to time for each case (default: 20000)")
+    parser.add_option("-r",
+                      "--repeat",
+                      type="int",
+                      dest="repeat",
+                      default=3,
+                      help="Best of this many runs is reported (default: 3)")
+    options, args = parser.parse_args()
+
+    alert = make_alert()
+    body = json.dumps(alert)
+    obj = Alert.from_dict(alert)
+    timestamp = alert['createTime']
+    now = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+    # An alert as forwarded by alerta.py, with its timestamps as datetimes
+    forwarded = dict(alert, createTime=now, receiveTime=now, lastReceiveTime=now, expireTime=now)
+
+    # unique timestamps defeat the parse cache so the uncached path is measured too
+    unique = [format_date(now + datetime.timedelta(milliseconds=i)) for i in range(options.number)]
+    uncached = iter(unique * (options.repeat + 1))
+
+    cases = [
+        ('decode',          lambda: json.loads(body),                          lambda: loads(body)),
+        ('encode',          lambda: json.dumps(alert, cls=DateEncoder),        lambda: dumps(alert)),
+        ('encode Alert',    lambda: json.dumps(alert, cls=DateEncoder),        lambda: dumps(obj)),
+        ('encode dates',    lambda: json.dumps(forwarded, cls=DateEncoder),    lambda: dumps(forwarded)),
+        ('parse_date',      lambda: old_parse(timestamp),                      lambda: parse_date(timestamp)),
+        ('parse_date new',  lambda: old_parse(timestamp),                      lambda: parse_date(uncached.next())),
+        ('format_date',     lambda: old_format(now),                           lambda: format_date(now)),
+        ('from_dict',       lambda: dict(alert),                               lambda: Alert.from_dict(alert)),
+    ]
+
+    print "%-16s %12s %12s %8s" % ('case', 'old us/op', 'new us/op', 'speedup')
+    for name, old, new in cases:
+        old_time = min(timeit.repeat(old, number=options.number, repeat=options.repeat)) / options.number * 1e6
+        new_time = min(timeit.repeat(new, number=options.number, repeat=options.repeat)) / options.number * 1e6
+        print "%-16s %12.2f %12.2f %7.1fx" % (name, old_time, new_time, old_time / new_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+########################################
+#
+# alert-counts-bench.py - Alert status bar count benchmark
+#
+########################################
+
+import os
+import sys
+from optparse import OptionParser
+import time
+import random
+import pymongo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.counts import STATUS_COUNTS, SEVERITY_COUNTS, find_counts, aggregate_counts
+from alerta.indexes import ensure_indexes
+from alerta.timestamp import utcnow
+
+__version__ = '1.0.0'
+
+ENVIRONMENTS = [ 'PROD', 'REL', 'QA', 'TEST', 'CODE', 'STAGE', 'DEV' ]
+
+# The query console.js sends for every status bar
+QUERY = { 'environment': 'PROD' }
+SORTBY = [('lastReceiveTime', -1)]
+HIDE_REPEATS = [ 'NORMAL' ]
+
+def load_alerts(alerts, count, rnd):
+
+    now = utcnow()
+    batch = list()
+    for i in range(count):
+        batch.append({
+            '_id': 'bench-%08d' % i,
+            'resource': 'bench%06d' % (i // 10),
+            'event': 'BenchEvent%d' % (i % 10),
+            'environment': [ rnd.choice(ENVIRONMENTS) ],
+            'service': [ 'Bench' ],
+            'severity': rnd.choice(SEVERITY_COUNTS),
+            'status': rnd.choice(STATUS_COUNTS),
+            'repeat': rnd.random() < 0.5,
+            'text': 'benchmark alert',
+            'summary': 'benchmark alert %d' % i,
+            'lastReceiveTime': now,
+        })
+        if len(batch) == 1000:
+            alerts.insert(batch)
+            batch = list()
+    if batch:
+        alerts.insert(batch)
+
+def main():
+
+    parser = OptionParser(
+                      version="%prog " + __version__,
+                      description="Compare counting alerts for a status bar by reading every alert against a MongoDB aggregation, at increasing numbers of alerts",
+                      epilog="alert-counts-bench.py --sizes 10000,100000,1000000")
+    parser.add_option("-s",
+                      "--sizes",
+                      dest="sizes",
+                      default="10000,100000,1000000",
+                      help="Comma separated numbers of alerts to measure (default: 10000,100000,1000000)")
+    parser.add_option("-r",
+                      "--repeat",
+                      type="int",
+                      dest="repeat",
+                      default=3,
+                      help="Best of this many runs is reported (default: 3)")
+    parser.add_option("-d",
+                      "--database",
+                      dest="database",
+                      default="alerta_bench",
+                      help="Scratch database, dropped before and after the run (default: alerta_bench)")
+    options, args = parser.parse_args()
+
+    mongo = pymongo.Connection()
+    rnd = random.Random(0)
+
+    print "%10s %12s %12s %8s" % ('alerts', 'find ms', 'aggregate ms', 'speedup')
+    for size in [int(s) for s in options.sizes.split(',')]:
+        mongo.drop_database(options.database)
+        db = mongo[options.database]
+        ensure_indexes(db)
+        load_alerts(db.alerts, size, rnd)
+
+        expected = find_counts(db.alerts, QUERY, SORTBY, 0, HIDE_REPEATS)
+        if aggregate_counts(db.alerts, QUERY, SORTBY, 0, HIDE_REPEATS) != expected:
+            print >>sys.stderr, 'ERROR: aggregated counts differ at %d alerts' % size
+            sys.exit(1)
+
+        timings = dict()
+        for name, count in [('find', find_counts), ('aggregate', aggregate_counts)]:
+            best = None
+            for i in range(options.repeat):
+                start = time.time()
+                count(db.alerts, QUERY, SORTBY, 0, HIDE_REPEATS)
+                elapsed = (time.time() - start) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        print "%10d %12.1f %12.1f %7.1fx" % (size, timings['find'], timings['aggregate'], timings['find'] / timings['aggregate'])
+
+    mongo.drop_database(options.database)
+
+if __name__ == '__main__':
+    main()
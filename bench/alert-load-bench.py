@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+########################################
+#
+# alert-load-bench.py - Alert server load generator and throughput benchmark
+#
+########################################
+
+import os
+import sys
+from optparse import OptionParser
+import time
+import random
+import imp
+import logging
+import threading
+from Queue import Queue
+import pymongo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.codec import dumps
+from alerta.timestamp import format_date, utcnow
+
+__version__ = '1.0.0'
+
+SERVER = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'bin', 'alerta.py')
+
+BRANCHES = [ 'new', 'duplicate', 'correlated' ]
+SEVERITIES = [ 'CRITICAL', 'MAJOR', 'MINOR', 'WARNING', 'NORMAL' ]
+OPCOUNTERS = [ 'insert', 'query', 'update', 'delete', 'getmore', 'command' ]
+
+# Stands in for the stomp connection so that only the alert server and MongoDB are measured.
+# Records when each message is acknowledged and counts forwarded alerts.
+class StubBroker(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acked = dict() # message-id -> time acknowledged
+        self.sent = 0
+        self.transactions = 0
+
+    def is_connected(self):
+        return True
+
+    def begin(self):
+        with self.lock:
+            self.transactions += 1
+            return str(self.transactions)
+
+    def commit(self, transaction=None):
+        pass
+
+    def abort(self, transaction=None):
+        pass
+
+    def send(self, body, headers, destination=None, transaction=None):
+        with self.lock:
+            self.sent += 1
+
+    def ack(self, headers):
+        self.acked[headers['message-id']] = time.time()
+
+# Generates alerts with a given mix of new, duplicate and correlated alerts spread over a
+# number of resources. Tracks the last severity of every alert so it knows what will be a
+# duplicate and what will correlate.
+class LoadGenerator(object):
+
+    def __init__(self, resources, mix, seed=0):
+        self.resources = resources
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.keys = list()
+        self.severity = dict()
+        self.count = 0
+
+    def choose_branch(self):
+        r = self.random.random()
+        for branch in BRANCHES:
+            r -= self.mix[branch]
+            if r < 0:
+                return branch
+        return BRANCHES[0]
+
+    def next(self, branch=None):
+        branch = branch or self.choose_branch()
+        self.count += 1
+
+        if branch == 'new' or not self.keys:
+            branch = 'new'
+            key = ('bench%06d' % self.random.randint(1, self.resources), 'BenchEvent%d' % self.count)
+            severity = self.random.choice(SEVERITIES)
+            self.keys.append(key)
+        else:
+            key = self.random.choice(self.keys)
+            severity = self.severity[key]
+            if branch == 'correlated':
+                severity = self.random.choice([s for s in SEVERITIES if s != severity])
+        self.severity[key] = severity
+
+        resource, event = key
+        alert = dict()
+        alert['id']               = 'bench-%08d' % self.count
+        alert['resource']         = resource
+        alert['event']            = event
+        alert['group']            = 'Bench'
+        alert['value']            = str(self.random.randint(0, 100))
+        alert['severity']         = severity
+        alert['severityCode']     = SEVERITIES.index(severity) + 1
+        alert['environment']      = ['BENCH']
+        alert['service']          = ['Bench']
+        alert['text']             = 'benchmark alert'
+        alert['type']             = 'exceptionAlert'
+        alert['tags']             = list()
+        alert['summary']          = 'BENCH - %s %s on %s' % (severity, event, resource)
+        alert['createTime']       = format_date(utcnow())
+        alert['origin']           = 'alert-load-bench'
+        alert['thresholdInfo']    = 'n/a'
+        alert['timeout']          = 86400
+        alert['correlatedEvents'] = [event]
+
+        return branch, alert
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+def opcounters(db):
+    counters = db.command('serverStatus')['opcounters']
+    return dict((op, counters.get(op, 0)) for op in OPCOUNTERS)
+
+# Feed messages to the handler, optionally at a fixed rate, recording when each was delivered
+def deliver(handler, messages, rate, delivered):
+
+    start = time.time()
+    for i, (msgid, body) in enumerate(messages):
+        if rate:
+            wait = start + float(i) / rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        delivered[msgid] = time.time()
+        handler.on_message({ 'message-id': msgid }, body)
+
+def main():
+
+    parser = OptionParser(
+                      version="%prog " + __version__,
+                      description="Drive the alerta server worker threads and message handler with synthetic alerts against a local MongoDB and a stub broker. Reports throughput, latency per branch and MongoDB operations per alert.",
+                      epilog="alert-load-bench.py --count 20000 --resources 1000 --mix new=0.1,duplicate=0.7,correlated=0.2 --batch 50")
+    parser.add_option("-c",
+                      "--count",
+                      type="int",
+                      dest="count",
+                      default=10000,
+                      help="Number of alerts to send (default: 10000)")
+    parser.add_option("-p",
+                      "--preload",
+                      type="int",
+                      dest="preload",
+                      default=1000,
+                      help="New alerts saved before measuring so duplicates and correlated alerts have something to match (default: 1000)")
+    parser.add_option("-r",
+                      "--resources",
+                      type="int",
+                      dest="resources",
+                      default=500,
+                      help="Number of distinct resources (default: 500)")
+    parser.add_option("-m",
+                      "--mix",
+                      dest="mix",
+                      default="new=0.1,duplicate=0.7,correlated=0.2",
+                      help="Fraction of new, duplicate and correlated alerts (default: new=0.1,duplicate=0.7,correlated=0.2)")
+    parser.add_option("-t",
+                      "--threads",
+                      type="int",
+                      dest="threads",
+                      default=4,
+                      help="Number of worker threads or greenlets (default: 4)")
+    parser.add_option("-g",
+                      "--greenlets",
+                      action="store_true",
+                      default=False,
+                      help="Run the workers as greenlets on a gevent event loop, as the server does with USE_GREENLETS, for comparison with threads")
+    parser.add_option("-b",
+                      "--batch",
+                      type="int",
+                      dest="batch",
+                      default=1,
+                      help="Maximum alerts saved together (default: 1)")
+    parser.add_option("-R",
+                      "--rate",
+                      type="float",
+                      dest="rate",
+                      default=0,
+                      help="Alerts per second to send, 0 to send as fast as the server accepts them (default: 0)")
+    parser.add_option("-d",
+                      "--database",
+                      dest="database",
+                      default="alerta_bench",
+                      help="Scratch database, dropped before and after the run (default: alerta_bench)")
+    parser.add_option("-o",
+                      "--output",
+                      dest="output",
+                      help="Append the results as a line of JSON to this file for comparison between releases")
+    options, args = parser.parse_args()
+
+    mix = dict((branch, 0.0) for branch in BRANCHES)
+    for item in options.mix.split(','):
+        branch, fraction = item.split('=')
+        if branch not in mix:
+            parser.error('unknown branch %s in --mix' % branch)
+        mix[branch] = float(fraction)
+    total = sum(mix.values())
+    for branch in mix:
+        mix[branch] /= total
+
+    # Patch before the server module, queues and connections are created
+    if options.greenlets:
+        from gevent import monkey
+        monkey.patch_all()
+
+    logging.basicConfig(level=logging.ERROR) # throttling warnings are expected when sending flat out
+
+    server = imp.load_source('alerta_server', SERVER)
+    if options.greenlets:
+        mongo = pymongo.Connection(use_greenlets=True, max_pool_size=options.threads)
+    else:
+        mongo = pymongo.Connection()
+    mongo.drop_database(options.database)
+    db = mongo[options.database]
+
+    broker = StubBroker()
+    server.db = db
+    server.alerts = db.alerts
+    server.mgmt = db.status
+    server.hb = db.heartbeats
+    server.conn = broker
+    server.ensure_indexes(db)
+    server.metrics = server.Metrics(server.mgmt)
+    server.alertconf = server.AlertConfig(os.devnull)
+    server.index = server.AlertIndex(server.INDEX_SIZE)
+    server.BATCH_SIZE = options.batch
+    server.NUM_THREADS = options.threads
+    server.publisher = server.start_publisher()
+    server.acks = Queue()
+
+    # Record the branch each alert took
+    branches = dict()
+    save_alert = server.save_alert
+    save_alerts = server.save_alerts
+
+    def tracked_save_alert(alert, createTime, receiveTime, expireTime, stages=None):
+        result = save_alert(alert, createTime, receiveTime, expireTime, stages)
+        branches[alert['id']] = result[0]
+        return result
+
+    def tracked_save_alerts(batch, stages=None):
+        results = save_alerts(batch, stages)
+        for (alert, createTime, receiveTime, expireTime), (branch, saved) in zip(batch, results):
+            branches[alert['id']] = branch
+        return results
+
+    server.save_alert = tracked_save_alert
+    server.save_alerts = tracked_save_alerts
+
+    workers = list()
+    for i in range(options.threads):
+        q = Queue(max(1, server.QUEUE_HIGH_WATER // options.threads))
+        w = server.WorkerThread(q, server.acks)
+        w.daemon = True
+        server.queues.append(q)
+        workers.append(w)
+    for w in workers:
+        w.start()
+    handler = server.MessageHandler()
+
+    generator = LoadGenerator(options.resources, mix)
+
+    def run(messages, rate):
+        delivered = dict()
+        sender = threading.Thread(target=deliver, args=(handler, messages, rate, delivered))
+        sender.daemon = True
+        sender.start()
+        while len(broker.acked) < len(messages) or sender.is_alive():
+            server.send_acks()
+            time.sleep(0.001)
+        return delivered
+
+    preload = list()
+    for i in range(options.preload):
+        branch, alert = generator.next('new')
+        preload.append((alert['id'], dumps(alert)))
+    run(preload, 0)
+    broker.acked.clear()
+    branches.clear()
+
+    messages = list()
+    for i in range(options.count):
+        branch, alert = generator.next()
+        messages.append((alert['id'], dumps(alert)))
+
+    before = opcounters(db)
+    start = time.time()
+    delivered = run(messages, options.rate)
+    elapsed = time.time() - start
+    after = opcounters(db)
+
+    for q in server.queues:
+        q.put(None)
+    for w in workers:
+        w.join()
+    server.publisher.stop()
+
+    ops = dict((op, after[op] - before[op]) for op in OPCOUNTERS)
+    ops['command'] = max(0, ops['command'] - 1) # the serverStatus used to read the counters
+
+    latency = dict((branch, list()) for branch in BRANCHES + ['all'])
+    for msgid, sent in delivered.items():
+        ms = (broker.acked[msgid] - sent) * 1000
+        latency['all'].append(ms)
+        if branches.get(msgid) in latency:
+            latency[branches[msgid]].append(ms)
+
+    results = dict()
+    results['version'] = server.__version__
+    results['options'] = { 'count': options.count, 'resources': options.resources, 'mix': mix, 'threads': options.threads, 'greenlets': options.greenlets, 'batch': options.batch, 'rate': options.rate }
+    results['throughput'] = options.count / elapsed
+    results['opsPerAlert'] = sum(ops.values()) / float(options.count)
+    results['ops'] = ops
+    results['latency'] = dict()
+
+    print "%d alerts in %.2fs: %.1f alerts/sec, %.2f mongo ops/alert (%s)" % (options.count, elapsed, results['throughput'], results['opsPerAlert'],
+        ', '.join('%s %.2f' % (op, ops[op] / float(options.count)) for op in OPCOUNTERS if ops[op]))
+    print "%-12s %8s %10s %10s %10s" % ('branch', 'alerts', 'p50 ms', 'p99 ms', 'max ms')
+    for branch in BRANCHES + ['all']:
+        values = sorted(latency[branch])
+        results['latency'][branch] = { 'count': len(values), 'p50': percentile(values, 50), 'p99': percentile(values, 99), 'max': values[-1] if values else 0.0 }
+        print "%-12s %8d %10.2f %10.2f %10.2f" % (branch, len(values), percentile(values, 50), percentile(values, 99), values[-1] if values else 0.0)
+
+    if options.output:
+        f = open(options.output, 'a')
+        f.write(dumps(results) + '\n')
+        f.close()
+
+    mongo.drop_database(options.database)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+########################################
+#
+# alert-rules-bench.py - Alert transform and blackout rule matching benchmark
+#
+########################################
+
+import os
+import sys
+from optparse import OptionParser
+import timeit
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.alert import Alert
+from alerta.rules import RuleIndex
+
+__version__ = '1.0.0'
+
+GROUPS = [ 'Bench', 'OS', 'Web', 'Deploys', 'Network' ]
+
+# Per-service and per-event rules with a catch-all at the end
+def make_rules(count, rnd):
+
+    rules = list()
+    for i in range(count):
+        if i % 2:
+            match = { 'service': [ 'Service%d' % i ] }
+        else:
+            match = { 'event': 'Event%d' % i, 'group': rnd.choice(GROUPS) }
+        rules.append({ 'match': match, 'suppress': i % 3 == 0 })
+    rules.append({ 'match': { 'group': 'Deploys' }, 'parser': 'DeploysServiceLookup' })
+    return rules
+
+def make_alert(count, rnd):
+
+    alert = dict()
+    alert['resource']    = 'bench0001'
+    alert['event']       = 'Event%d' % rnd.randint(0, count * 2)
+    alert['group']       = rnd.choice(GROUPS)
+    alert['environment'] = ['BENCH']
+    alert['service']     = ['Service%d' % rnd.randint(0, count * 2)]
+    alert['severity']    = 'MAJOR'
+    return Alert.from_dict(alert)
+
+# The linear scan RuleIndex replaces
+def linear_match(rules, alert):
+    for match, conf in rules:
+        if all(key in alert and alert[key] == value for key, value in match):
+            return conf
+    return None
+
+def main():
+
+    parser = OptionParser(
+                      version="%prog " + __version__,
+                      description="Compare the indexed rule matcher against a linear scan of the alert transform and blackout rules",
+                      epilog="alert-rules-bench.py --rules 10,100,1000,10000")
+    parser.add_option("-r",
+                      "--rules",
+                      dest="rules",
+                      default="10,100,1000,5000",
+                      help="Comma separated rule counts to measure (default: 10,100,1000,5000)")
+    parser.add_option("-n",
+                      "--number",
+                      type="int",
+                      dest="number",
+                      default=2000,
+                      help="Number of alerts matched for each case (default: 2000)")
+    options, args = parser.parse_args()
+
+    rnd = random.Random(0)
+
+    print "%8s %12s %12s %8s" % ('rules', 'linear us', 'index us', 'speedup')
+    for count in [int(c) for c in options.rules.split(',')]:
+        conf = make_rules(count, rnd)
+        linear = [(tuple(rule['match'].items()), rule) for rule in conf]
+        index = RuleIndex(conf)
+        alerts = [make_alert(count, rnd) for i in range(options.number)]
+
+        for alert in alerts:
+            if linear_match(linear, alert) is not index.match(alert):
+                print >>sys.stderr, 'ERROR: indexed match differs for %s' % alert.to_dict()
+                sys.exit(1)
+
+        linear_time = min(timeit.repeat(lambda: [linear_match(linear, alert) for alert in alerts], number=1, repeat=3)) / options.number * 1e6
+        index_time = min(timeit.repeat(lambda: [index.match(alert) for alert in alerts], number=1, repeat=3)) / options.number * 1e6
+        print "%8d %12.2f %12.2f %7.1fx" % (count, linear_time, index_time, linear_time / index_time)
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,12 @@ import logging
 import uuid
 import re
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.alert import Alert
+from alerta.severity import SEVERITY_CODE
+from alerta.codec import dumps
+from alerta.timestamp import format_date
+
 __program__ = 'alert-ganglia'
 __version__ = '1.8.9'
 
@@ -37,17 +43,6 @@ RULESFILE = '/opt/alerta/conf/alert-ganglia.yaml'
 LOGFILE = '/var/log/alerta/alert-ganglia.log'
 PIDFILE = '/var/run/alerta/alert-ganglia.pid'
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
-
 currentCount  = dict()
 currentState  = dict()
 previousSeverity = dict()
@@ -99,15 +94,15 @@ def send_heartbeat():
     headers['type']           = "heartbeat"
     headers['correlation-id'] = heartbeatid
 
-    heartbeat = dict()
+    heartbeat = Alert()
     heartbeat['id']         = heartbeatid
     heartbeat['type']       = "heartbeat"
-    heartbeat['createTime'] = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    heartbeat['createTime'] = format_date(createTime)
     heartbeat['origin']     = "%s/%s" % (__program__,os.uname()[1])
     heartbeat['version']    = __version__
 
     try:
-        conn.send(json.dumps(heartbeat), headers, destination=ALERT_QUEUE)
+        conn.send(dumps(heartbeat), headers, destination=ALERT_QUEUE)
         broker = conn.get_host_and_port()
         logging.info('%s : Heartbeat sent to %s:%s', heartbeatid, broker[0], str(broker[1]))
     except Exception, e:
@@ -386,7 +381,7 @@ def main():
                                 headers['correlation-id'] = alertid
 
                                 # standard alert info
-                                alert = dict()
+                                alert = Alert()
                                 alert['id']               = alertid
                                 alert['resource']         = resource
                                 alert['event']            = rule['event']
@@ -400,21 +395,21 @@ def main():
                                 alert['type']             = 'gangliaAlert'
                                 alert['tags']             = metric[resource]['tags']
                                 alert['summary']          = '%s - %s %s is %s on %s %s' % (','.join(metric[resource]['environment']), sev, rule['event'], alert['value'], ','.join(metric[resource]['service']), resource)
-                                alert['createTime']       = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+                                alert['createTime']       = format_date(createTime)
                                 alert['origin']           = "%s/%s" % (__program__, os.uname()[1])
                                 alert['thresholdInfo']    = ','.join(rule['thresholdInfo'])
                                 alert['timeout']          = 86400  # expire alerts after 1 day
                                 alert['moreInfo']         = metric[resource]['moreInfo']
                                 alert['graphs']           = metric[resource]['graphUrl']
 
-                                logging.info('%s : %s', alertid, json.dumps(alert))
+                                logging.info('%s : %s', alertid, dumps(alert))
 
                                 while not conn.is_connected():
                                     logging.warning('Waiting for message broker to become available')
                                     time.sleep(1.0)
 
                                 try:
-                                    conn.send(json.dumps(alert), headers, destination=ALERT_QUEUE)
+                                    conn.send(dumps(alert), headers, destination=ALERT_QUEUE)
                                     broker = conn.get_host_and_port()
                                     logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
                                 except Exception, e:
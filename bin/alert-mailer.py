@@ -27,6 +27,10 @@ import pytz
 import logging
 import uuid
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.codec import dumps
+from alerta.timestamp import parse_date
+
 __version__ = '1.0.8'
 
 BROKER_LIST  = [('localhost', 61613)] # list of brokers for failover
@@ -83,8 +87,7 @@ class MessageHandler(object):
             return
 
         # Convert createTime to local time (set TIMEZONE above)
-        createTime = datetime.datetime.strptime(alert['createTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-        createTime = createTime.replace(tzinfo=pytz.utc)
+        createTime = parse_date(alert['createTime'])
         tz = pytz.timezone(TIMEZONE)
         localTime = createTime.astimezone(tz)
    
@@ -113,7 +116,7 @@ class MessageHandler(object):
             for g in alert['graphs']:
                 text += '%s\n' % (g)
         text += 'Raw Alert\n'
-        text += '%s\n' % (json.dumps(alert))
+        text += '%s\n' % (dumps(alert))
         text += 'Generated by %s on %s at %s\n' % ('alert-mailer.py', os.uname()[1], datetime.datetime.now().strftime("%a %d %b %H:%M:%S"))
 
         logging.debug('Raw Text: %s', text)
@@ -151,7 +154,7 @@ class MessageHandler(object):
                 graph_cid[g] = str(uuid.uuid4())
                 html += '<tr><td><img src="cid:'+graph_cid[g]+'"></td></tr>\n'
         html += '<tr><td><p align="left" style="font-size:18px;line-height:22px;color:#c25130;font-weight:bold;">Raw Alert</p>\n'
-        html += '<tr><td><p align="left" style="font-family: \'Courier New\', Courier, monospace">%s</p></td></tr>\n' % (json.dumps(alert))
+        html += '<tr><td><p align="left" style="font-family: \'Courier New\', Courier, monospace">%s</p></td></tr>\n' % (dumps(alert))
         html += '<tr><td>Generated by %s on %s at %s</td></tr>\n' % ('alert-mailer.py', os.uname()[1], datetime.datetime.now().strftime("%a %d %b %H:%M:%S"))
         html += '</table>'
         html += '</td></tr></table>'
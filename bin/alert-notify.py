@@ -26,6 +26,9 @@ import datetime
 import pytz
 import uuid
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.timestamp import parse_date
+
 __version__ = '1.0.2'
 
 BROKER_LIST  = [('localhost', 61613)] # list of brokers for failover
@@ -112,8 +115,7 @@ def email_notify(alertid, email):
 
     MAILING_LIST = email
 
-    createTime = datetime.datetime.strptime(alert[alertid]['createTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-    createTime = createTime.replace(tzinfo=pytz.utc)
+    createTime = parse_date(alert[alertid]['createTime'])
     tz = pytz.timezone(TIMEZONE)
     localTime = createTime.astimezone(tz)
    
@@ -20,6 +20,13 @@ import logging
 import uuid
 import re
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.plugins import ParserLoader
+from alerta.alert import Alert
+from alerta.severity import SEVERITY_CODE
+from alerta.codec import dumps
+from alerta.timestamp import format_date
+
 __program__ = 'alert-snmptrap'
 __version__ = '1.2.5'
 
@@ -34,16 +41,7 @@ DISABLE = '/opt/alerta/conf/alert-snmptrap.disable'
 TRAPCONF = '/opt/alerta/conf/alert-snmptrap.yaml'
 PARSERDIR = '/opt/alerta/bin/parsers'
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
+parsers = ParserLoader(PARSERDIR)
 
 def main():
 
@@ -145,12 +143,26 @@ def main():
         if re.match(t['trapoid'], trapoid):
             if 'parser' in t:
                 print 'Loading parser %s' % t['parser']
+                scope = locals().copy()
                 try:
-                    exec(open('%s/%s.py' % (PARSERDIR, t['parser'])))
+                    parsers.run(t['parser'], globals(), scope)
                     logging.info('Parser %s/%s exec OK', PARSERDIR, t['parser'])
                 except Exception, e:
                     print 'Parser %s failed: %s' % (t['parser'], e)
                     logging.warning('Parser %s failed', t['parser'])
+                event       = scope['event']
+                resource    = scope['resource']
+                severity    = scope['severity']
+                group       = scope['group']
+                value       = scope['value']
+                text        = scope['text']
+                environment = scope['environment']
+                service     = scope['service']
+                tags        = scope['tags']
+                correlate   = scope['correlate']
+                threshold   = scope['threshold']
+                suppress    = scope['suppress']
+                logging.debug('Parser %s stats: %s', t['parser'], parsers.stats.get(t['parser']))
             if 'event' in t:
                 event = t['event']
             if 'resource' in t:
@@ -203,7 +215,7 @@ def main():
     headers['type']           = "snmptrapAlert"
     headers['correlation-id'] = alertid
 
-    alert = dict()
+    alert = Alert()
     alert['id']               = alertid
     alert['resource']         = resource
     alert['event']            = event
@@ -217,13 +229,13 @@ def main():
     alert['type']             = 'snmptrapAlert'
     alert['tags']             = tags
     alert['summary']          = '%s - %s %s is %s on %s %s' % (','.join(environment), severity.upper(), event, value, ','.join(service), resource)
-    alert['createTime']       = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    alert['createTime']       = format_date(createTime)
     alert['origin']           = "%s/%s" % (__program__, os.uname()[1])
     alert['thresholdInfo']    = threshold
     alert['timeout']          = DEFAULT_TIMEOUT
     alert['correlatedEvents'] = correlate
 
-    logging.info('%s : %s', alertid, json.dumps(alert))
+    logging.info('%s : %s', alertid, dumps(alert))
 
     try:
         conn = stomp.Connection(BROKER_LIST)
@@ -235,7 +247,7 @@ def main():
         sys.exit(1)
 
     try:
-        conn.send(json.dumps(alert), headers, destination=ALERT_QUEUE)
+        conn.send(dumps(alert), headers, destination=ALERT_QUEUE)
         broker = conn.get_host_and_port()
         logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
     except Exception, e:
@@ -7,10 +7,6 @@
 
 import os
 import sys
-try:
-    import json
-except ImportError:
-    import simplejson as json
 import yaml
 import stomp
 import time
@@ -22,6 +18,13 @@ import uuid
 import re
 import fnmatch
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.plugins import ParserLoader
+from alerta.alert import Alert
+from alerta.severity import SEVERITY_CODE
+from alerta.codec import dumps
+from alerta.timestamp import format_date
+
 __program__ = 'alert-syslog'
 __version__ = '1.1.7'
 
@@ -37,17 +40,6 @@ DISABLE = '/opt/alerta/conf/alert-syslog.disable'
 SYSLOGCONF = '/opt/alerta/conf/alert-syslog.yaml'
 PARSERDIR = '/opt/alerta/bin/parsers'
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
-
 SYSLOG_FACILITY_NAMES = [
     "kern",
     "user",
@@ -100,6 +92,8 @@ SYSLOG_SEVERITY_MAP = {
 SYSLOG_UDP_PORT             = 514
 SYSLOG_TCP_PORT             = 514
 
+parsers = ParserLoader(PARSERDIR)
+
 def send_syslog(data):
     global conn
 
@@ -165,11 +159,25 @@ def send_syslog(data):
         if fnmatch.fnmatch('%s.%s' % (facility, level), s['priority']):
             if 'parser' in s:
                 logging.debug('Loading parser %s', s['parser'])
+                scope = locals().copy()
                 try:
-                    exec(open('%s/%s.py' % (PARSERDIR, s['parser'])))
+                    parsers.run(s['parser'], globals(), scope)
                     logging.info('Parser %s/%s exec OK', PARSERDIR, s['parser'])
                 except Exception, e:
                     logging.warning('Parser %s failed: %s', s['parser'], e)
+                event       = scope['event']
+                resource    = scope['resource']
+                severity    = scope['severity']
+                group       = scope['group']
+                value       = scope['value']
+                text        = scope['text']
+                environment = scope['environment']
+                service     = scope['service']
+                tags        = scope['tags']
+                correlate   = scope['correlate']
+                threshold   = scope['threshold']
+                suppress    = scope['suppress']
+                logging.debug('Parser %s stats: %s', s['parser'], parsers.stats.get(s['parser']))
             if 'event' in s:
                 event = s['event']
             if 'resource' in s:
@@ -207,7 +215,7 @@ def send_syslog(data):
     headers['type']           = "syslogAlert"
     headers['correlation-id'] = alertid
 
-    alert = dict()
+    alert = Alert()
     alert['id']               = alertid
     alert['resource']         = resource
     alert['event']            = event
@@ -221,20 +229,20 @@ def send_syslog(data):
     alert['type']             = 'syslogAlert'
     alert['tags']             = tags
     alert['summary']          = '%s - %s %s is %s on %s %s' % (','.join(environment), severity.upper(), event, value, ','.join(service), resource)
-    alert['createTime']       = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    alert['createTime']       = format_date(createTime)
     alert['origin']           = "%s/%s" % (__program__, os.uname()[1])
     alert['thresholdInfo']    = threshold
     alert['timeout']          = DEFAULT_TIMEOUT
     alert['correlatedEvents'] = correlate
 
-    logging.info('%s : %s', alertid, json.dumps(alert))
+    logging.info('%s : %s', alertid, dumps(alert))
 
     while not conn.is_connected():
         logging.warning('Waiting for message broker to become available')
         time.sleep(1.0)
 
     try:
-        conn.send(json.dumps(alert), headers, destination=ALERT_QUEUE)
+        conn.send(dumps(alert), headers, destination=ALERT_QUEUE)
         broker = conn.get_host_and_port()
         logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
     except Exception, e:
@@ -267,15 +275,15 @@ def send_heartbeat():
     # headers['persistent']     = 'false'
     # headers['expires']        = int(time.time() * 1000) + EXPIRATION_TIME * 1000
 
-    heartbeat = dict()
+    heartbeat = Alert()
     heartbeat['id']         = heartbeatid
     heartbeat['type']       = "heartbeat"
-    heartbeat['createTime'] = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    heartbeat['createTime'] = format_date(createTime)
     heartbeat['origin']     = "%s/%s" % (__program__,os.uname()[1])
     heartbeat['version']    = __version__
 
     try:
-        conn.send(json.dumps(heartbeat), headers, destination=ALERT_QUEUE)
+        conn.send(dumps(heartbeat), headers, destination=ALERT_QUEUE)
         broker = conn.get_host_and_port()
         logging.info('%s : Heartbeat sent to %s:%s', heartbeatid, broker[0], str(broker[1]))
     except Exception, e:
@@ -22,6 +22,12 @@ import logging
 import uuid
 import re
 from BaseHTTPServer import BaseHTTPRequestHandler as BHRH
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.alert import Alert
+from alerta.severity import SEVERITY_CODE
+from alerta.codec import dumps
+from alerta.timestamp import format_date
 HTTP_RESPONSES = dict([(k, v[0]) for k, v in BHRH.responses.items()])
 
 __program__ = 'alert-urlmon'
@@ -64,17 +70,6 @@ HTTP_RESPONSES[506] = 'Variant Also Negotiates'
 HTTP_RESPONSES[507] = 'Insufficient Storage'
 HTTP_RESPONSES[510] = 'Not Extended'
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
-
 _check_rate   = 60             # Check rate of alerts
 
 # Global variables
@@ -320,7 +315,7 @@ class WorkerThread(threading.Thread):
                 headers['correlation-id'] = alertid
 
                 # standard alert info
-                alert = dict()
+                alert = Alert()
                 alert['id']               = alertid
                 alert['resource']         = item['resource']
                 alert['event']            = event
@@ -334,20 +329,20 @@ class WorkerThread(threading.Thread):
                 alert['type']             = 'serviceAlert'
                 alert['tags']             = item.get('tags', list())
                 alert['summary']          = '%s - %s %s is %s on %s %s' % (','.join(item['environment']), severity, event, value, ','.join(item['service']), item['resource'])
-                alert['createTime']       = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+                alert['createTime']       = format_date(createTime)
                 alert['origin']           = "%s/%s" % (__program__, os.uname()[1])
                 alert['thresholdInfo']    = "%s : RT > %d RT > %d x %s" % (item['url'], warn_thold, crit_thold, item.get('count', 1))
                 alert['timeout']          = DEFAULT_TIMEOUT
                 alert['correlatedEvents'] = HTTP_ALERTS
 
-                logging.info('%s : %s', alertid, json.dumps(alert))
+                logging.info('%s : %s', alertid, dumps(alert))
 
                 while not conn.is_connected():
                     logging.warning('Waiting for message broker to become available')
                     time.sleep(1.0)
 
                 try:
-                    conn.send(json.dumps(alert), headers, destination=ALERT_QUEUE)
+                    conn.send(dumps(alert), headers, destination=ALERT_QUEUE)
                     broker = conn.get_host_and_port()
                     logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
                 except Exception, e:
@@ -387,15 +382,15 @@ def send_heartbeat():
     # headers['persistent']     = 'false'
     # headers['expires']        = int(time.time() * 1000) + EXPIRATION_TIME * 1000
 
-    heartbeat = dict()
+    heartbeat = Alert()
     heartbeat['id']         = heartbeatid
     heartbeat['type']       = "heartbeat"
-    heartbeat['createTime'] = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    heartbeat['createTime'] = format_date(createTime)
     heartbeat['origin']     = "%s/%s" % (__program__, os.uname()[1])
     heartbeat['version']    = __version__
 
     try:
-        conn.send(json.dumps(heartbeat), headers, destination=ALERT_QUEUE)
+        conn.send(dumps(heartbeat), headers, destination=ALERT_QUEUE)
         broker = conn.get_host_and_port()
         logging.info('%s : Heartbeat sent to %s:%s', heartbeatid, broker[0], str(broker[1]))
     except Exception, e:
@@ -8,20 +8,31 @@
 import os
 import sys
 import time
-try:
-    import json
-except ImportError:
-    import simplejson as json
 import yaml
 import threading
-from Queue import Queue
+import multiprocessing
+import signal
+import zlib
+from Queue import Queue, Empty
+from collections import OrderedDict
 import stomp
 import pymongo
 import datetime
-import pytz
 import logging
 import re
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.plugins import ParserLoader
+from alerta.metrics import Metrics
+from alerta.publisher import Publisher
+from alerta.codec import dumps, loads
+from alerta.timestamp import format_date, parse_date, utcnow
+from alerta.indexes import ensure_indexes
+from alerta.history import history_docs, push_history, record_history
+from alerta.heartbeats import Heartbeats
+from alerta.spool import Spool
+from alerta.rules import RuleIndex
+
 __program__ = 'alerta'
 __version__ = '1.6.0'
 
@@ -38,359 +49,923 @@ PIDFILE = '/var/run/alerta/alerta.pid'
 ALERTCONF = '/opt/alerta/conf/alerta.yaml'
 PARSERDIR = '/opt/alerta/bin/parsers'
 
+CONF_CHECK_INTERVAL = 5 # seconds between checks for changes to ALERTCONF
+
 NUM_THREADS = 4
+USE_PROCESSES = False # run workers as separate processes to use more than one CPU
+USE_GREENLETS = False # run workers as greenlets on one gevent event loop, requires gevent
+NUM_GREENLETS = 200 # alerts processed concurrently when using greenlets
+STATS_INTERVAL = 10 # seconds between writes of management stats and server heartbeat
+HEARTBEAT_INTERVAL = 5 # seconds between writes of received heartbeats
+HEARTBEAT_TIMEOUT = 300 # seconds without a heartbeat before an origin is logged as late
+MAX_RETRIES = 3 # attempts to save an alert if it is changed by another writer or the database fails
+RETRY_WAIT = 1 # seconds to wait before saving an alert again after a database error
+BATCH_SIZE = 1 # maximum alerts saved together with bulk writes (1 = no batching)
+BATCH_WAIT = 0.05 # seconds to wait for a batch to fill
+QUEUE_HIGH_WATER = 1000 # stop taking alerts from the broker when this many are waiting to be processed
+PREFETCH_SIZE = 1000 # maximum unacknowledged alerts the broker will deliver
+EXPIRE_INTERVAL = 30 # seconds between checks for OPEN alerts past their expireTime
+EXPIRE_BATCH = 1000 # maximum alerts expired with a single update
+INDEX_SIZE = 50000 # resources kept in the in-memory alert index
+HISTORY_SIZE = 10 # most recent history entries kept on the alert document, older entries are only in the history collection
+HISTORY_TTL = 30 * 24 * 60 * 60 # seconds to keep alert history
+LATENCY_BUDGET = 1000 # log alerts that take longer than this many milliseconds to process (0 = never)
+SPOOL_DIR = '/var/spool/alerta' # journal of accepted alerts replayed at startup (None = acknowledge alerts only after processing)
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024 # bytes written to a spool segment before starting a new one
+SPOOL_SYNC_WAIT = 0.002 # seconds to wait for more alerts so one fsync covers them all
+INDEX_FIELDS = { "environment": 1, "resource": 1, "event": 1, "severity": 1, "status": 1, "correlatedEvents": 1 }
+
+# Stages of alert processing timed for every alert
+STAGES = [
+    ('decode',    'Time taken to decode the alert from JSON'),
+    ('queue',     'Time the alert waited in the worker queue'),
+    ('transform', 'Time taken to apply alert transforms, blackout rules and parsers'),
+    ('classify',  'Time taken to find the existing alert and plan the write'),
+    ('persist',   'Time taken to write the alert and its history to MongoDB'),
+    ('publish',   'Time taken to hand the alert to the publisher'),
+    ('stats',     'Time taken to record management stats'),
+]
 
 # Global variables
 conn = None
 db = None
 alerts = None
 mgmt = None
-queue = Queue()
+metrics = None
+queues = list()
+acks = None
+alertconf = None
+index = None
+publisher = None
+heartbeats = None
+spool = None
+parsers = None
+
+# Alert transforms and blackout rules are loaded once and shared by all worker threads. The
+# rule index is replaced as a whole when ALERTCONF changes so readers never see a partial update.
+class AlertConfig(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rules = RuleIndex(None)
+        self.mtime = None
+        self.checked = 0
+        self.reloads = 0
+        self.lock = threading.Lock()
+
+    def compile(self, conf):
+        return RuleIndex(conf)
+
+    def check(self):
+        now = time.time()
+        if now - self.checked < CONF_CHECK_INTERVAL:
+            return False
+
+        with self.lock:
+            if now - self.checked < CONF_CHECK_INTERVAL:
+                return False
+            self.checked = now
+
+            try:
+                mtime = os.stat(self.filename).st_mtime
+            except OSError, e:
+                logging.warning('Failed to stat alert transforms and blackout rules: %s', e)
+                return False
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime
 
-# Extend JSON Encoder to support ISO 8601 format dates
-class DateEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime.date, datetime.datetime)):
-            return obj.replace(microsecond=0).isoformat() + ".%03dZ" % (obj.microsecond//1000)
+            try:
+                rules = self.compile(yaml.load(open(self.filename)))
+            except Exception, e:
+                logging.warning('Failed to load alert transforms and blackout rules, keeping %d existing: %s', len(self.rules), e)
+                return False
+
+            self.rules = rules
+            self.reloads += 1
+            logging.info('Loaded %d alert transforms and blackout rules OK', len(rules))
+            return True
+
+    def match(self, alert):
+        return self.rules.match(alert)
+
+# Summary of every alert for an environment and resource, enough to classify new alerts without
+# reading the database. Whole environment/resource buckets are cached so a miss inside a cached
+# bucket means the alert is new. Buckets are kept in least recently used order and evicted once
+# there are more than INDEX_SIZE of them. Only the worker that owns a bucket writes its alerts
+# and writes are guarded, so if another writer (eg. the API) changes an alert the bucket is
+# dropped and read again.
+class AlertIndex(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            docs = self.buckets.pop(key, None)
+            if docs is not None:
+                self.buckets[key] = docs
+            return docs
+
+    def put(self, key, docs):
+        docs = [index_summary(doc) for doc in docs]
+        with self.lock:
+            self.buckets.pop(key, None)
+            self.buckets[key] = docs
+            while len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        return docs
+
+    def invalidate(self, key):
+        with self.lock:
+            self.buckets.pop(key, None)
+
+    def warm(self, owns=None):
+        buckets = dict()
+        for doc in alerts.find({}, INDEX_FIELDS):
+            key = index_key(doc)
+            if owns and not owns(key):
+                continue
+            if key not in buckets and len(buckets) >= self.size:
+                continue
+            buckets.setdefault(key, list()).append(doc)
+        for key, docs in buckets.items():
+            self.put(key, docs)
+        logging.info('Alert index warmed with %d resources', len(buckets))
+
+def correlated_status(severity, previousSeverity):
+    if severity in ['DEBUG','INFORM']:
+        return 'OPEN'
+    elif severity == 'NORMAL':
+        return 'CLOSED'
+    elif severity == 'WARNING':
+        if previousSeverity in ['NORMAL']:
+            return 'OPEN'
+    elif severity == 'MINOR':
+        if previousSeverity in ['NORMAL','WARNING']:
+            return 'OPEN'
+    elif severity == 'MAJOR':
+        if previousSeverity in ['NORMAL','WARNING','MINOR']:
+            return 'OPEN'
+    elif severity == 'CRITICAL':
+        if previousSeverity in ['NORMAL','WARNING','MINOR','MAJOR']:
+            return 'OPEN'
+    else:
+        return 'UNKNOWN'
+    return None
+
+# Add the milliseconds since start to a stage of the latency breakdown and return the time now
+def stage_time(stages, stage, start):
+    now = time.time()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0) + (now - start) * 1000
+    return now
+
+def index_key(alert):
+    return (tuple(alert['environment']), alert['resource'])
+
+def index_summary(doc):
+    summary = dict((field, doc[field]) for field in INDEX_FIELDS if field in doc)
+    summary['_id'] = doc['_id']
+    return summary
+
+# Get the alerts for each environment and resource from the index, reading any that are not
+# cached from the database in a single query
+def load_buckets(keys):
+
+    buckets = dict()
+    missing = list()
+    for key in set(keys):
+        docs = index.get(key)
+        if docs is None:
+            missing.append(key)
+            buckets[key] = list()
+        else:
+            buckets[key] = docs
+
+    metrics.counter("alerts", "index_hit", "Alert index hits", "Alerts classified without a database read", len(keys) - len(missing))
+    if missing:
+        metrics.counter("alerts", "index_miss", "Alert index misses", "Alerts classified with a database read", len(missing))
+        query = {'$or': [{"environment": list(environment), "resource": resource} for environment, resource in missing]}
+        for doc in alerts.find(query, INDEX_FIELDS):
+            key = index_key(doc)
+            if key in buckets:
+                buckets[key].append(doc)
+        for key in missing:
+            buckets[key] = index.put(key, buckets[key])
+
+    return buckets
+
+# Pick the alert that a new alert is a duplicate of or else the first one it correlates with
+def find_existing(alert, docs):
+
+    existing = None
+    for doc in docs:
+        if doc['environment'] != alert['environment'] or doc['resource'] != alert['resource']:
+            continue
+        if doc['event'] == alert['event'] and doc['severity'] == alert['severity']:
+            return doc
+        if not existing and (doc['event'] == alert['event'] or alert['event'] in doc.get('correlatedEvents', list())):
+            existing = doc
+    return existing
+
+# Apply an update to a copy of the document it is written to (history is not kept locally)
+def apply_update(doc, update):
+
+    doc = dict(doc)
+    doc.update(update.get('$set', dict()))
+    for field, inc in update.get('$inc', dict()).items():
+        doc[field] = doc.get(field, 0) + inc
+    return doc
+
+# Decide whether an alert is new, a duplicate or correlated with an existing alert and build
+# the single write that applies the change, status transition and recent history. Writes to
+# existing alerts are guarded on the severity and status that were read. Returns the branch
+# taken, the write as ('insert', doc), ('update', query, update) or ('modify', query, update) if
+# the saved document is needed for forwarding, the resulting document and the documents to add
+# to the history collection once the write succeeds.
+def plan_alert(alert, createTime, receiveTime, expireTime, existing):
+
+    alertid = alert['id']
+    modifyTime = utcnow() # every write sets modifyTime so clients can poll for changes
+
+    if existing and existing['event'] == alert['event'] and existing['severity'] == alert['severity']:
+        logging.info('%s : Duplicate alert -> update dup count', alertid)
+        # Duplicate alert .. 1. update existing document with lastReceiveTime, lastReceiveId, text, summary, value, tags and origin
+        #                    2. increment duplicate count
+        #                    3. re-open or close if not OPEN, ACK or CLOSED and push history
+
+        update = { '$set': { "lastReceiveTime": receiveTime, "expireTime": expireTime,
+                             "lastReceiveId": alertid, "text": alert['text'], "summary": alert['summary'], "value": alert['value'],
+                             "tags": alert['tags'], "repeat": True, "origin": alert['origin'], "modifyTime": modifyTime },
+                   '$inc': { "duplicateCount": 1 }}
+
+        if existing['status'] not in ['OPEN','ACK','CLOSED']:
+            if alert['severity'] != 'NORMAL':
+                status = 'OPEN'
+            else:
+                status = 'CLOSED'
+            updateTime = utcnow()
+            update['$set']['status'] = status
+            history = [{ "status": status, "updateTime": updateTime }]
+            push_history(update, history, HISTORY_SIZE)
+            logging.info('%s : Alert status for duplicate %s %s alert changed to %s', alertid, alert['severity'], alert['event'], status)
+        else:
+            history = list()
+            logging.info('%s : Alert status for duplicate %s %s alert unchanged because either OPEN, ACK or CLOSED', alertid, alert['severity'], alert['event'])
+
+        query = { "_id": existing['_id'], "severity": existing['severity'], "status": existing['status'] }
+        return 'duplicate', ('update', query, update), apply_update(existing, update), history_docs(existing['_id'], history)
+
+    elif existing:
+        previousSeverity = existing['severity']
+        logging.info('%s : Event and/or severity change %s %s -> %s update details', alertid, alert['event'], previousSeverity, alert['severity'])
+        # Diff sev alert ... 1. update existing document with severity, createTime, receiveTime, lastReceiveTime, previousSeverity,
+        #                        severityCode, lastReceiveId, text, summary, value, tags and origin
+        #                    2. set duplicate count to zero
+        #                    3. push history and any status change
+
+        history = [{ "createTime": createTime, "receiveTime": receiveTime, "severity": alert['severity'], "event": alert['event'],
+                     "severityCode": alert['severityCode'], "value": alert['value'], "text": alert['text'], "id": alertid }]
+        update = { '$set': { "event": alert['event'], "severity": alert['severity'], "severityCode": alert['severityCode'],
+                             "createTime": createTime, "receiveTime": receiveTime, "lastReceiveTime": receiveTime, "expireTime": expireTime,
+                             "previousSeverity": previousSeverity, "lastReceiveId": alertid, "text": alert['text'], "summary": alert['summary'], "value": alert['value'],
+                             "tags": alert['tags'], "repeat": False, "origin": alert['origin'], "thresholdInfo": alert['thresholdInfo'], "duplicateCount": 0,
+                             "modifyTime": modifyTime }}
+
+        status = correlated_status(alert['severity'], previousSeverity)
+        if status:
+            updateTime = utcnow()
+            update['$set']['status'] = status
+            history.append({ "status": status, "updateTime": updateTime })
+            logging.info('%s : Alert status for %s %s alert with diff event/severity changed to %s', alertid, alert['severity'], alert['event'], status)
+        push_history(update, history, HISTORY_SIZE)
+
+        query = { "_id": existing['_id'], "severity": previousSeverity, "status": existing['status'] }
+        return 'correlated', ('modify', query, update), apply_update(existing, update), history_docs(existing['_id'], history)
+
+    else:
+        logging.info('%s : New alert -> insert', alertid)
+        # New alert so ... 1. insert entire document with history, status and duplicate count of zero
+
+        if alert['severity'] != 'NORMAL':
+            status = 'OPEN'
+        else:
+            status = 'CLOSED'
+        updateTime = utcnow()
+
+        # Use alert id as object id
+        doc = dict(alert)
+        del doc['id']
+        doc['_id']              = alertid
+        doc['lastReceiveId']    = alertid
+        doc['createTime']       = createTime
+        doc['receiveTime']      = receiveTime
+        doc['lastReceiveTime']  = receiveTime
+        doc['expireTime']       = expireTime
+        doc['previousSeverity'] = 'UNKNOWN'
+        doc['repeat']           = False
+        doc['duplicateCount']   = 0
+        doc['status']           = status
+        doc['modifyTime']       = modifyTime
+        doc['history'] = [{ "createTime": createTime, "receiveTime": receiveTime, "severity": alert['severity'], "event": alert['event'],
+                            "severityCode": alert['severityCode'], "value": alert['value'], "text": alert['text'], "id": alertid },
+                          { "status": status, "updateTime": updateTime }]
+        logging.info('%s : Alert status for new %s %s alert set to %s', alertid, alert['severity'], alert['event'], status)
+
+        saved = dict(doc)
+        del saved['history']
+        return 'new', ('insert', doc), saved, history_docs(alertid, doc['history'])
+
+# Convert a saved document into the alert that is forwarded, using object id as canonical alert id
+def forward_doc(doc):
+
+    alert = dict(doc)
+    alert['id'] = alert['_id']
+    del alert['_id']
+    return alert
+
+# Save an alert with one write, classifying it against the alert index. The write is retried
+# with the alerts read from the database if another writer changed the alert in between.
+# Returns the branch taken and the alert to forward (None for duplicates). Time spent is added
+# to the classify and persist stages if given.
+def save_alert(alert, createTime, receiveTime, expireTime, stages=None):
+
+    key = index_key(alert)
+    for attempt in range(MAX_RETRIES):
+        start = time.time()
+        if attempt:
+            index.invalidate(key)
+        docs = load_buckets([key])[key]
+
+        existing = find_existing(alert, docs)
+        branch, op, doc, history = plan_alert(alert, createTime, receiveTime, expireTime, existing)
+        start = stage_time(stages, 'classify', start)
+
+        if op[0] == 'insert':
+            alerts.insert(op[1], safe=True)
+        elif op[0] == 'update':
+            if not alerts.update(op[1], op[2], safe=True)['updatedExisting']:
+                logging.info('%s : Alert %s changed by another writer, retrying', alert['id'], op[1]['_id'])
+                stage_time(stages, 'persist', start)
+                continue
+        else:
+            # FIXME - no native find_and_modify method in this version of pymongo
+            no_obj_error = "No matching object found"
+            saved = db.command("findAndModify", 'alerts',
+                allowable_errors=[no_obj_error],
+                query=op[1],
+                update=op[2],
+                new=True,
+                fields={ "history": 0 })['value']
+            if not saved:
+                logging.info('%s : Alert %s changed by another writer, retrying', alert['id'], op[1]['_id'])
+                stage_time(stages, 'persist', start)
+                continue
+            doc = saved
+        record_history(db.history, history)
+        stage_time(stages, 'persist', start)
+
+        if existing:
+            docs[docs.index(existing)] = index_summary(doc)
+        else:
+            docs.append(index_summary(doc))
+
+        if branch == 'duplicate':
+            return branch, None
+        return branch, forward_doc(doc)
+
+    index.invalidate(key)
+    logging.error('%s : Failed to save alert after %d attempts', alert['id'], MAX_RETRIES)
+    return None, None
+
+# Work out which writes of an ordered bulk write were applied when some updates did not match.
+# Every write sets lastReceiveId, so the writes to an alert up to the one whose alert id it was
+# left with were applied and the writes after it were not.
+def applied_writes(ops, alertids):
+
+    writes = dict()
+    for i, op in enumerate(ops):
+        writes.setdefault(op[1]['_id'], list()).append(i)
+
+    updated = [op[1]['_id'] for op in ops if op[0] != 'insert']
+    lastReceiveIds = dict((doc['_id'], doc.get('lastReceiveId')) for doc in alerts.find({"_id": {'$in': updated}}, {"lastReceiveId": 1}))
+
+    applied = [True] * len(ops)
+    for _id, positions in writes.items():
+        last = -1 # none applied, eg. if the alert was deleted
+        for n, i in enumerate(positions):
+            if alertids[i] == lastReceiveIds.get(_id):
+                last = n
+        for i in positions[last + 1:]:
+            if ops[i][0] != 'insert':
+                applied[i] = False
+    return applied
+
+# Save a batch of alerts, classifying them against the alert index and applying them with bulk
+# writes. Alerts are planned in order against the alerts as left by earlier alerts in the same
+# batch so several alerts for the same resource are handled exactly as if they arrived one at a
+# time. If another writer changed an alert while the batch was planned, the guarded updates to
+# it and the updates planned on top of them do not match, and those alerts are saved again one
+# at a time with save_alert once the alerts for their resource have been read again. Correlated
+# alerts are read back after the batch is written so they are forwarded as they are at the end
+# of the batch. Returns a list of (branch, alert to forward) in batch order. Time spent is added
+# to the classify and persist stages if given.
+def save_alerts(batch, stages=None):
+
+    start = time.time()
+    buckets = load_buckets([index_key(alert) for alert, createTime, receiveTime, expireTime in batch])
+
+    plans = list()
+    ops = list()
+    for alert, createTime, receiveTime, expireTime in batch:
+        docs = buckets[index_key(alert)]
+        existing = find_existing(alert, docs)
+        branch, op, doc, history = plan_alert(alert, createTime, receiveTime, expireTime, existing)
+        if existing:
+            docs[docs.index(existing)] = index_summary(doc)
+        else:
+            docs.append(index_summary(doc))
+        ops.append(op)
+        plans.append((branch, doc, alert['id'], history))
+    start = stage_time(stages, 'classify', start)
+
+    updates = len([op for op in ops if op[0] != 'insert'])
+    applied = [True] * len(ops)
+    if hasattr(alerts, 'initialize_ordered_bulk_op'):
+        bulk = alerts.initialize_ordered_bulk_op()
+        for op in ops:
+            if op[0] == 'insert':
+                bulk.insert(op[1])
+            else:
+                bulk.find(op[1]).update_one(op[2])
+        result = bulk.execute()
+        matched = result['nMatched']
+        if matched != updates:
+            applied = applied_writes(ops, [alertid for branch, doc, alertid, history in plans])
+    else:
+        # Older pymongo has no bulk API so only consecutive inserts can be combined
+        matched = 0
+        inserts = list()
+        for i, op in enumerate(ops):
+            if op[0] == 'insert':
+                inserts.append(op[1])
+                continue
+            if inserts:
+                alerts.insert(inserts, safe=True)
+                inserts = list()
+            if alerts.update(op[1], op[2], safe=True)['updatedExisting']:
+                matched += 1
+            else:
+                applied[i] = False
+        if inserts:
+            alerts.insert(inserts, safe=True)
+
+    # Writes that were not applied are retried alert by alert, in batch order
+    retry = [i for i in range(len(ops)) if not applied[i]]
+    if retry:
+        logging.warning('Batch of %d alerts: %d of %d updates did not match because alerts were changed by another writer, retrying them', len(batch), len(retry), updates)
+        for i in retry:
+            index.invalidate(index_key(batch[i][0]))
+
+    correlated = [doc['_id'] for i, (branch, doc, alertid, history) in enumerate(plans) if branch == 'correlated' and applied[i]]
+    if correlated:
+        saved = dict((doc['_id'], doc) for doc in alerts.find({"_id": {'$in': correlated}}, {"history": 0}))
+    else:
+        saved = dict()
+
+    entries = list()
+    for i, (branch, doc, alertid, history) in enumerate(plans):
+        if applied[i]:
+            entries.extend(history)
+    record_history(db.history, entries)
+    stage_time(stages, 'persist', start)
+
+    results = list()
+    for i, (branch, doc, alertid, history) in enumerate(plans):
+        if not applied[i]:
+            results.append(save_alert(*batch[i], stages=stages))
+        elif branch == 'duplicate':
+            results.append((branch, None))
+        elif branch == 'correlated':
+            results.append((branch, forward_doc(saved.get(doc['_id'], doc))))
         else:
-            return json.JSONEncoder.default(self, obj)
+            results.append((branch, forward_doc(doc)))
+    return results
 
-class WorkerThread(threading.Thread):
+# Forward alert to notify topic and logger queue
+def forward_alert(alert):
 
-    def __init__(self, queue):
-        threading.Thread.__init__(self)
-        self.input_queue = queue
+    headers = dict()
+    headers['type']           = alert['type']
+    headers['correlation-id'] = alert['id']
 
-    def run(self):
-        global db, alerts, mgmt, hb, conn, queue
+    publisher.publish(alert, headers)
 
-        while True:
-            alert = self.input_queue.get()
-            if not alert:
-                logging.info('%s is shutting down.', self.getName())
-                break
+# Move OPEN alerts whose expireTime has passed to EXPIRED. Due alerts are found with a range scan
+# on the (status, expireTime) index and expired EXPIRE_BATCH at a time with a single multi-update
+# guarded on the same condition, so only due alerts are read however many alerts there are and an
+# alert that is received again in between is left alone. Returns the number of alerts expired.
+def expire_alerts():
 
-            start = time.time()
-            alertid = alert['id']
-            logging.info('%s : %s', alertid, alert['summary'])
+    total = 0
+    while True:
+        start = time.time()
+        now = utcnow()
+        query = { "status": "OPEN", "expireTime": { '$lt': now }}
+        due = [doc['_id'] for doc in alerts.find(query, { "_id": 1 }).limit(EXPIRE_BATCH)]
+        if not due:
+            break
+
+        entries = [{ "status": "EXPIRED", "updateTime": now }]
+        query['_id'] = { '$in': due }
+        alerts.update(query, push_history({ '$set': { "status": "EXPIRED", "modifyTime": now }}, entries, HISTORY_SIZE), multi=True, safe=True)
+
+        expired = list(alerts.find({ "_id": { '$in': due }, "status": "EXPIRED" }, { "history": 0 }))
+        record_history(db.history, [entry for doc in expired for entry in history_docs(doc['_id'], entries)])
+        for doc in expired:
+            logging.info('%s : Alert status for %s %s alert changed to EXPIRED', doc['_id'], doc['severity'], doc['event'])
+            if index:
+                index.invalidate(index_key(doc))
+            forward_alert(forward_doc(doc))
+
+        total += len(expired)
+        expire_latency = int((time.time() - start) * 1000)
+        metrics.timer("alerts", "expired", "Alert expiry rate and duration", "Time taken to expire alerts past their expireTime", expire_latency, len(expired))
+
+        if len(expired) < EXPIRE_BATCH:
+            break
+
+    return total
+
+class AlertExpirer(threading.Thread):
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self, name='AlertExpirer')
+        self.daemon = True
+        self.interval = interval
+        self.shutdown = threading.Event()
 
-            # Load alert transforms
+    def run(self):
+        while not self.shutdown.wait(self.interval):
             try:
-                alertconf = yaml.load(open(ALERTCONF))
-                logging.info('Loaded %d alert transforms and blackout rules OK', len(alertconf))
+                count = expire_alerts()
             except Exception, e:
-                alertconf = dict()
-                logging.warning('Failed to load alert transforms and blackout rules: %s', e)
-
-            # Apply alert transforms and blackouts
-            suppress = False
-            for conf in alertconf:
-                logging.debug('alertconf: %s', conf)
-                if all(item in alert.items() for item in conf['match'].items()):
-                    if 'parser' in conf:
-                        logging.debug('Loading parser %s', conf['parser'])
-                        try:
-                            exec(open('%s/%s.py' % (PARSERDIR, conf['parser']))) in globals(), locals()
-                            logging.info('Parser %s/%s exec OK', PARSERDIR, conf['parser'])
-                        except Exception, e:
-                            logging.warning('Parser %s failed: %s', conf['parser'], e)
-                    if 'event' in conf:
-                        event = conf['event']
-                    if 'resource' in conf:
-                        resource = conf['resource']
-                    if 'severity' in conf:
-                        severity = conf['severity']
-                    if 'group' in conf:
-                        group = conf['group']
-                    if 'value' in conf:
-                        value = conf['value']
-                    if 'text' in conf:
-                        text = conf['text']
-                    if 'environment' in conf:
-                        environment = [conf['environment']]
-                    if 'service' in conf:
-                        service = [conf['service']]
-                    if 'tags' in conf:
-                        tags = conf['tags']
-                    if 'correlatedEvents' in conf:
-                        correlate = conf['correlatedEvents']
-                    if 'thresholdInfo' in conf:
-                        threshold = conf['thresholdInfo']
-                    if 'suppress' in conf:
-                        suppress = conf['suppress']
-                    break
+                logging.error('Failed to expire alerts: %s', e)
+            else:
+                if count:
+                    logging.info('Expired %d alerts', count)
+
+    def stop(self):
+        self.shutdown.set()
+        self.join()
+
+def start_publisher():
+
+    pub = Publisher(conn, [NOTIFY_TOPIC, LOGGER_QUEUE], dumps, metrics)
+    pub.start()
+    return pub
+
+# Alerts for the same environment and resource always go to the same worker queue so
+# they are processed in the order received. Unrelated alerts are processed in parallel.
+# Worker queues are bounded so when they are full the receiver blocks here, the broker stops
+# delivering once PREFETCH_SIZE alerts are unacknowledged and the backlog stays on the broker.
+def shard(key):
+
+    environment, resource = key
+    key = '%s/%s' % (','.join(environment), resource)
+    return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % len(queues)
+
+# The token is handed back on the done queue once the alert has been processed. It is the
+# broker message-id, or the spool sequence number when alerts are journaled.
+def dispatch(alert, token, stages):
+
+    q = queues[shard(index_key(alert))]
+    if q.full():
+        logging.warning('%s : Alert queue is full, throttling', alert['id'])
+        start = time.time()
+        q.put((token, alert, stages, time.time()))
+        metrics.timer("alerts", "throttled", "Alert receive throttling", "Time spent waiting for space in a full alert queue", int((time.time() - start) * 1000))
+    else:
+        q.put((token, alert, stages, time.time()))
+
+# Queue the alerts that were journaled but not processed before the last shutdown or crash
+def replay_spool(unprocessed):
+
+    for seq, data in unprocessed:
+        receiveTime, body = data.split(' ', 1)
+        try:
+            alert = loads(body)
+        except ValueError, e:
+            logging.error('Could not decode spooled alert %s - %s', seq, e)
+            spool.done(seq)
+            continue
+        alert['receiveTime'] = receiveTime
+        logging.info('%s : Replaying spooled alert %s', alert.get('id'), seq)
+        dispatch(alert, seq, dict())
+
+class AlertWorker(object):
+
+    # Apply alert transforms and blackouts and work out alert timestamps. Returns None if
+    # the alert is suppressed.
+    def prepare(self, alert):
+
+        logging.info('%s : %s', alert['id'], alert['summary'])
+
+        # Reload alert transforms if changed
+        if alertconf.check():
+            metrics.counter("alerts", "rules", "Alert rule reloads", "Number of times alert transforms and blackout rules were reloaded")
+
+        # Apply alert transforms and blackouts
+        rules_start = time.time()
+        suppress = False
+        conf = alertconf.match(alert)
+        if conf:
+            logging.debug('alertconf: %s', conf)
+            if 'parser' in conf:
+                logging.debug('Loading parser %s', conf['parser'])
+                try:
+                    parser_latency = parsers.run(conf['parser'], globals(), { 'alert': alert })
+                    logging.info('Parser %s/%s exec OK', PARSERDIR, conf['parser'])
+                    metrics.timer("parsers", conf['parser'], "Parser %s" % conf['parser'], "Time taken to run the alert parser", parser_latency)
+                except Exception, e:
+                    logging.warning('Parser %s failed: %s', conf['parser'], e)
+            if 'suppress' in conf:
+                suppress = conf['suppress']
+        rules_latency = (time.time() - rules_start) * 1000
+        metrics.timer("alerts", "transformed", "Alert rule evaluation", "Time taken to apply alert transforms and blackout rules", rules_latency)
 
-            if suppress:
-                logging.info('%s : Suppressing alert %s', alert['id'], alert['summary'])
-                return
+        if suppress:
+            logging.info('%s : Suppressing alert %s', alert['id'], alert['summary'])
+            return None
 
-            createTime = datetime.datetime.strptime(alert['createTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-            createTime = createTime.replace(tzinfo=pytz.utc)
+        createTime = parse_date(alert['createTime'])
 
-            receiveTime = datetime.datetime.strptime(alert['receiveTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-            receiveTime = receiveTime.replace(tzinfo=pytz.utc)
+        receiveTime = parse_date(alert['receiveTime'])
 
-            # Add expire timestamp
-            if 'timeout' in alert and alert['timeout'] == 0:
-                expireTime = ''
-            elif 'timeout' in alert and alert['timeout'] > 0:
-                expireTime = createTime + datetime.timedelta(seconds=alert['timeout'])
-            else:
-                alert['timeout'] = DEFAULT_TIMEOUT
-                expireTime = createTime + datetime.timedelta(seconds=alert['timeout'])
-
-            if alerts.find_one({"environment": alert['environment'], "resource": alert['resource'], "event": alert['event'], "severity": alert['severity']}):
-                logging.info('%s : Duplicate alert -> update dup count', alertid)
-                # Duplicate alert .. 1. update existing document with lastReceiveTime, lastReceiveId, text, summary, value, tags and origin
-                #                    2. increment duplicate count
-
-                # FIXME - no native find_and_modify method in this version of pymongo
-                no_obj_error = "No matching object found"
-                alert = db.command("findAndModify", 'alerts',
-                    allowable_errors=[no_obj_error],
-                    query={ "environment": alert['environment'], "resource": alert['resource'], "event": alert['event'] },
-                    update={ '$set': { "lastReceiveTime": receiveTime, "expireTime": expireTime,
-                                "lastReceiveId": alertid, "text": alert['text'], "summary": alert['summary'], "value": alert['value'],
-                                "tags": alert['tags'], "repeat": True, "origin": alert['origin'] },
-                      '$inc': { "duplicateCount": 1 }},
-                    new=True,
-                    fields={ "history": 0 })['value']
-
-                if alert['status'] not in ['OPEN','ACK','CLOSED']:
-                    if alert['severity'] != 'NORMAL':
-                        status = 'OPEN'
-                    else:
-                        status = 'CLOSED'
-                else:
-                    status = None
-
-                if status:
-                    alert['status'] = status
-                    updateTime = datetime.datetime.utcnow()
-                    updateTime = updateTime.replace(tzinfo=pytz.utc)
-                    alerts.update(
-                        { "environment": alert['environment'], "resource": alert['resource'], '$or': [{"event": alert['event']}, {"correlatedEvents": alert['event']}]},
-                        { '$set': { "status": status },
-                          '$push': { "history": { "status": status, "updateTime": updateTime } }})
-                    logging.info('%s : Alert status for duplicate %s %s alert changed to %s', alertid, alert['severity'], alert['event'], status)
-                else:
-                    logging.info('%s : Alert status for duplicate %s %s alert unchanged because either OPEN, ACK or CLOSED', alertid, alert['severity'], alert['event'])
+        # Add expire timestamp
+        if 'timeout' in alert and alert['timeout'] == 0:
+            expireTime = ''
+        elif 'timeout' in alert and alert['timeout'] > 0:
+            expireTime = createTime + datetime.timedelta(seconds=alert['timeout'])
+        else:
+            alert['timeout'] = DEFAULT_TIMEOUT
+            expireTime = createTime + datetime.timedelta(seconds=alert['timeout'])
 
-                self.input_queue.task_done()
+        return alert, createTime, receiveTime, expireTime
 
-            elif alerts.find_one({"environment": alert['environment'], "resource": alert['resource'], '$or': [{"event": alert['event']}, {"correlatedEvents": alert['event']}]}):
-                previousSeverity = alerts.find_one({"environment": alert['environment'], "resource": alert['resource'], '$or': [{"event": alert['event']}, {"correlatedEvents": alert['event']}]}, { "severity": 1 , "_id": 0})['severity']
-                logging.info('%s : Event and/or severity change %s %s -> %s update details', alertid, alert['event'], previousSeverity, alert['severity'])
-                # Diff sev alert ... 1. update existing document with severity, createTime, receiveTime, lastReceiveTime, previousSeverity,
-                #                        severityCode, lastReceiveId, text, summary, value, tags and origin
-                #                    2. set duplicate count to zero
-                #                    3. push history
-
-                # FIXME - no native find_and_modify method in this version of pymongo
-                no_obj_error = "No matching object found"
-                alert = db.command("findAndModify", 'alerts',
-                    allowable_errors=[no_obj_error],
-                    query={ "environment": alert['environment'], "resource": alert['resource'], '$or': [{"event": alert['event']}, {"correlatedEvents": alert['event']}]},
-                    update={ '$set': { "event": alert['event'], "severity": alert['severity'], "severityCode": alert['severityCode'],
-                               "createTime": createTime, "receiveTime": receiveTime, "lastReceiveTime": receiveTime, "expireTime": expireTime,
-                               "previousSeverity": previousSeverity, "lastReceiveId": alertid, "text": alert['text'], "summary": alert['summary'], "value": alert['value'],
-                               "tags": alert['tags'], "repeat": False, "origin": alert['origin'], "thresholdInfo": alert['thresholdInfo'], "duplicateCount": 0 },
-                             '$push': { "history": { "createTime": createTime, "receiveTime": receiveTime, "severity": alert['severity'], "event": alert['event'],
-                               "severityCode": alert['severityCode'], "value": alert['value'], "text": alert['text'], "id": alertid }}},
-                    new=True,
-                    fields={ "history": 0 })['value']
-
-                # Update alert status
-                status = None
-
-                if alert['severity'] in ['DEBUG','INFORM']:
-                    status = 'OPEN'
-                elif alert['severity'] == 'NORMAL':
-                    status = 'CLOSED'
-                elif alert['severity'] == 'WARNING':
-                    if previousSeverity in ['NORMAL']:
-                        status = 'OPEN'
-                elif alert['severity'] == 'MINOR':
-                    if previousSeverity in ['NORMAL','WARNING']:
-                        status = 'OPEN'
-                elif alert['severity'] == 'MAJOR':
-                    if previousSeverity in ['NORMAL','WARNING','MINOR']:
-                        status = 'OPEN'
-                elif alert['severity'] == 'CRITICAL':
-                    if previousSeverity in ['NORMAL','WARNING','MINOR','MAJOR']:
-                        status = 'OPEN'
-                else:
-                    status = 'UNKNOWN'
-
-                if status:
-                    alert['status'] = status
-                    updateTime = datetime.datetime.utcnow()
-                    updateTime = updateTime.replace(tzinfo=pytz.utc)
-                    alerts.update(
-                        { "environment": alert['environment'], "resource": alert['resource'], '$or': [{"event": alert['event']}, {"correlatedEvents": alert['event']}]},
-                        { '$set': { "status": status },
-                          '$push': { "history": { "status": status, "updateTime": updateTime } }})
-                    logging.info('%s : Alert status for %s %s alert with diff event/severity changed to %s', alertid, alert['severity'], alert['event'], status)
-
-                # Forward alert to notify topic and logger queue
-                while not conn.is_connected():
-                    logging.warning('Waiting for message broker to become available')
-                    time.sleep(1.0)
-
-                # Use object id as canonical alert id
-                alert['id'] = alert['_id']
-                del alert['_id']
-
-                headers = dict()
-                headers['type']           = alert['type']
-                headers['correlation-id'] = alert['id']
-
-                logging.info('%s : Fwd alert to %s', alert['id'], NOTIFY_TOPIC)
-                try:
-                    conn.send(json.dumps(alert, cls=DateEncoder), headers, destination=NOTIFY_TOPIC)
-                except Exception, e:
-                    logging.error('Failed to send alert to broker %s', e)
+    # Wait for the next alert then take up to BATCH_SIZE alerts that arrive within BATCH_WAIT
+    def next_batch(self):
 
-                logging.info('%s : Fwd alert to %s', alert['id'], LOGGER_QUEUE)
+        batch = [self.input_queue.get()]
+        if BATCH_SIZE > 1 and batch[0]:
+            deadline = time.time() + BATCH_WAIT
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
                 try:
-                    conn.send(json.dumps(alert, cls=DateEncoder), headers, destination=LOGGER_QUEUE)
-                except Exception, e:
-                    logging.error('Failed to send alert to broker %s', e)
+                    alert = self.input_queue.get(True, timeout)
+                except Empty:
+                    break
+                batch.append(alert)
+                if not alert:
+                    break
+        return batch
 
-                self.input_queue.task_done()
-                logging.info('%s : Alert forwarded to %s and %s', alert['id'], NOTIFY_TOPIC, LOGGER_QUEUE)
+    # Save prepared alerts, in a batch if there is more than one. If the database fails the
+    # alerts are saved again one at a time, MAX_RETRIES times each, after reading their
+    # resources again as the index may hold writes that were planned but not made. Alerts that
+    # still cannot be saved are logged and dropped so the worker carries on with the rest.
+    def save(self, prepared, shared):
 
-            else:
-                logging.info('%s : New alert -> insert', alertid)
-                # New alert so ... 1. insert entire document
-                #                  2. push history
-                #                  3. set duplicate count to zero
-
-                # Use alert id as object id
-                alertid = alert['id']
-                alert['_id'] = alertid
-                del alert['id']
-
-                alert['lastReceiveId']    = alertid
-                alert['createTime']       = createTime
-                alert['receiveTime']      = receiveTime
-                alert['lastReceiveTime']  = receiveTime
-                alert['expireTime']       = expireTime
-                alert['previousSeverity'] = 'UNKNOWN'
-                alert['repeat']           = False
-                if alert['severity'] != 'NORMAL':
-                    status = 'OPEN'
-                else:
-                    status = 'CLOSED'
-                alert['status'] = status
-
-                alerts.insert(alert, safe=True)
-                alerts.update(
-                    { "environment": alert['environment'], "resource": alert['resource'], "event": alert['event'] },
-                    { '$push': { "history": { "createTime": createTime, "receiveTime": receiveTime, "severity": alert['severity'], "event": alert['event'],
-                                 "severityCode": alert['severityCode'], "value": alert['value'], "text": alert['text'], "id": alertid }},
-                      '$set': { "duplicateCount": 0 }}, safe=True)
-
-                updateTime = datetime.datetime.utcnow()
-                updateTime = updateTime.replace(tzinfo=pytz.utc)
-                alerts.update(
-                    { "environment": alert['environment'], "resource": alert['resource'], "event": alert['event'] },
-                    { '$set': { "status": status },
-                      '$push': { "history": { "status": status, "updateTime": updateTime } }}, safe=True)
-                logging.info('%s : Alert status for new %s %s alert set to %s', alertid, alert['severity'], alert['event'], status)
-
-                # Forward alert to notify topic and logger queue
-                while not conn.is_connected():
-                    logging.warning('Waiting for message broker to become available')
-                    time.sleep(1.0)
-
-                alert = alerts.find_one({"_id": alertid}, {"_id": 0, "history": 0})
-                alert['id'] = alertid
-
-                headers = dict()
-                headers['type']           = alert['type']
-                headers['correlation-id'] = alert['id']
-
-                logging.info('%s : Fwd alert to %s', alert['id'], NOTIFY_TOPIC)
+        try:
+            if len(prepared) == 1:
+                return [save_alert(*prepared[0], stages=shared)]
+            return save_alerts(prepared, shared)
+        except Exception, e:
+            logging.error('%s : Failed to save %d alerts, retrying one at a time - %s', self.name, len(prepared), e)
+            for p in prepared:
+                index.invalidate(index_key(p[0]))
+
+        results = list()
+        for p in prepared:
+            for attempt in range(MAX_RETRIES):
+                time.sleep(RETRY_WAIT)
                 try:
-                    conn.send(json.dumps(alert, cls=DateEncoder), headers, destination=NOTIFY_TOPIC)
+                    results.append(save_alert(*p, stages=shared))
+                    break
                 except Exception, e:
-                    logging.error('Failed to send alert to broker %s', e)
+                    logging.warning('%s : Failed to save alert on attempt %d - %s', p[0]['id'], attempt + 1, e)
+                    index.invalidate(index_key(p[0]))
+            else:
+                logging.error('%s : Dropping alert %s after %d failed attempts to save it', p[0]['id'], p[0]['summary'], MAX_RETRIES)
+                results.append((None, None))
+        return results
+
+    def process(self, batch):
 
-                logging.info('%s : Fwd alert to %s', alert['id'], LOGGER_QUEUE)
+        start = time.time()
+        prepared = list()
+        for msgid, alert, stages, queued in batch:
+            stages['queue'] = (start - queued) * 1000
+            t = time.time()
+            try:
+                p = self.prepare(alert)
+            except Exception, e:
+                logging.error('%s : Dropping alert that could not be prepared - %s', alert.get('id'), e)
+                p = None
+            stage_time(stages, 'transform', t)
+            if p:
+                prepared.append(p)
+
+        # Stages shared by all alerts in the batch
+        shared = dict()
+        if prepared:
+            results = self.save(prepared, shared)
+        else:
+            results = list()
+
+        t = time.time()
+        for branch, saved in results:
+            if saved:
                 try:
-                    conn.send(json.dumps(alert, cls=DateEncoder), headers, destination=LOGGER_QUEUE)
+                    forward_alert(saved)
                 except Exception, e:
-                    logging.error('Failed to send alert to broker %s', e)
+                    logging.error('%s : Failed to forward alert - %s', saved['id'], e)
+        stage_time(shared, 'publish', t)
+
+        return start, prepared, shared
+
+    def run(self):
+        global db, alerts, metrics, conn
 
+        running = True
+        while running:
+            batch = self.next_batch()
+            if not batch[-1]:
+                running = False
+                batch.pop()
+
+            # Any error is logged and the worker carries on, otherwise its queue would never be
+            # drained again and once full the receiver would block for every shard
+            try:
+                start, prepared, shared = self.process(batch)
+            except Exception, e:
+                logging.error('%s : Failed to process batch of %d alerts - %s', self.name, len(batch), e)
+                start, prepared, shared = time.time(), list(), dict()
+
+            # Acknowledge alerts only once they have been saved and forwarded, or dropped
+            for token, alert, stages, queued in batch:
+                self.done_queue.put(token)
                 self.input_queue.task_done()
-                logging.info('%s : Alert forwarded to %s and %s', alert['id'], NOTIFY_TOPIC, LOGGER_QUEUE)
 
             # Update management stats
-            proc_latency = int((time.time() - start) * 1000)
-            mgmt.update(
-                { "group": "alerts", "name": "processed", "type": "timer", "title": "Alert process rate and duration", "description": "Time taken to process the alert" },
-                { '$inc': { "count": 1, "totalTime": proc_latency}},
-               True)
-            delta = receiveTime - createTime
-            recv_latency = int(delta.days * 24 * 60 * 60 * 1000 + delta.seconds * 1000 + delta.microseconds / 1000)
-            mgmt.update(
-                { "group": "alerts", "name": "received", "type": "timer", "title": "Alert receive rate and latency", "description": "Time taken for alert to be received by the server" },
-                { '$inc': { "count": 1, "totalTime": recv_latency}},
-               True)
-            queue_len = queue.qsize()
-            mgmt.update(
-                { "group": "alerts", "name": "queue", "type": "gauge", "title": "Alert internal queue length", "description": "Length of internal alert queue" },
-                { '$set': { "value": queue_len }},
-               True)
-            logging.info('%s : Alert receive latency = %s ms, process latency = %s ms, queue length = %s', alertid, recv_latency, proc_latency, queue_len)
-
-            heartbeatTime = datetime.datetime.utcnow()
-            heartbeatTime = heartbeatTime.replace(tzinfo=pytz.utc)
-            hb.update(
-                { "origin": "%s/%s" % (__program__, os.uname()[1]) },
-                { "origin": "%s/%s" % (__program__, os.uname()[1]), "version": __version__, "createTime": heartbeatTime, "receiveTime": heartbeatTime },
-                True)
-
+            t = time.time()
+            batch_latency = int((time.time() - start) * 1000)
+            if len(batch) > 1:
+                metrics.timer("alerts", "batched", "Alert batch rate and duration", "Time taken to process a batch of alerts", batch_latency)
+            proc_latency = batch_latency / max(len(batch), 1)
+            for alert, createTime, receiveTime, expireTime in prepared:
+                metrics.timer("alerts", "processed", "Alert process rate and duration", "Time taken to process the alert", proc_latency)
+                delta = receiveTime - createTime
+                recv_latency = int(delta.days * 24 * 60 * 60 * 1000 + delta.seconds * 1000 + delta.microseconds / 1000)
+                metrics.timer("alerts", "received", "Alert receive rate and latency", "Time taken for alert to be received by the server", recv_latency)
+                logging.info('%s : Alert receive latency = %s ms, process latency = %s ms, queue length = %s', alert['id'], recv_latency, proc_latency, self.input_queue.qsize())
+            stage_time(shared, 'stats', t)
+            self.record_latency(batch, shared)
+
+        logging.info('%s is shutting down.', self.name)
         self.input_queue.task_done()
         return
 
+    # Record how long each alert spent in each stage and log any alert over the latency budget
+    # with its breakdown
+    def record_latency(self, batch, shared):
+
+        for msgid, alert, stages, queued in batch:
+            stages.update(shared)
+            total = sum(stages.values())
+            for stage, description in STAGES:
+                if stage in stages:
+                    metrics.histogram("latency", stage, "Alert %s latency" % stage, description, stages[stage])
+            metrics.histogram("latency", "total", "Alert total latency", "Time taken from receiving the alert to finishing processing it", total)
+
+            if LATENCY_BUDGET and total > LATENCY_BUDGET:
+                logging.warning('%s : Alert took %.1f ms, over the %d ms latency budget (%s)', alert['id'], total, LATENCY_BUDGET,
+                    ', '.join('%s %.1f ms' % (stage, stages[stage]) for stage, description in STAGES if stage in stages))
+
+class WorkerThread(AlertWorker, threading.Thread):
+
+    def __init__(self, queue, done):
+        threading.Thread.__init__(self)
+        self.input_queue = queue
+        self.done_queue = done
+
+# Worker processes inherit the alert transforms and parsers but open their own connections
+# to MongoDB and the message broker and write their own management stats.
+class WorkerProcess(AlertWorker, multiprocessing.Process):
+
+    def __init__(self, queue, done, shard):
+        multiprocessing.Process.__init__(self)
+        self.input_queue = queue
+        self.done_queue = done
+        self.shard = shard
+
+    def run(self):
+        global db, alerts, mgmt, metrics, conn, index, publisher
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # parent sends shutdown sentinel
+
+        try:
+            mongo = pymongo.Connection()
+            db = mongo.monitoring
+            alerts = db.alerts
+            mgmt = db.status
+        except pymongo.errors.ConnectionFailure, e:
+            logging.error('%s : Mongo connection failure: %s', self.name, e)
+            sys.exit(1)
+
+        metrics = Metrics(mgmt, STATS_INTERVAL)
+        metrics.start()
+
+        # Only index the resources this worker is sent alerts for
+        index = AlertIndex(INDEX_SIZE)
+        index.warm(lambda key: shard(key) == self.shard)
+
+        try:
+            conn = stomp.Connection(
+                       BROKER_LIST,
+                       reconnect_sleep_increase = 5.0,
+                       reconnect_sleep_max = 120.0,
+                       reconnect_attempts_max = 20
+                   )
+            conn.start()
+            conn.connect(wait=True)
+        except Exception, e:
+            logging.error('%s : Stomp connection error: %s', self.name, e)
+        publisher = start_publisher()
+
+        AlertWorker.run(self)
+
+        publisher.stop()
+        metrics.stop()
+        conn.disconnect()
+
 class MessageHandler(object):
 
     def on_error(self, headers, body):
         logging.error('Received an error %s', body)
 
     def on_message(self, headers, body):
-        global hb, queue
 
+        start = time.time()
         logging.debug("Received alert : %s", body)
 
+        msgid = headers['message-id']
+
         alert = dict()
         try:
-            alert = json.loads(body)
+            alert = loads(body)
         except ValueError, e:
             logging.error("Could not decode JSON - %s", e)
+            conn.ack({ 'message-id': msgid })
             return
 
-        # Set receiveTime
-        receiveTime = datetime.datetime.utcnow()
-        alert['receiveTime'] = receiveTime.replace(microsecond=0).isoformat() + ".%03dZ" % (receiveTime.microsecond//1000)
-
-        # Get createTime
-        createTime = datetime.datetime.strptime(alert['createTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-        createTime = createTime.replace(tzinfo=pytz.utc)
-
-        # Handle heartbeats
-        if alert['type'] == 'heartbeat':
-            hb.update(
-                { "origin": alert['origin'] },
-                { "origin": alert['origin'], "version": alert['version'], "createTime": createTime, "receiveTime": receiveTime },
-                True)
-            logging.info('%s : heartbeat from %s', alert['id'], alert['origin'])
-            return
+        # A malformed alert is acknowledged and dropped, otherwise it would hold a prefetch slot
+        # until the connection is lost and then be redelivered
+        token = None
+        try:
+            # Set receiveTime
+            receiveTime = utcnow()
+            alert['receiveTime'] = format_date(receiveTime)
+
+            # Get createTime
+            createTime = parse_date(alert['createTime'])
+
+            # Handle heartbeats
+            if alert['type'] == 'heartbeat':
+                heartbeats.receive(alert['origin'], alert['version'], createTime, receiveTime)
+                logging.info('%s : heartbeat from %s', alert['id'], alert['origin'])
+                conn.ack({ 'message-id': msgid })
+                return
 
-        # Queue alert for processing
-        queue.put(alert)
+            # Journal the alert so it is acknowledged once it is on disk rather than once it is processed
+            if spool:
+                token = spool.append('%s %s' % (alert['receiveTime'], body), msgid)
+            else:
+                token = msgid
+
+            # Queue alert for processing, as the plain dict it was decoded to
+            dispatch(alert, token, { 'decode': (time.time() - start) * 1000 })
+        except Exception, e:
+            logging.error('Could not process alert message %s, dropping - %s', msgid, e)
+            if spool and token is not None:
+                spool.done(token)
+            else:
+                conn.ack({ 'message-id': msgid })
 
     def on_disconnected(self):
         global conn
@@ -398,10 +973,56 @@ class MessageHandler(object):
         logging.warning('Connection lost. Attempting auto-reconnect to %s', ALERT_QUEUE)
         conn.start()
         conn.connect(wait=True)
-        conn.subscribe(destination=ALERT_QUEUE, ack='auto')
+        subscribe()
+
+# Alerts are acknowledged individually after processing, or after they have been journaled if
+# there is a spool, and anything unacknowledged is redelivered
+def subscribe():
+
+    conn.subscribe({ 'activemq.prefetchSize': PREFETCH_SIZE }, destination=ALERT_QUEUE, ack='client-individual')
+
+def send_acks():
+
+    msgids = list()
+    while True:
+        try:
+            token = acks.get_nowait()
+        except Empty:
+            break
+        if spool:
+            spool.done(token)
+        elif token:
+            msgids.append(token)
+    if spool:
+        msgids.extend(spool.durable())
+
+    for msgid in msgids:
+        try:
+            conn.ack({ 'message-id': msgid })
+        except Exception, e:
+            logging.error('Failed to acknowledge message %s: %s', msgid, e)
+
+def send_heartbeat():
+
+    heartbeatTime = utcnow()
+    heartbeats.receive("%s/%s" % (__program__, os.uname()[1]), __version__, heartbeatTime, heartbeatTime)
 
 def main():
-    global db, alerts, mgmt, hb, conn
+    global db, alerts, mgmt, metrics, hb, conn, alertconf, acks, index, publisher, heartbeats, spool, parsers
+
+    # With greenlets the threads, sockets and sleeps used by the workers, stomp.py and pymongo
+    # all yield to the gevent event loop, so each worker can have an alert waiting on MongoDB
+    # while the others run. Patch before any locks, queues or connections are created, which is
+    # why nothing at module level creates them.
+    if USE_GREENLETS:
+        try:
+            from gevent import monkey
+        except ImportError:
+            print >>sys.stderr, 'ERROR: You need to install the gevent python module to use greenlets'
+            sys.exit(1)
+        monkey.patch_all()
+
+    parsers = ParserLoader(PARSERDIR)
 
     logging.basicConfig(level=logging.INFO, format="%(asctime)s alerta[%(process)d] %(threadName)s %(levelname)s - %(message)s", filename=LOGFILE)
     logging.info('Starting up Alerta version %s', __version__)
@@ -417,9 +1038,16 @@ def main():
             pass
     file(PIDFILE, 'w').write(str(os.getpid()))
 
+    if USE_GREENLETS and USE_PROCESSES:
+        logging.error('USE_GREENLETS and USE_PROCESSES cannot both be set')
+        sys.exit(1)
+
     # Connection to MongoDB
     try:
-        mongo = pymongo.Connection()
+        if USE_GREENLETS:
+            mongo = pymongo.Connection(use_greenlets=True, max_pool_size=NUM_GREENLETS)
+        else:
+            mongo = pymongo.Connection()
         db = mongo.monitoring
         alerts = db.alerts
         mgmt = db.status
@@ -428,7 +1056,51 @@ def main():
         logging.error('Mongo connection failure: %s', e)
         sys.exit(1)
 
-    # Connect to message broker
+    # Create the indexes the alert, API and management queries rely on
+    ensure_indexes(db, HISTORY_TTL)
+
+    # Buffer management stats in memory and write them on an interval
+    metrics = Metrics(mgmt, STATS_INTERVAL)
+
+    # Keep the latest heartbeat from each origin in memory and write them on an interval
+    heartbeats = Heartbeats(hb, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, metrics)
+    heartbeats.load()
+
+    # Load alert transforms and blackout rules
+    alertconf = AlertConfig(ALERTCONF)
+    alertconf.check()
+
+    # Index existing alerts so that most alerts can be classified without a database read
+    if not USE_PROCESSES:
+        index = AlertIndex(INDEX_SIZE)
+        index.warm()
+
+    # Start worker threads, greenlets or processes, one queue each. Alerts for the same resource
+    # always go to the same worker so they are processed in the order they were received.
+    workers = list()
+    num_workers = NUM_GREENLETS if USE_GREENLETS else NUM_THREADS
+    maxsize = max(1, QUEUE_HIGH_WATER // num_workers)
+    if USE_PROCESSES:
+        acks = multiprocessing.Queue()
+    else:
+        acks = Queue()
+    for i in range(num_workers):
+        if USE_PROCESSES:
+            q = multiprocessing.JoinableQueue(maxsize)
+            w = WorkerProcess(q, acks, i)
+        else:
+            q = Queue(maxsize)
+            w = WorkerThread(q, acks)
+        queues.append(q)
+        workers.append(w)
+    for w in workers:
+        w.start()
+        logging.info('Starting alert forwarding worker: %s', w.name)
+    metrics.start()
+    heartbeats.start()
+
+    # Start the publisher before replaying the spool so replayed alerts are forwarded too. It
+    # buffers them until the broker connection below is up.
     try:
         conn = stomp.Connection(
                    BROKER_LIST,
@@ -436,26 +1108,60 @@ def main():
                    reconnect_sleep_max = 120.0,
                    reconnect_attempts_max = 20
                )
+    except Exception, e:
+        logging.error('Stomp connection error: %s', e)
+        sys.exit(1)
+    publisher = start_publisher()
+
+    # Replay alerts journaled before the last shutdown before taking any more from the broker
+    if SPOOL_DIR:
+        spool = Spool(SPOOL_DIR, SPOOL_SEGMENT_SIZE, SPOOL_SYNC_WAIT, metrics)
+        try:
+            unprocessed = spool.open()
+        except (IOError, OSError), e:
+            logging.error('Failed to open spool %s: %s', SPOOL_DIR, e)
+            sys.exit(1)
+        spool.start()
+        replay_spool(unprocessed)
+
+    # Connect to message broker
+    try:
         conn.set_listener('', MessageHandler())
         conn.start()
         conn.connect(wait=True)
-        conn.subscribe(destination=ALERT_QUEUE, ack='auto')
+        subscribe()
     except Exception, e:
         logging.error('Stomp connection error: %s', e)
 
-    # Start worker thread
-    for i in range(NUM_THREADS):
-        w = WorkerThread(queue)
-        w.start()
-        logging.info('Starting alert forwarding thread: %s', w.getName())
+    # Expire alerts in this process, whether workers are threads or processes
+    expirer = AlertExpirer(EXPIRE_INTERVAL)
+    expirer.start()
 
+    heartbeat = 0
     while True:
         try:
+            send_acks()
+            if time.time() - heartbeat >= STATS_INTERVAL:
+                send_heartbeat()
+                metrics.gauge("alerts", "queue", "Alert internal queue length", "Length of internal alert queue", sum([q.qsize() for q in queues]))
+                heartbeat = time.time()
             time.sleep(0.01)
         except (KeyboardInterrupt, SystemExit):
-            for i in range(NUM_THREADS):
-                queue.put(None)
+            for q in queues:
+                q.put(None)
+            for w in workers:
+                w.join()
+            expirer.stop()
+            if publisher:
+                publisher.stop()
+            send_acks()
+            if spool:
+                spool.stop()
+                send_acks()
             conn.disconnect()
+            send_heartbeat()
+            heartbeats.stop()
+            metrics.stop()
             os.unlink(PIDFILE)
             sys.exit(0)
 
@@ -13,12 +13,17 @@ except ImportError:
     import simplejson as json
 import time
 import datetime
-import stomp
 import urlparse
 import logging
 import uuid
 import re
 
+sys.path.insert(0, '/opt/alerta/lib')
+from alerta.severity import SEVERITY_CODE
+from alerta.codec import dumps
+from alerta.timestamp import format_date
+from alerta.webapp import send_to_broker, run_cgi, wsgi_application
+
 __version__ = '1.4.1'
 
 BROKER_LIST  = [('localhost', 61613)] # list of brokers for failover
@@ -30,53 +35,35 @@ LOGFILE = '/var/log/alerta/alert-api.log'
 VALID_SEVERITY    = [ 'CRITICAL', 'MAJOR', 'MINOR', 'WARNING', 'NORMAL', 'INFORM', 'DEBUG' ]
 VALID_ENVIRONMENT = [ 'PROD', 'REL', 'QA', 'TEST', 'CODE', 'STAGE', 'DEV', 'LWP','INFRA' ]
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
-
-# Extend JSON Encoder to support ISO 8601 format dates
-class DateEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime.date, datetime.datetime)):
-            return obj.replace(microsecond=0).isoformat() + ".%03dZ" % (obj.microsecond//1000)
-        else:
-            return json.JSONEncoder.default(self, obj)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s alert-api[%(process)d] %(levelname)s - %(message)s", filename=LOGFILE)
 
-def main():
+def handle(environ, body):
 
     start = time.time()
 
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s alert-api[%(process)d] %(levelname)s - %(message)s", filename=LOGFILE)
-    logging.info('Received HTTP request %s %s' % (os.environ['REQUEST_METHOD'], os.environ['REQUEST_URI']))
+    logging.info('Received HTTP request %s %s' % (environ['REQUEST_METHOD'], environ['REQUEST_URI']))
 
     status = dict()
     status['response'] = dict()
     status['response']['status'] = None
     error = 'unknown error'
 
-    for e in os.environ:
-       logging.debug('%s: %s', e, os.environ[e])
+    for e in environ:
+       logging.debug('%s: %s', e, environ[e])
 
     # Get HTTP method and any body data
-    method = os.environ['REQUEST_METHOD']
+    method = environ['REQUEST_METHOD']
     if method in ['PUT', 'POST']:
         try:
-            data = json.loads(sys.stdin.read())
+            data = json.loads(body)
         except ValueError, e:
             data = list()
             logging.warning('Failed to get data - %s', e)
             error = 'failed to parse json data in body'
 
     # Parse RESTful URI
-    uri = urlparse.urlsplit(os.environ['REQUEST_URI'])
-    form = urlparse.parse_qs(os.environ['QUERY_STRING'])
+    uri = urlparse.urlsplit(environ['REQUEST_URI'])
+    form = urlparse.parse_qs(environ['QUERY_STRING'])
     request = method + ' ' + uri.path
 
     m = re.search(r'(PUT|POST) /alerta/api/v1/alerts/alert.json$', request)
@@ -120,26 +107,18 @@ def main():
             alert['environment']   = [x.upper() for x in alert['environment']]
             alert['type']          = 'exceptionAlert'
             alert['summary']       = '%s - %s %s is %s on %s %s' % (','.join(alert['environment']), alert['severity'].upper(), alert['event'], alert['value'], ','.join(alert['service']), alert['resource'])
-            alert['createTime']    = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+            alert['createTime']    = format_date(createTime)
             alert['origin']        = 'alert-api/%s' % os.uname()[1]
 
-            logging.info('%s : %s', alertid, json.dumps(alert))
+            logging.info('%s : %s', alertid, dumps(alert))
 
             try:
-                conn = stomp.Connection(BROKER_LIST)
-                conn.start()
-                conn.connect(wait=True)
-            except Exception, e:
-                print >>sys.stderr, "ERROR: Could not connect to broker - %s" % e
-                logging.error('Could not connect to broker %s', e)
-            try:
-                conn.send(json.dumps(alert), headers, destination=ALERT_QUEUE)
+                broker = send_to_broker(BROKER_LIST, dumps(alert), headers, [ALERT_QUEUE])
             except Exception, e:
                 print >>sys.stderr, "ERROR: Failed to send alert to broker - %s " % e
                 logging.error('Failed to send alert to broker %s', e)
-            broker = conn.get_host_and_port()
-            logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
-            conn.disconnect()
+            else:
+                logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
 
             status['response']['id'] = alertid
             status['response']['status'] = 'ok'
@@ -160,19 +139,14 @@ def main():
 
         diff = int(diff * 1000)
 
-    content = json.dumps(status, cls=DateEncoder)
+    content = dumps(status)
     if 'callback' in form:
         content = '%s(%s);' % (form['callback'][0], content)
 
-    print "Content-Type: application/javascript; charset=utf-8"
-    print "Content-Length: %s" % len(content)
-    print "Expires: -1"
-    print "Cache-Control: no-cache"
-    print "Pragma: no-cache"
-    print ""
-    print content
-
     logging.info('Request %s completed in %sms', request, diff)
+    return content
+
+application = wsgi_application(handle)
 
 if __name__ == '__main__':
-    main()
+    run_cgi(handle)
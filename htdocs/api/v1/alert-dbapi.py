@@ -13,14 +13,22 @@ except ImportError:
     import simplejson as json
 import time
 import datetime
-import stomp
-import yaml
-import pymongo
 import urlparse
 import logging
 import pytz
 import re
 
+sys.path.insert(0, '/opt/alerta/lib')
+from alerta.codec import dumps
+from alerta.timestamp import parse_date, utcnow
+from alerta.history import HISTORY_SIZE, history_docs, push_history, record_history, get_history
+from alerta.filters import compile_filter
+from alerta.pages import Page
+from alerta.counts import new_counts, count_alert, counts_pipeline, find_counts, aggregate_counts
+from alerta.changes import change_token, parse_change_token, token_expired, record_deletions, get_deletions, last_change
+from alerta.cache import ResponseCache, cache_key, cache_version, response_etag
+from alerta.webapp import get_db, send_to_broker, ConfigFile, ETAG_KEY, not_modified, run_cgi, wsgi_application
+
 __version__ = '1.9.10'
 
 BROKER_LIST  = [('localhost', 61613)] # list of brokers for failover
@@ -29,25 +37,22 @@ LOGGER_QUEUE = '/queue/logger'
 
 EXPIRATION_TIME = 600 # seconds = 10 minutes
 
-MAX_HISTORY = -10 # maximum number of history log entries to return (0 = no history)
+MAX_HISTORY = -10 # maximum number of history log entries to return (0 = no history), listings return at most HISTORY_SIZE kept on the alert
 
 CONFIGFILE = '/opt/alerta/conf/alerta-global.yaml'
 LOGFILE = '/var/log/alerta/alert-dbapi.log'
 
-# Extend JSON Encoder to support ISO 8601 format dates
-class DateEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime.date, datetime.datetime)):
-            return obj.replace(microsecond=0).isoformat() + ".%03dZ" % (obj.microsecond//1000)
-        else:
-            return json.JSONEncoder.default(self, obj)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s alert-dbapi[%(process)d] %(levelname)s - %(message)s", filename=LOGFILE)
+
+globalconf = ConfigFile(CONFIGFILE)
+
+cache = ResponseCache() # alert listings, shared by every request when run under WSGI
 
-def main():
+def handle(environ, body):
 
     start = time.time()
 
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s alert-dbapi[%(process)d] %(levelname)s - %(message)s", filename=LOGFILE)
-    logging.info('Received HTTP request %s %s' % (os.environ['REQUEST_METHOD'], os.environ['REQUEST_URI']))
+    logging.info('Received HTTP request %s %s' % (environ['REQUEST_METHOD'], environ['REQUEST_URI']))
 
     total = 0
     status = dict()
@@ -55,14 +60,14 @@ def main():
     status['response']['status'] = None
     error = 'unknown error'
 
-    for e in os.environ:
-        logging.debug('%s: %s', e, os.environ[e])
+    for e in environ:
+        logging.debug('%s: %s', e, environ[e])
 
     # Get HTTP method and any body data
-    method = os.environ['REQUEST_METHOD']
+    method = environ['REQUEST_METHOD']
     if method in ['PUT', 'POST']:
         try:
-            data = json.loads(sys.stdin.read())
+            data = json.loads(body)
         except ValueError, e:
             data = list()
             logging.warning('Failed to get data - %s', e)
@@ -71,22 +76,18 @@ def main():
             method = data['_method'].upper()
 
     # Parse RESTful URI
-    uri = urlparse.urlsplit(os.environ['REQUEST_URI'])
-    form = urlparse.parse_qs(os.environ['QUERY_STRING'])
+    uri = urlparse.urlsplit(environ['REQUEST_URI'])
+    form = urlparse.parse_qs(environ['QUERY_STRING'])
     request = method + ' ' + uri.path
 
-    # Connect to MongoDB
-    mongo = pymongo.Connection()
-    db = mongo.monitoring
+    # Connections and config are kept between requests when run under WSGI
+    db = get_db()
     alerts = db.alerts
     mgmt = db.status
+    history = db.history
     query = dict()
 
-    # Read in config file
-    try:
-        config = yaml.load(open(CONFIGFILE,'r'))
-    except IOError, e:
-        logging.error('Failed to load config file %s: %s', CONFIGFILE, e)
+    config = globalconf.get()
     if config and 'warning' in config:
         status['response']['warning'] = config['warning']
 
@@ -97,8 +98,10 @@ def main():
         status['response']['alert'] = list()
 
         logging.debug('MongoDB GET -> alerts.find_one(%s)', query)
-        alert = alerts.find_one(query)
+        alert = alerts.find_one(query, {"history": 0})
         if alert:
+            if MAX_HISTORY:
+                alert['history'] = get_history(history, alert['_id'], -MAX_HISTORY)
             alert['id'] = alert['_id']
             del alert['_id']
             status['response']['alert'] = alert
@@ -120,10 +123,53 @@ def main():
             { '$inc': { "count": 1, "totalTime": diff}},
             True)
 
-    m = re.search(r'GET /alerta/api/v1/alerts$', request)  # hide-alert-details, sort-by 
+    # Identical alert listings are served from the response cache until an alert changes, and a
+    # client that already has the response is told so without running the query
+    cached = None
+    m = re.search(r'GET /alerta/api/v1/alerts$', request)
+    if m:
+        key = cache_key(uri.path, form)
+        version = cache_version(last_change(db))
+        environ[ETAG_KEY] = response_etag(key, version, form.get('callback', [None])[0])
+
+        if not_modified(environ):
+            cached = 'notModified'
+            status['response']['status'] = 'ok'
+        else:
+            response = cache.get(key, version)
+            if response is not None:
+                cached = 'hits'
+                status['response'].update(response)
+
+        cache.count(cached)
+        stats = cache.take_stats()
+        if stats:
+            mgmt.update(
+                { "group": "cache", "name": "alerts", "type": "counter", "title": "Alert response cache", "description": "Alert listings served from the response cache or not modified" },
+                { '$inc': stats },
+                True)
+
+    if cached:
+        diff = time.time() - start
+        status['response']['time'] = "%.3f" % diff
+        status['response']['localTime'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        diff = int(diff * 1000)
+        m = None
+
+    # Page through the alerts with page-size and the next token returned with each page
+    page = None
+    if m and ('page-size' in form or 'next' in form or 'order' in form):
+        try:
+            page = Page(form.pop('page-size', [None])[0], form.pop('next', [None])[0], form.pop('order', [None])[0])
+        except ValueError, e:
+            error = str(e)
+            m = None
+
     if m:
         logging.debug('form %s' % form)
 
+        issued = utcnow() # changes after this are returned by the next request for changes
+
         if 'hide-alert-details' in form:
             hide_details = form['hide-alert-details'][0] == 'true'
             del form['hide-alert-details']
@@ -137,7 +183,8 @@ def main():
             hide_repeats = []
 
         fields = dict()
-        if 'fields' in form:
+        field_list = 'fields' in form # return only the requested fields, otherwise all but those left out
+        if field_list:
             if len(form['fields']) == 1:
                 for f in form['fields'][0].split(','):
                     fields[f] = 1
@@ -150,11 +197,19 @@ def main():
             fields['status'] = 1
 
         if 'hide-alert-history' in form:
-            if form['hide-alert-history'][0] == 'true':
-                fields['history'] = 0
+            show_history = form['hide-alert-history'][0] != 'true'
             del form['hide-alert-history']
         else:
+            show_history = True
+
+        # Listings return the recent history kept on each alert document so that no query is
+        # needed per alert, the full history is in the history collection
+        if show_history and MAX_HISTORY:
             fields['history'] = { '$slice': MAX_HISTORY }
+        elif field_list:
+            fields.pop('history', None)
+        else:
+            fields['history'] = 0
 
         if 'limit' in form:
             limit = int(form['limit'][0])
@@ -163,8 +218,7 @@ def main():
             limit = 0
 
         if 'from-date' in form:
-            from_date = datetime.datetime.strptime(form['from-date'][0], '%Y-%m-%dT%H:%M:%S.%fZ')
-            from_date = from_date.replace(tzinfo=pytz.utc)
+            from_date = parse_date(form['from-date'][0])
             to_date = datetime.datetime.utcnow()
             to_date = to_date.replace(tzinfo=pytz.utc)
             query['lastReceiveTime'] = {'$gte': from_date, '$lt': to_date }
@@ -181,98 +235,59 @@ def main():
         else:
             sortby.append(('lastReceiveTime',-1))
 
-        query = dict()
-        for field in form:
-            if field in ['callback', '_']:
-                continue
-            if field == 'id':
-                query['_id'] = dict()
-                query['_id']['$regex'] = '^'+form['id'][0]
-            elif len(form[field]) == 1:
-                if field.startswith('-'):
-                    query[field[1:]] = dict()
-                    query[field[1:]]['$not'] = re.compile(form[field][0])
-                else:
-                    query[field] = dict()
-                    query[field]['$regex'] = form[field][0]
-                    query[field]['$options'] = 'i'  # case insensitive search
-            else:
-                if field.startswith('-'):
-                    query[field[1:]] = dict()
-                    query[field[1:]]['$nin'] = form[field]
-                else:
-                    query[field] = dict()
-                    query[field]['$in'] = form[field]
+        query.update(compile_filter(form))
 
-        # Init status and severity counts
-        total = 0
-        opened = 0
-        ack = 0
-        closed = 0
-        critical = 0
-        major = 0
-        minor = 0
-        warning = 0
-        normal = 0
-        inform = 0
-        debug = 0
+        # Pages are always in (lastReceiveTime, _id) order and the token needs lastReceiveTime
+        if page:
+            query = page.query(query)
+            sortby = page.sort()
+            limit = page.limit()
+            if field_list:
+                fields['lastReceiveTime'] = 1
 
         if not len(fields): fields = None
-        logging.debug('MongoDB GET all -> alerts.find(%s, %s, sort=%s).limit(%s)', query, fields, sortby, limit)
 
+        total = 0
+        stat, sev = new_counts()
         alertDetails = list()
-        for alert in alerts.find(query, fields, sort=sortby).limit(limit):
-            if alert['severity'] in hide_repeats and alert['repeat']:
-                continue
 
-            if not hide_details:
-                alert['id'] = alert['_id']
-                del alert['_id']
-                alertDetails.append(alert)
-
-            total += 1
-            if alert['status'] == 'OPEN':
-                opened += 1
-            if alert['status'] == 'ACK':
-                ack += 1
-            if alert['status'] == 'CLOSED':
-                closed += 1
-
-            # Only OPEN or NORMAL alerts contribute to the severity counts
-            if alert['severity'] != 'NORMAL' and alert['status'] != 'OPEN':
-                continue
-            if alert['severity'] == 'CRITICAL':
-                critical += 1
-            elif alert['severity'] == 'MAJOR':
-                major += 1
-            elif alert['severity'] == 'MINOR':
-                minor += 1
-            elif alert['severity'] == 'WARNING':
-                warning += 1
-            elif alert['severity'] == 'NORMAL':
-                normal += 1
-            elif alert['severity'] == 'INFORM':
-                inform += 1
-            elif alert['severity'] == 'DEBUG':
-                debug += 1
-
-        stat = { 'open': opened,
-                 'ack': ack,
-                 'closed': closed
-        }
-        logging.info('statusCounts %s', stat)
+        # Status bars only want the counts, so count on the server and skip reading the alerts
+        counted = False
+        if hide_details and not page:
+            logging.debug('MongoDB GET counts -> alerts.aggregate(%s)', counts_pipeline(query, sortby, limit, hide_repeats))
+            try:
+                total, stat, sev = aggregate_counts(alerts, query, sortby, limit, hide_repeats)
+                counted = True
+            except Exception, e:
+                logging.warning('Failed to aggregate alert counts, counting alerts instead: %s', e)
+                total = 0
+                stat, sev = new_counts()
+
+        if not counted:
+            logging.debug('MongoDB GET all -> alerts.find(%s, %s, sort=%s).limit(%s)', query, fields, sortby, limit)
+
+            cursor = alerts.find(query, fields, sort=sortby).limit(limit)
+            if page:
+                cursor = page.alerts(cursor)
+            for alert in cursor:
+                if alert['severity'] in hide_repeats and alert['repeat']:
+                    continue
+
+                if not hide_details:
+                    alert['id'] = alert['_id']
+                    del alert['_id']
+                    alertDetails.append(alert)
+
+                total += 1
+                count_alert(stat, sev, alert['status'], alert['severity'])
 
-        sev = { 'critical': critical,
-                'major': major,
-                'minor': minor,
-                'warning': warning,
-                'normal': normal,
-                'inform': inform,
-                'debug': debug
-        }
+        logging.info('statusCounts %s', stat)
         logging.info('severityCounts %s', sev)
 
         status['response']['alerts'] = { 'statusCounts': stat, 'severityCounts': sev, 'alertDetails': list(alertDetails) }
+        if page:
+            status['response']['next'] = page.next_token()
+        status['response']['changeToken'] = change_token(issued)
 
         diff = time.time() - start
         status['response']['status'] = 'ok'
@@ -280,12 +295,84 @@ def main():
         status['response']['total'] = total
         status['response']['localTime'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
 
+        cache.put(key, version, dict(status['response']))
+
         diff = int(diff * 1000) # management status needs time in milliseconds
         mgmt.update(
             { "group": "requests", "name": "complex_get", "type": "timer", "title": "Complex GET requests", "description": "Requests to the alert status API" },
             { '$inc': { "count": 1, "totalTime": diff}},
             True)
 
+    # Only the alerts changed or deleted since the change token from the previous request
+    m = re.search(r'GET /alerta/api/v1/alerts/changes$', request)
+    if m:
+        logging.debug('form %s' % form)
+
+        issued = utcnow()
+        try:
+            since = parse_change_token(form.pop('since', [None])[0])
+        except ValueError, e:
+            error = 'since must be a change token - %s' % e
+            m = None
+
+    if m:
+        hide_repeats = form.pop('hide-alert-repeats', [])
+        show_history = form.pop('hide-alert-history', ['false'])[0] != 'true'
+        for f in ['hide-alert-details', 'fields', 'limit', 'sort-by', 'from-date', 'page-size', 'next', 'order']:
+            form.pop(f, None)
+
+        query = compile_filter(form)
+
+        if token_expired(since, issued):
+            # Deleted alerts may have been forgotten, so the client must reload all alerts
+            status['response']['changes'] = { 'reset': True }
+            total = 0
+        else:
+            logging.debug('MongoDB GET changes -> alerts.find(%s)', { 'modifyTime': { '$gte': since } })
+            changed = set(alert['_id'] for alert in alerts.find({ 'modifyTime': { '$gte': since } }, { '_id': 1 }))
+
+            # Changed alerts that no longer match the filter or are now hidden repeats are removed
+            # by the client like deleted ones
+            alertDetails = list()
+            matched = set()
+            if show_history and MAX_HISTORY:
+                fields = { 'history': { '$slice': MAX_HISTORY } }
+            else:
+                fields = { 'history': 0 }
+            if changed:
+                for alert in alerts.find(dict(query, _id={ '$in': list(changed) }), fields):
+                    if alert['severity'] in hide_repeats and alert['repeat']:
+                        continue
+                    matched.add(alert['_id'])
+                    alert['id'] = alert['_id']
+                    del alert['_id']
+                    alertDetails.append(alert)
+
+            deleted = (changed - matched) | set(get_deletions(db.deleted, since))
+
+            # Counts are for all matching alerts, so the status bar does not need a separate request
+            sortby = [('lastReceiveTime', -1)]
+            try:
+                total, stat, sev = aggregate_counts(alerts, query, sortby, 0, hide_repeats)
+            except Exception, e:
+                logging.warning('Failed to aggregate alert counts, counting alerts instead: %s', e)
+                total, stat, sev = find_counts(alerts, query, sortby, 0, hide_repeats)
+
+            status['response']['changes'] = { 'statusCounts': stat, 'severityCounts': sev, 'alertDetails': alertDetails, 'deleted': sorted(deleted) }
+
+        diff = time.time() - start
+        status['response']['status'] = 'ok'
+        status['response']['next'] = change_token(issued)
+        status['response']['time'] = "%.3f" % diff
+        status['response']['total'] = total
+        status['response']['localTime'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+
+        diff = int(diff * 1000) # management status needs time in milliseconds
+        mgmt.update(
+            { "group": "requests", "name": "changes", "type": "timer", "title": "Changes GET requests", "description": "Requests for alerts changed since the last request" },
+            { '$inc': { "count": 1, "totalTime": diff}},
+            True)
+
     m = re.search(r'(PUT|POST) /alerta/api/v1/alerts/alert/(?P<id>[a-z0-9-]+)$', request)
     if m:
         alertid = m.group('id')
@@ -294,6 +381,7 @@ def main():
 
         update = data
         update['repeat'] = False
+        update['modifyTime'] = utcnow()
 
         logging.debug('MongoDB MODIFY -> alerts.update(%s, { $set: %s })', query, update)
         error = alerts.update(query, { '$set': update }, safe=True)
@@ -304,8 +392,10 @@ def main():
             if 'status' in update:
                 updateTime = datetime.datetime.utcnow()
                 updateTime = updateTime.replace(tzinfo=pytz.utc)
-                alerts.update(query, { '$push': { "history": { "status": update['status'], "updateTime": updateTime } }})
+                entries = [{ "status": update['status'], "updateTime": updateTime }]
+                alerts.update(query, push_history(dict(), entries, HISTORY_SIZE))
                 alert = alerts.find_one(query, {"history": 0})
+                record_history(history, history_docs(alert['_id'], entries))
 
                 alertid = alert['_id']
                 alert['id'] = alert['_id']
@@ -317,23 +407,13 @@ def main():
                 headers['correlation-id'] = alertid
 
                 try:
-                    conn = stomp.Connection(BROKER_LIST)
-                    conn.start()
-                    conn.connect(wait=True)
-                except Exception, e:
-                    print >>sys.stderr, "ERROR: Could not connect to broker - %s" % e
-                    logging.error('Could not connect to broker %s', e)
-                try:
-                    logging.info('%s : Fwd alert to %s', alertid, NOTIFY_TOPIC)
-                    conn.send(json.dumps(alert, cls=DateEncoder), headers, destination=NOTIFY_TOPIC)
-                    logging.info('%s : Fwd alert to %s', alertid, LOGGER_QUEUE)
-                    conn.send(json.dumps(alert, cls=DateEncoder), headers, destination=LOGGER_QUEUE)
+                    logging.info('%s : Fwd alert to %s and %s', alertid, NOTIFY_TOPIC, LOGGER_QUEUE)
+                    broker = send_to_broker(BROKER_LIST, dumps(alert), headers, [NOTIFY_TOPIC, LOGGER_QUEUE])
                 except Exception, e:
                     print >>sys.stderr, "ERROR: Failed to send alert to broker - %s " % e
                     logging.error('Failed to send alert to broker %s', e)
-                broker = conn.get_host_and_port()
-                logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
-                conn.disconnect()
+                else:
+                    logging.info('%s : Alert sent to %s:%s', alertid, broker[0], str(broker[1]))
         else:
             status['response']['status'] = 'error'
             status['response']['message'] = 'No existing alert with that ID found'
@@ -355,7 +435,7 @@ def main():
         tag = data
 
         logging.info('MongoDB TAG -> alerts.update(%s, { $push: %s })', query, tag)
-        error = alerts.update(query, { '$push': tag }, safe=True)
+        error = alerts.update(query, { '$push': tag, '$set': { "modifyTime": utcnow() } }, safe=True)
         if error['ok'] == 1:
             status['response']['status'] = 'ok'
 
@@ -374,10 +454,14 @@ def main():
         query['_id'] = dict()
         query['_id']['$regex'] = '^'+m.group('id')
 
+        # Remember the deleted ids so clients polling for changes remove them too
+        alertids = [alert['_id'] for alert in alerts.find(query, { '_id': 1 })]
+
         logging.info('MongoDB DELETE -> alerts.remove(%s)', query)
-        error = alerts.remove(query, safe=True)
+        error = alerts.remove({ '_id': { '$in': alertids } }, safe=True)
         if error['ok'] == 1:
             status['response']['status'] = 'ok'
+            record_deletions(db.deleted, alertids)
 
         diff = time.time() - start
         status['response']['time'] = "%.3f" % diff
@@ -406,17 +490,7 @@ def main():
 
         sortby = list()
 
-        query = dict()
-        for field in form:
-            if field in ['callback', '_']:
-                continue
-            if len(form[field]) == 1:
-                query[field] = dict()
-                query[field]['$regex'] = form[field][0]
-                query[field]['$options'] = 'i'  # case insensitive search
-            else:
-                query[field] = dict()
-                query[field]['$in'] = form[field]
+        query = compile_filter(form)
 
         if not len(fields): fields = None
         logging.debug('MongoDB GET all -> alerts.find(%s, %s, sort=%s).limit(%s)', query, fields, sortby, limit)
@@ -462,19 +536,14 @@ def main():
             { '$inc': { "count": 1, "totalTime": diff}},
             True)
 
-    content = json.dumps(status, cls=DateEncoder)
+    content = dumps(status)
     if 'callback' in form:
         content = '%s(%s);' % (form['callback'][0], content)
 
-    print "Content-Type: application/javascript; charset=utf-8"
-    print "Content-Length: %s" % len(content)
-    print "Expires: -1"
-    print "Cache-Control: no-cache"
-    print "Pragma: no-cache"
-    print ""
-    print content
-
     logging.info('Request %s completed in %sms', request, diff)
+    return content
+
+application = wsgi_application(handle)
 
 if __name__ == '__main__':
-    main()
+    run_cgi(handle)
@@ -13,35 +13,33 @@ except ImportError:
     import simplejson as json
 import time
 import datetime
-import pymongo
 import urlparse
 import logging
 import re
 
+sys.path.insert(0, '/opt/alerta/lib')
+from alerta.codec import dumps
+from alerta.histogram import PERCENTILES, percentile
+from alerta.heartbeats import HEARTBEAT_TIMEOUT, heartbeat_age
+from alerta.webapp import get_db, run_cgi, wsgi_application
+
 __version__ = '1.1.0'
 
 LOGFILE = '/var/log/alerta/alert-mgmt.log'
 
-# Extend JSON Encoder to support ISO 8601 format dates
-class DateEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime.date, datetime.datetime)):
-            return obj.replace(microsecond=0).isoformat() + ".%03dZ" % (obj.microsecond//1000)
-        else:
-            return json.JSONEncoder.default(self, obj)
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s alert-mgmt[%(process)d] %(levelname)s - %(message)s", filename=LOGFILE)
 
-def main():
+def handle(environ, body):
 
     start = time.time()
 
-    logging.basicConfig(level=logging.DEBUG, format="%(asctime)s alert-mgmt[%(process)d] %(levelname)s - %(message)s", filename=LOGFILE)
-    logging.info('Received HTTP request %s %s' % (os.environ['REQUEST_METHOD'], os.environ['REQUEST_URI']))
+    logging.info('Received HTTP request %s %s' % (environ['REQUEST_METHOD'], environ['REQUEST_URI']))
 
     # Get HTTP method and any body data
-    method = os.environ['REQUEST_METHOD']
+    method = environ['REQUEST_METHOD']
     if method in ['PUT', 'POST']:
         try:
-            data = json.loads(sys.stdin.read())
+            data = json.loads(body)
         except ValueError, e:
             data = list()
             logging.warning('Failed to get data - %s', e)
@@ -50,13 +48,12 @@ def main():
             method = data['_method'].upper()
 
     # Parse RESTful URI
-    uri = urlparse.urlsplit(os.environ['REQUEST_URI'])
-    form = urlparse.parse_qs(os.environ['QUERY_STRING'])
+    uri = urlparse.urlsplit(environ['REQUEST_URI'])
+    form = urlparse.parse_qs(environ['QUERY_STRING'])
     request = method + ' ' + uri.path
 
-    # Connection to MongoDB
-    mongo = pymongo.Connection()
-    db = mongo.monitoring
+    # Connections are kept between requests when run under WSGI
+    db = get_db()
     alerts = db.alerts
     mgmt = db.status
     hb = db.heartbeats
@@ -69,7 +66,12 @@ def main():
     if m:
         status['heartbeats'] = list()
 
+        # Heartbeats are written by alerta every HEARTBEAT_INTERVAL seconds, work out which are late now
+        now = time.time()
         for hb in hb.find({}, {"_id": 0, "type": 0}):
+            if hb.get('receiveTime'):
+                hb['age'] = int(heartbeat_age(hb, now))
+                hb['late'] = hb['age'] > HEARTBEAT_TIMEOUT
             status['heartbeats'].append(hb)
 
     m = re.search(r'GET /alerta/management/status$', request)
@@ -78,6 +80,11 @@ def main():
 
         for stat in mgmt.find({}, {"_id": 0}):
             logging.debug('%s', json.dumps(stat))
+            if stat['type'] == 'histogram':
+                for pct in PERCENTILES:
+                    stat['p%d' % pct] = percentile(stat.get('buckets', dict()), pct)
+            if stat['group'] == 'cache' and stat.get('count'):
+                stat['hitRate'] = round(100.0 * (stat.get('hits', 0) + stat.get('notModified', 0)) / stat['count'], 1) # percent of requests not run against the database
             status['metrics'].append(stat)
 
         for sev in ['CRITICAL', 'MAJOR', 'MINOR', 'WARNING', 'NORMAL', 'INFORM', 'DEBUG']:
@@ -102,19 +109,14 @@ def main():
 
     diff = time.time() - start
 
-    content = json.dumps(status, cls=DateEncoder)
+    content = dumps(status)
     if 'callback' in form:
         content = '%s(%s);' % (form['callback'][0], content)
 
-    print "Content-Type: application/javascript; charset=utf-8"
-    print "Content-Length: %s" % len(content)
-    print "Expires: -1"
-    print "Cache-Control: no-cache"
-    print "Pragma: no-cache"
-    print ""
-    print content
-
     logging.info('Request %s completed in %sms', request, diff)
+    return content
+
+application = wsgi_application(handle)
 
 if __name__ == '__main__':
-    main()
+    run_cgi(handle)
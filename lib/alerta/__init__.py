@@ -0,0 +1,7 @@
+########################################
+#
+# alerta - Alerta shared library
+#
+########################################
+
+__version__ = '1.0.0'
@@ -0,0 +1,44 @@
+########################################
+#
+# alert.py - Alert model
+#
+########################################
+
+FIELDS = (
+    'id',
+    'resource',
+    'event',
+    'group',
+    'value',
+    'severity',
+    'severityCode',
+    'environment',
+    'service',
+    'text',
+    'type',
+    'tags',
+    'summary',
+    'createTime',
+    'receiveTime',
+    'origin',
+    'thresholdInfo',
+    'timeout',
+    'correlatedEvents',
+)
+
+# An alert as sent to the alert queue. Alerts are decoded, copied and encoded for every message
+# so an alert is a plain dict underneath, and all of that runs in the built in dict and json
+# code. The class names the standard fields and converts to and from plain dicts.
+class Alert(dict):
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d)
+
+    def to_dict(self):
+        return dict(self)
+
+    def __repr__(self):
+        return 'Alert(%s)' % dict.__repr__(self)
@@ -0,0 +1,127 @@
+########################################
+#
+# cache.py - Alert API response cache
+#
+########################################
+
+import time
+import datetime
+import threading
+import hashlib
+
+from alerta.changes import CHANGES_OVERLAP
+from alerta.timestamp import format_date, utcnow
+
+CACHE_TTL = 5 # seconds a cached response is served for, bounds anything a change to the alerts does not cover
+CACHE_SIZE = 256 # responses kept per process
+STATS_INTERVAL = 10 # seconds between writes of cache hit counts, the first request in a process always writes them
+
+# Dashboards and wall screens poll the same few URLs. Responses are cached by the normalized
+# query string together with a version made from the time of the last change to any alert (see
+# last_change in changes.py), so a cached response is only served while no alert has been
+# written or deleted, by this process or any other. The same pair is the ETag, so a client that
+# already has the response gets 304 Not Modified without the query being run at all.
+
+# Fields that do not change the response, eg. the jQuery cache buster
+IGNORE_FIELDS = ('callback', '_')
+
+# Fields where the order of the values changes the response
+ORDERED_FIELDS = ('sort-by',)
+
+def cache_key(path, form):
+
+    fields = list()
+    for field in sorted(form):
+        if field in IGNORE_FIELDS:
+            continue
+        values = form[field] if field in ORDERED_FIELDS else sorted(form[field])
+        fields.append('%s=%s' % (field, ','.join(values)))
+    return path + '?' + '&'.join(fields)
+
+# Writes are stamped with modifyTime before they are made, so a write stamped before the last
+# change can still land up to CHANGES_OVERLAP seconds after it without changing the version.
+# Until then the version also changes every ttl seconds, so neither the cache nor a 304 can hold
+# a stale response for longer than that. Once the alerts have been quiet for CHANGES_OVERLAP
+# the version only changes with them.
+def cache_version(changed, ttl=CACHE_TTL, now=None):
+
+    if changed is None:
+        return ''
+    version = format_date(changed)
+    if (now or utcnow()) - changed < datetime.timedelta(seconds=CHANGES_OVERLAP):
+        version += ' %d' % (time.time() // ttl)
+    return version
+
+# The JSONP callback wraps the response so is part of the ETag but not the cache key
+def response_etag(key, version, callback=None):
+
+    return '"%s"' % hashlib.md5('%s %s %s' % (key, version, callback or '')).hexdigest()
+
+# True if an If-None-Match header matches the ETag
+def etag_matches(if_none_match, etag):
+
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+class ResponseCache(object):
+
+    def __init__(self, ttl=CACHE_TTL, size=CACHE_SIZE, stats_interval=STATS_INTERVAL):
+
+        self.ttl = ttl
+        self.size = size
+        self.entries = dict() # key -> (version, expires, response)
+        self.lock = threading.Lock()
+        self.stats_interval = stats_interval
+        self.stats = self.new_stats()
+        self.flushed = 0
+
+    def new_stats(self):
+
+        return { "count": 0, "hits": 0, "notModified": 0 }
+
+    # Count a request answered from the cache ('hits'), with 304 Not Modified ('notModified') or
+    # neither (None)
+    def count(self, result):
+
+        with self.lock:
+            self.stats['count'] += 1
+            if result:
+                self.stats[result] += 1
+
+    # Hit counts are kept in memory and returned for writing to the management status once every
+    # stats_interval seconds, so a cache hit does not cost a database write. Returns None if the
+    # counts are not due to be written.
+    def take_stats(self):
+
+        now = time.time()
+        with self.lock:
+            if now - self.flushed < self.stats_interval or not self.stats['count']:
+                return None
+            stats, self.stats = self.stats, self.new_stats()
+            self.flushed = now
+        return stats
+
+    def get(self, key, version):
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            cached_version, expires, response = entry
+            if cached_version != version or expires < time.time():
+                del self.entries[key]
+                return None
+            return response
+
+    def put(self, key, version, response):
+
+        now = time.time()
+        with self.lock:
+            if len(self.entries) >= self.size:
+                for k, (v, expires, r) in self.entries.items():
+                    if expires < now:
+                        del self.entries[k]
+                if len(self.entries) >= self.size:
+                    self.entries.clear()
+            self.entries[key] = (version, now + self.ttl, response)
@@ -0,0 +1,64 @@
+########################################
+#
+# changes.py - Alert change tracking
+#
+########################################
+
+import base64
+import datetime
+
+from alerta.timestamp import format_date, parse_date, utcnow, utc
+
+CHANGES_OVERLAP = 60 # seconds before a change token that are read again, covers clock skew between writers and writes in flight
+DELETED_TTL = 24 * 60 * 60 # seconds deleted alerts are remembered, older change tokens need a full reload
+
+# Every write to an alert sets modifyTime, and deleting an alert leaves a document with its id and
+# the time it was deleted in the deleted collection, so clients can ask for only the alerts that
+# changed since their last poll. A change token is the time the server started answering the
+# previous request. Changes are read from CHANGES_OVERLAP seconds before it, so a change can be
+# returned more than once but is not missed, and clients replace alerts by id.
+
+def change_token(now=None):
+
+    return base64.urlsafe_b64encode(format_date(now or utcnow()))
+
+# Returns the time to read changes from, or raises ValueError for a token that was not issued by
+# change_token
+def parse_change_token(token):
+
+    if not token:
+        raise ValueError('missing change token')
+    try:
+        since = parse_date(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        raise ValueError('invalid change token')
+    return since - datetime.timedelta(seconds=CHANGES_OVERLAP)
+
+# True if deletions before this time may already have been forgotten
+def token_expired(since, now=None):
+
+    return since < (now or utcnow()) - datetime.timedelta(seconds=DELETED_TTL)
+
+def record_deletions(deleted, alertids, now=None):
+
+    now = now or utcnow()
+    for alertid in alertids:
+        deleted.save({ "_id": alertid, "modifyTime": now })
+
+def get_deletions(deleted, since):
+
+    return [doc['_id'] for doc in deleted.find({ "modifyTime": { '$gte': since } }, { "_id": 1 })]
+
+# The time of the last write to or delete of any alert, read from the modifyTime indexes, or None
+# if there are none
+def last_change(db):
+
+    changed = None
+    for collection in [db.alerts, db.deleted]:
+        latest = list(collection.find({}, { "_id": 0, "modifyTime": 1 }, sort=[('modifyTime', -1)]).limit(1))
+        if latest and latest[0].get('modifyTime'):
+            modifyTime = latest[0]['modifyTime']
+            if modifyTime.tzinfo is None: # pymongo returns naive UTC datetimes unless tz_aware is set
+                modifyTime = modifyTime.replace(tzinfo=utc)
+            changed = max(changed, modifyTime) if changed else modifyTime
+    return changed
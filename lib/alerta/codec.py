@@ -0,0 +1,37 @@
+########################################
+#
+# codec.py - JSON encoding of alerts
+#
+########################################
+
+import datetime
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from alerta.timestamp import format_date
+
+# Extend JSON Encoder to support ISO 8601 format dates and objects with a to_dict method
+class DateEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime.datetime):
+            return format_date(obj)
+        elif isinstance(obj, datetime.date):
+            return obj.isoformat()
+        elif hasattr(obj, 'to_dict'):
+            return obj.to_dict()
+        else:
+            return json.JSONEncoder.default(self, obj)
+
+# One shared encoder, json.dumps(obj, cls=DateEncoder) builds a new encoder on every call
+_encoder = DateEncoder()
+_decoder = json.JSONDecoder()
+
+def dumps(obj, **kwargs):
+    if kwargs:
+        return json.dumps(obj, cls=DateEncoder, **kwargs)
+    return _encoder.encode(obj)
+
+def loads(s):
+    return _decoder.decode(s)
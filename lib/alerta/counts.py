@@ -0,0 +1,67 @@
+########################################
+#
+# counts.py - Alert status and severity counts
+#
+########################################
+
+from bson.son import SON
+
+STATUS_COUNTS = [ 'OPEN', 'ACK', 'CLOSED' ]
+SEVERITY_COUNTS = [ 'CRITICAL', 'MAJOR', 'MINOR', 'WARNING', 'NORMAL', 'INFORM', 'DEBUG' ]
+
+def new_counts():
+
+    stat = dict((status.lower(), 0) for status in STATUS_COUNTS)
+    sev = dict((severity.lower(), 0) for severity in SEVERITY_COUNTS)
+    return stat, sev
+
+def count_alert(stat, sev, status, severity, count=1):
+
+    if status in STATUS_COUNTS:
+        stat[status.lower()] += count
+
+    # Only OPEN or NORMAL alerts contribute to the severity counts
+    if severity != 'NORMAL' and status != 'OPEN':
+        return
+    if severity in SEVERITY_COUNTS:
+        sev[severity.lower()] += count
+
+# Group the alerts a listing would return by status and severity. A limit applies to the sorted
+# alerts before repeats are hidden, as it does for the listing.
+def counts_pipeline(query, sortby, limit, hide_repeats):
+
+    pipeline = [{ '$match': query }]
+    if limit:
+        pipeline.append({ '$sort': SON(sortby) })
+        pipeline.append({ '$limit': limit })
+    if hide_repeats:
+        pipeline.append({ '$match': { '$or': [{ 'severity': { '$nin': hide_repeats } }, { 'repeat': { '$ne': True } }] } })
+    pipeline.append({ '$group': { '_id': { 'status': '$status', 'severity': '$severity' }, 'count': { '$sum': 1 } } })
+    return pipeline
+
+# Returns (total, statusCounts, severityCounts) by reading every alert, for servers that cannot
+# run the aggregation
+def find_counts(alerts, query, sortby, limit, hide_repeats):
+
+    total = 0
+    stat, sev = new_counts()
+    for alert in alerts.find(query, { "severity": 1, "status": 1, "repeat": 1 }, sort=sortby).limit(limit):
+        if alert['severity'] in hide_repeats and alert.get('repeat'):
+            continue
+        total += 1
+        count_alert(stat, sev, alert['status'], alert['severity'])
+    return total, stat, sev
+
+# Returns (total, statusCounts, severityCounts) without reading any alert documents
+def aggregate_counts(alerts, query, sortby, limit, hide_repeats):
+
+    result = alerts.aggregate(counts_pipeline(query, sortby, limit, hide_repeats))
+    if isinstance(result, dict): # pymongo 2.x returns the command response
+        result = result['result']
+
+    total = 0
+    stat, sev = new_counts()
+    for group in result:
+        total += group['count']
+        count_alert(stat, sev, group['_id'].get('status'), group['_id'].get('severity'), group['count'])
+    return total, stat, sev
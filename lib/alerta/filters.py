@@ -0,0 +1,67 @@
+########################################
+#
+# filters.py - Alert API query string filters
+#
+########################################
+
+import re
+
+# Filters are compiled so that the common case, a field equal to a value, is an exact match that
+# can use an index. Each single value is one of:
+#
+#   value       exact match, eg. environment=PROD or resource=web01.gudev.gnl
+#   value*      case sensitive prefix match, anchored so it can use an index, eg. resource=web*
+#   ~regex      case insensitive regular expression, eg. service=~frontend
+#   regex       a value with any of ^$*+?{}[]\|() in it is a case sensitive regular expression,
+#               eg. service=R2|R1 or service=^Network
+#
+# Several values for a field match any of them exactly. A field starting with '-' negates it.
+REGEX_CHARS = re.compile(r'[\^$*+?{}\[\]\\|()]')
+
+ALERT_ID_LENGTH = 36 # length of a full uuid4 alert id
+
+# Compile one value into (operator, argument) where operator is None for an exact match
+def compile_value(value):
+
+    if value.startswith('~'):
+        return '$regex', re.compile(value[1:], re.IGNORECASE)
+    elif value.endswith('*') and not REGEX_CHARS.search(value[:-1]):
+        return '$regex', re.compile('^' + re.escape(value[:-1]))
+    elif REGEX_CHARS.search(value):
+        return '$regex', re.compile(value)
+    return None, value
+
+def compile_field(values, negate=False):
+
+    if len(values) > 1:
+        return { '$nin' if negate else '$in': values }
+
+    op, arg = compile_value(values[0])
+    if op is None:
+        return { '$ne': arg } if negate else arg
+    elif negate:
+        return { '$not': arg }
+    return arg
+
+# Alert ids match by prefix so that the short ids shown in the console can be used
+def compile_id(value):
+
+    if len(value) == ALERT_ID_LENGTH:
+        return value
+    return re.compile('^' + re.escape(value))
+
+# Build a MongoDB query from the filter fields of a parsed query string. Fields in ignore, eg.
+# the JSONP callback, are skipped.
+def compile_filter(form, ignore=('callback', '_')):
+
+    query = dict()
+    for field, values in form.items():
+        if field in ignore:
+            continue
+        if field == 'id':
+            query['_id'] = compile_id(values[0])
+        elif field.startswith('-'):
+            query[field[1:]] = compile_field(values, negate=True)
+        else:
+            query[field] = compile_field(values)
+    return query
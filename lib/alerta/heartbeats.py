@@ -0,0 +1,114 @@
+########################################
+#
+# heartbeats.py - Coalesced heartbeat state
+#
+########################################
+
+import time
+import calendar
+import threading
+import logging
+
+from alerta.timestamp import utc
+
+HEARTBEAT_INTERVAL = 5 # seconds between writes of received heartbeats
+HEARTBEAT_TIMEOUT = 300 # seconds without a heartbeat before an origin is late
+
+# Seconds since a heartbeat was received, for naive (UTC) and timezone aware receive times
+def heartbeat_age(heartbeat, now=None):
+
+    if now is None:
+        now = time.time()
+    return now - calendar.timegm(heartbeat['receiveTime'].utctimetuple())
+
+# The latest heartbeat from each origin is kept in memory and only origins that have sent a
+# heartbeat since the last flush are written to the heartbeats collection, once per interval,
+# so receiving a heartbeat never costs a database write. Origins that stop sending heartbeats
+# are detected on the same interval.
+class Heartbeats(object):
+
+    def __init__(self, hb, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT, metrics=None):
+        self.hb = hb
+        self.interval = interval
+        self.timeout = timeout
+        self.metrics = metrics
+        self.latest = dict() # origin -> heartbeat
+        self.dirty = set()
+        self.late = set()
+        self.lock = threading.Lock()
+        self.shutdown = threading.Event()
+        self.thread = None
+
+    # Start from the heartbeats already saved so that origins that do not come back are detected
+    def load(self):
+        for heartbeat in self.hb.find({}, { "_id": 0 }):
+            for field in ['createTime', 'receiveTime']:
+                if heartbeat.get(field) and heartbeat[field].tzinfo is None:
+                    heartbeat[field] = heartbeat[field].replace(tzinfo=utc)
+            if heartbeat.get('origin') and heartbeat.get('receiveTime'):
+                self.latest[heartbeat['origin']] = heartbeat
+        logging.info('Loaded %d heartbeats', len(self.latest))
+
+    # Record a heartbeat. Heartbeats older than the latest from the same origin are ignored.
+    def receive(self, origin, version, createTime, receiveTime):
+        with self.lock:
+            current = self.latest.get(origin)
+            if current and current.get('createTime') and current['createTime'] > createTime:
+                return False
+            self.latest[origin] = { "origin": origin, "version": version, "createTime": createTime, "receiveTime": receiveTime }
+            self.dirty.add(origin)
+            return True
+
+    def check(self, now=None):
+        with self.lock:
+            heartbeats = self.latest.values()
+
+        late = set(heartbeat['origin'] for heartbeat in heartbeats if heartbeat_age(heartbeat, now) > self.timeout)
+        for origin in late - self.late:
+            logging.warning('Heartbeat from %s is late, none received for more than %d seconds', origin, self.timeout)
+        for origin in self.late - late:
+            logging.info('Heartbeat from %s received again', origin)
+        self.late = late
+
+        if self.metrics:
+            self.metrics.gauge("heartbeats", "late", "Late heartbeats", "Number of origins that have not sent a heartbeat within the timeout", len(late))
+        return late
+
+    def flush(self):
+        with self.lock:
+            heartbeats = [self.latest[origin] for origin in self.dirty]
+            self.dirty = set()
+
+        if not heartbeats:
+            return
+        try:
+            if hasattr(self.hb, 'initialize_unordered_bulk_op'):
+                bulk = self.hb.initialize_unordered_bulk_op()
+                for heartbeat in heartbeats:
+                    bulk.find({ "origin": heartbeat['origin'] }).upsert().replace_one(heartbeat)
+                bulk.execute()
+            else:
+                for heartbeat in heartbeats:
+                    self.hb.update({ "origin": heartbeat['origin'] }, heartbeat, True)
+        except Exception, e:
+            logging.error('Failed to write %d heartbeats: %s', len(heartbeats), e)
+            with self.lock:
+                self.dirty.update(heartbeat['origin'] for heartbeat in heartbeats)
+        else:
+            logging.debug('Flushed %d heartbeats', len(heartbeats))
+
+    def run(self):
+        while not self.shutdown.wait(self.interval):
+            self.flush()
+            self.check()
+        self.flush()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='HeartbeatFlusher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown.set()
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,32 @@
+########################################
+#
+# histogram.py - Latency histograms
+#
+########################################
+
+import bisect
+
+# Bucket upper bounds in milliseconds. A histogram is a count per bucket, keyed by the bucket
+# number as a string so it can be stored in MongoDB and added to with $inc from any number of
+# processes. The last bucket (len(BUCKETS)) counts anything slower than BUCKETS[-1].
+BUCKETS = [ 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000 ]
+
+PERCENTILES = [ 50, 90, 99 ]
+
+def bucket(elapsed):
+    return str(bisect.bisect_left(BUCKETS, elapsed))
+
+# Estimate a percentile from bucket counts as the upper bound of the bucket it falls in. Returns
+# None for an empty histogram and BUCKETS[-1] if it falls in the overflow bucket.
+def percentile(buckets, pct):
+
+    total = sum(buckets.values())
+    if not total:
+        return None
+    rank = pct / 100.0 * total
+    seen = 0
+    for i in range(len(BUCKETS)):
+        seen += buckets.get(str(i), 0)
+        if seen >= rank:
+            return BUCKETS[i]
+    return BUCKETS[-1]
@@ -0,0 +1,51 @@
+########################################
+#
+# history.py - Alert history store
+#
+########################################
+
+import logging
+
+HISTORY_SIZE = 10               # most recent history entries kept on the alert document
+HISTORY_TTL  = 30 * 24 * 60 * 60 # seconds history is kept in the history collection
+
+# Every history entry is written to the history collection, one document per entry keyed by the
+# alert id and the time of the entry, and expired by a TTL index. The alert document only keeps
+# the most recent HISTORY_SIZE entries so that it does not grow without limit.
+
+# Build the history documents for entries belonging to an alert
+def history_docs(alertid, entries):
+
+    docs = list()
+    for entry in entries:
+        doc = dict(entry)
+        doc['alertid'] = alertid
+        doc['time'] = entry.get('updateTime') or entry.get('receiveTime')
+        docs.append(doc)
+    return docs
+
+# Add history entries to an alert update, trimming the history on the alert to the most recent
+# entries (needs MongoDB 2.4 or later)
+def push_history(update, entries, size=HISTORY_SIZE):
+
+    update.setdefault('$push', dict())['history'] = { '$each': [dict(entry) for entry in entries], '$slice': -size }
+    return update
+
+# Write history documents to the history collection in one insert
+def record_history(history, docs):
+
+    if not docs:
+        return
+    try:
+        history.insert(docs, safe=True)
+    except Exception, e:
+        logging.error('Failed to write %d history entries: %s', len(docs), e)
+
+# Return the most recent history entries for an alert, oldest first
+def get_history(history, alertid, limit=HISTORY_SIZE):
+
+    entries = list()
+    for doc in history.find({ "alertid": alertid }, { "_id": 0, "alertid": 0, "time": 0 }, sort=[('time', -1)]).limit(limit):
+        entries.append(doc)
+    entries.reverse()
+    return entries
@@ -0,0 +1,118 @@
+########################################
+#
+# indexes.py - MongoDB indexes and the query shapes they serve
+#
+########################################
+
+import logging
+
+from alerta.history import HISTORY_TTL
+from alerta.changes import DELETED_TTL
+
+ASCENDING  = 1
+DESCENDING = -1
+
+# Indexes for the queries built by alerta.py, alert-dbapi.py, alert-mgmt.py and the sbin scripts.
+# Environment and correlatedEvents are arrays and MongoDB cannot build a compound index over two
+# array fields, so correlatedEvents queries use the (environment, resource) prefix.
+INDEXES = [
+    # collection, keys, name
+    ('alerts',     [('environment', ASCENDING), ('resource', ASCENDING), ('event', ASCENDING)], 'environment_resource_event'),
+    ('alerts',     [('lastReceiveTime', DESCENDING), ('_id', DESCENDING)],                       'lastReceiveTime_id'),
+    ('alerts',     [('status', ASCENDING), ('lastReceiveTime', DESCENDING)],                     'status_lastReceiveTime'),
+    ('alerts',     [('status', ASCENDING), ('expireTime', ASCENDING)],                           'status_expireTime'),
+    ('alerts',     [('severity', ASCENDING), ('status', ASCENDING)],                             'severity_status'),
+    ('alerts',     [('modifyTime', ASCENDING)],                                                  'modifyTime'),
+    ('deleted',    [('modifyTime', ASCENDING)],                                                  'modifyTime_ttl'),
+    ('history',    [('alertid', ASCENDING), ('time', DESCENDING)],                               'alertid_time'),
+    ('history',    [('time', ASCENDING)],                                                        'time_ttl'),
+    ('heartbeats', [('origin', ASCENDING)],                                                      'origin'),
+    ('status',     [('group', ASCENDING), ('name', ASCENDING)],                                  'group_name'),
+]
+
+# Indexes used by MongoDB to expire documents, and the seconds documents are kept
+TTL_INDEXES = { 'time_ttl': HISTORY_TTL, 'modifyTime_ttl': DELETED_TTL }
+
+# Query shapes replayed by the index advisor. Values in angle brackets are filled in from a
+# sample alert so the query is representative of the data.
+QUERY_SHAPES = [
+    # name, collection, query, sort
+    ('alerta: classify',            'alerts',     {'$or': [{'environment': '<environment>', 'resource': '<resource>'}]}, None),
+    ('alerta: duplicate',           'alerts',     {'environment': '<environment>', 'resource': '<resource>', 'event': '<event>', 'severity': '<severity>'}, None),
+    ('alerta: correlated',          'alerts',     {'environment': '<environment>', 'resource': '<resource>', 'correlatedEvents': '<event>'}, None),
+    ('dbapi: alerts',               'alerts',     {}, [('lastReceiveTime', DESCENDING)]),
+    ('dbapi: alerts by status',     'alerts',     {'status': {'$in': ['OPEN', 'ACK']}}, [('lastReceiveTime', DESCENDING)]),
+    ('dbapi: alerts from date',     'alerts',     {'lastReceiveTime': {'$gte': '<lastReceiveTime>'}}, [('lastReceiveTime', DESCENDING)]),
+    ('dbapi: alerts by resource',   'alerts',     {'environment': {'$in': '<environment>'}, 'resource': {'$in': ['<resource>']}}, [('lastReceiveTime', DESCENDING)]),
+    ('dbapi: alerts page',          'alerts',     {'$or': [{'lastReceiveTime': {'$lt': '<lastReceiveTime>'}}, {'lastReceiveTime': '<lastReceiveTime>', '_id': {'$lt': '<_id>'}}]}, [('lastReceiveTime', DESCENDING), ('_id', DESCENDING)]),
+    ('dbapi: changes',              'alerts',     {'modifyTime': {'$gte': '<lastReceiveTime>'}}, None),
+    ('dbapi: deleted',              'deleted',    {'modifyTime': {'$gte': '<lastReceiveTime>'}}, None),
+    ('dbapi: status bar',           'alerts',     {'environment': '<environment>', 'service': '<service>'}, [('lastReceiveTime', DESCENDING)]),
+    ('dbapi: history',              'history',    {'alertid': '<_id>'}, [('time', DESCENDING)]),
+    ('mgmt: severity count',        'alerts',     {'severity': '<severity>'}, None),
+    ('mgmt: status count',          'alerts',     {'status': 'OPEN'}, None),
+    ('mgmt: healthcheck',           'heartbeats', {}, None),
+    ('metrics: flush',              'status',     {'group': 'alerts', 'name': 'received'}, None),
+    ('expire: timed out',           'alerts',     {'status': 'OPEN', 'expireTime': {'$lt': '<lastReceiveTime>'}}, None),
+    ('expire: closed',              'alerts',     {'status': 'CLOSED', 'lastReceiveTime': {'$lt': '<lastReceiveTime>'}}, None),
+]
+
+# Shapes that read every document by design, so a collection scan is expected
+FULL_SCANS = [ 'mgmt: healthcheck' ]
+
+# Create any missing indexes. Indexes are built in the background so that a first start against
+# a large existing database does not block writes.
+def ensure_indexes(db, history_ttl=HISTORY_TTL):
+
+    ttls = dict(TTL_INDEXES, time_ttl=history_ttl)
+    for collection, keys, name in INDEXES:
+        options = dict(name=name, background=True)
+        if name in ttls:
+            options['expireAfterSeconds'] = ttls[name]
+        try:
+            db[collection].ensure_index(keys, **options)
+        except Exception, e:
+            logging.error('Failed to create index %s on %s: %s', name, collection, e)
+        else:
+            logging.debug('Index %s on %s ok', name, collection)
+
+# Replace the placeholders in a query shape with values from a sample alert
+def fill_shape(value, sample):
+
+    if isinstance(value, dict):
+        return dict((k, fill_shape(v, sample)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [fill_shape(v, sample) for v in value]
+    elif isinstance(value, basestring) and value.startswith('<') and value.endswith('>'):
+        return sample.get(value[1:-1])
+    return value
+
+# Summarise explain output as (indexes used, collection scan, documents scanned, documents
+# returned, milliseconds). Handles both the legacy format (cursor/nscanned) and the query
+# planner format introduced in MongoDB 3.0.
+def explain_summary(explain):
+
+    indexes = list()
+    collscan = False
+
+    if 'queryPlanner' in explain:
+        stack = [explain['queryPlanner']['winningPlan']]
+        while stack:
+            stage = stack.pop()
+            if stage.get('stage') == 'COLLSCAN':
+                collscan = True
+            if 'indexName' in stage:
+                indexes.append(stage['indexName'])
+            if 'inputStage' in stage:
+                stack.append(stage['inputStage'])
+            stack.extend(stage.get('inputStages', list()))
+        stats = explain.get('executionStats', dict())
+        return indexes, collscan, stats.get('totalDocsExamined'), stats.get('nReturned'), stats.get('executionTimeMillis')
+
+    for clause in explain.get('clauses', [explain]):
+        cursor = clause.get('cursor', '')
+        if cursor.startswith('BasicCursor'):
+            collscan = True
+        elif cursor.startswith('BtreeCursor'):
+            indexes.append(cursor.split()[1])
+    return indexes, collscan, explain.get('nscanned'), explain.get('n'), explain.get('millis')
@@ -0,0 +1,96 @@
+########################################
+#
+# metrics.py - Buffered management statistics
+#
+########################################
+
+import time
+import threading
+import logging
+
+from alerta.histogram import bucket
+
+FLUSH_INTERVAL = 10 # seconds between writes to the management status collection
+
+# Counters, timers, histograms and gauges are accumulated in memory and written to the management
+# status collection (db.status) once per flush interval, so that recording a metric
+# never costs a database write.
+class Metrics(object):
+
+    def __init__(self, mgmt, interval=FLUSH_INTERVAL):
+        self.mgmt = mgmt
+        self.interval = interval
+        self.metrics = dict() # (group, name) -> metric
+        self.lock = threading.Lock()
+        self.shutdown = threading.Event()
+        self.thread = None
+
+    def _metric(self, group, name, type, title, description):
+        key = (group, name)
+        metric = self.metrics.get(key)
+        if not metric:
+            metric = { "group": group, "name": name, "type": type, "title": title, "description": description,
+                       "count": 0, "totalTime": 0, "value": None }
+            self.metrics[key] = metric
+        return metric
+
+    def counter(self, group, name, title, description, count=1):
+        with self.lock:
+            self._metric(group, name, 'counter', title, description)['count'] += count
+
+    def timer(self, group, name, title, description, elapsed, count=1):
+        with self.lock:
+            metric = self._metric(group, name, 'timer', title, description)
+            metric['count'] += count
+            metric['totalTime'] += elapsed
+
+    def histogram(self, group, name, title, description, elapsed):
+        with self.lock:
+            metric = self._metric(group, name, 'histogram', title, description)
+            metric['count'] += 1
+            metric['totalTime'] += elapsed
+            buckets = metric.setdefault('buckets', dict())
+            key = bucket(elapsed)
+            buckets[key] = buckets.get(key, 0) + 1
+
+    def gauge(self, group, name, title, description, value):
+        with self.lock:
+            self._metric(group, name, 'gauge', title, description)['value'] = value
+
+    def flush(self):
+        with self.lock:
+            metrics = self.metrics
+            self.metrics = dict()
+
+        for metric in metrics.values():
+            query = { "group": metric['group'], "name": metric['name'], "type": metric['type'], "title": metric['title'], "description": metric['description'] }
+            if metric['type'] == 'gauge':
+                update = { '$set': { "value": metric['value'] }}
+            elif metric['type'] == 'timer':
+                update = { '$inc': { "count": metric['count'], "totalTime": round(metric['totalTime'], 3) }}
+            elif metric['type'] == 'histogram':
+                update = { '$inc': { "count": metric['count'], "totalTime": round(metric['totalTime'], 3) }}
+                for key, count in metric['buckets'].items():
+                    update['$inc']['buckets.%s' % key] = count
+            else:
+                update = { '$inc': { "count": metric['count'] }}
+            try:
+                self.mgmt.update(query, update, True)
+            except Exception, e:
+                logging.error('Failed to write management status %s/%s: %s', metric['group'], metric['name'], e)
+        logging.debug('Flushed %d management metrics', len(metrics))
+
+    def run(self):
+        while not self.shutdown.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='MetricsFlusher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown.set()
+        if self.thread:
+            self.thread.join()
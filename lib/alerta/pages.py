@@ -0,0 +1,84 @@
+########################################
+#
+# pages.py - Keyset pagination of alert listings
+#
+########################################
+
+import base64
+
+from alerta.codec import dumps, loads
+from alerta.timestamp import format_date, parse_date
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000 # hard limit on alerts returned in one page
+
+ORDERS = { 'desc': -1, 'asc': 1 }
+
+# Alerts are paged in (lastReceiveTime, _id) order, newest first by default. The next token holds
+# the position of the last alert in a page and the order, so the next page is a range query on the
+# lastReceiveTime_id index from that position however many alerts came before it, and alerts
+# that change while a client is paging do not shift the pages after them.
+class Page(object):
+
+    def __init__(self, size=None, token=None, order=None):
+
+        try:
+            self.size = min(int(size or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValueError('page-size must be a number')
+        if self.size < 1:
+            raise ValueError('page-size must be at least 1')
+
+        # A token carries on in the order the first page was requested in
+        self.after = None
+        if token:
+            try:
+                lastReceiveTime, alertid, order = loads(base64.urlsafe_b64decode(str(token)))
+                self.after = (parse_date(lastReceiveTime), alertid)
+            except Exception:
+                raise ValueError('invalid next token')
+        self.order = order or 'desc'
+        if self.order not in ORDERS:
+            raise ValueError('order must be one of %s' % ', '.join(ORDERS))
+
+        self.last = None
+        self.more = False
+
+    def sort(self):
+        direction = ORDERS[self.order]
+        return [('lastReceiveTime', direction), ('_id', direction)]
+
+    # Add the start of the page to a query
+    def query(self, query):
+
+        if not self.after:
+            return query
+        lastReceiveTime, alertid = self.after
+        op = '$lt' if self.order == 'desc' else '$gt'
+        keyset = { '$or': [{ 'lastReceiveTime': { op: lastReceiveTime } }, { 'lastReceiveTime': lastReceiveTime, '_id': { op: alertid } }] }
+        if not query:
+            return keyset
+        return { '$and': [query, keyset] }
+
+    # One more alert than the page size is read to know whether there is another page
+    def limit(self):
+        return self.size + 1
+
+    # Yield the alerts in the page, remembering where it ended
+    def alerts(self, cursor):
+
+        count = 0
+        for alert in cursor:
+            if count == self.size:
+                self.more = True
+                break
+            count += 1
+            self.last = (alert.get('lastReceiveTime'), alert['_id'])
+            yield alert
+
+    def next_token(self):
+
+        if not self.more or not self.last:
+            return None
+        lastReceiveTime, alertid = self.last
+        return base64.urlsafe_b64encode(dumps([format_date(lastReceiveTime), alertid, self.order]))
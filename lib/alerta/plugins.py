@@ -0,0 +1,68 @@
+########################################
+#
+# plugins.py - Alert parser plugin loader
+#
+########################################
+
+import os
+import time
+import threading
+import logging
+
+CHECK_INTERVAL = 5 # seconds between checks for changes to a parser file
+
+# Parsers are plain Python files that read and modify variables in the scope they are
+# run in eg. alert, trapvars, text, tags. Each one is compiled to a code object the first
+# time it is used and recompiled only when the file on disk changes.
+class ParserLoader(object):
+
+    def __init__(self, parserdir, check_interval=CHECK_INTERVAL):
+        self.parserdir = parserdir
+        self.check_interval = check_interval
+        self.parsers = dict() # name -> [code, mtime, checked]
+        self.stats = dict()   # name -> { count, totalTime }
+        self.lock = threading.Lock()
+
+    def filename(self, name):
+        return '%s/%s.py' % (self.parserdir, name)
+
+    def load(self, name):
+        now = time.time()
+        parser = self.parsers.get(name)
+        if parser and now - parser[2] < self.check_interval:
+            return parser[0]
+
+        with self.lock:
+            parser = self.parsers.get(name)
+            if parser and now - parser[2] < self.check_interval:
+                return parser[0]
+
+            filename = self.filename(name)
+            mtime = os.stat(filename).st_mtime
+            if parser and parser[1] == mtime:
+                parser[2] = now
+                return parser[0]
+
+            code = compile(open(filename).read(), filename, 'exec')
+            self.parsers[name] = [code, mtime, now]
+            logging.info('Parser %s compiled OK', filename)
+            return code
+
+    def run(self, name, global_vars, local_vars=None):
+        code = self.load(name)
+        if local_vars is None:
+            local_vars = global_vars
+
+        start = time.time()
+        try:
+            exec code in global_vars, local_vars
+        finally:
+            elapsed = (time.time() - start) * 1000
+            self.record(name, elapsed)
+        return elapsed
+
+    def record(self, name, elapsed):
+        with self.lock:
+            stat = self.stats.setdefault(name, { 'count': 0, 'totalTime': 0 })
+            stat['count'] += 1
+            stat['totalTime'] += elapsed
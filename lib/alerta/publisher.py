@@ -0,0 +1,129 @@
+########################################
+#
+# publisher.py - Buffered alert publisher
+#
+########################################
+
+import time
+import threading
+import logging
+from collections import deque
+
+BUFFER_SIZE = 10000 # alerts held while the broker is unavailable, oldest are dropped first
+BATCH_SIZE = 50 # alerts sent together in one broker transaction
+STOP_TIMEOUT = 30 # seconds to spend sending buffered alerts on shutdown
+
+# Alerts are queued by the worker threads and sent by a single publisher thread so that a slow
+# or unavailable broker never blocks alert processing. Each alert is encoded once and sent to
+# every destination. Queued alerts are sent in batches inside a broker transaction.
+class Publisher(object):
+
+    def __init__(self, conn, destinations, encode, metrics=None, size=BUFFER_SIZE, batch=BATCH_SIZE):
+        self.conn = conn
+        self.destinations = destinations
+        self.encode = encode
+        self.metrics = metrics
+        self.batch = batch
+        self.buffer = deque(maxlen=size)
+        self.dropped = 0
+        self.cond = threading.Condition()
+        self.shutdown = False
+        self.thread = None
+
+    def publish(self, alert, headers):
+        with self.cond:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+                logging.warning('Publisher buffer is full, dropped oldest alert (%d dropped so far)', self.dropped)
+            self.buffer.append((alert, headers, time.time()))
+            self.cond.notify()
+
+    def qsize(self):
+        return len(self.buffer)
+
+    def send(self, batch):
+        transaction = None
+        if len(batch) > 1:
+            transaction = self.conn.begin()
+
+        try:
+            for alert, headers, queued in batch:
+                try:
+                    body = self.encode(alert)
+                except Exception, e:
+                    logging.error('%s : Failed to encode alert, dropping: %s', alert.get('id'), e)
+                    continue
+                for destination in self.destinations:
+                    logging.info('%s : Fwd alert to %s', alert['id'], destination)
+                    if transaction:
+                        self.conn.send(body, headers, destination=destination, transaction=transaction)
+                    else:
+                        self.conn.send(body, headers, destination=destination)
+        except Exception:
+            if transaction:
+                try:
+                    self.conn.abort(transaction=transaction)
+                except Exception:
+                    pass
+            raise
+
+        if transaction:
+            self.conn.commit(transaction=transaction)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.shutdown:
+                    self.cond.wait(1.0)
+                if not self.buffer:
+                    return
+                batch = list()
+                while self.buffer and len(batch) < self.batch:
+                    batch.append(self.buffer.popleft())
+
+            if not self.conn.is_connected():
+                logging.warning('Waiting for message broker to become available, %d alerts buffered', self.qsize() + len(batch))
+                self.requeue(batch)
+                if self.shutdown:
+                    return
+                time.sleep(1.0)
+                continue
+
+            try:
+                self.send(batch)
+            except Exception, e:
+                logging.error('Failed to send %d alerts to broker, will retry: %s', len(batch), e)
+                self.requeue(batch)
+                time.sleep(1.0)
+                continue
+
+            now = time.time()
+            if self.metrics:
+                for alert, headers, queued in batch:
+                    self.metrics.timer("alerts", "published", "Alert publish rate and latency", "Time taken for a processed alert to be sent to the broker", int((now - queued) * 1000))
+                self.metrics.gauge("alerts", "publish_queue", "Alert publish queue length", "Length of outbound alert queue", self.qsize())
+            logging.info('Alerts %s forwarded to %s', ', '.join([alert['id'] for alert, headers, queued in batch]), ' and '.join(self.destinations))
+
+    # Put a batch that could not be sent back on the front of the buffer in its original order
+    def requeue(self, batch):
+        with self.cond:
+            room = self.buffer.maxlen - len(self.buffer)
+            if room < len(batch):
+                self.dropped += len(batch) - room
+                logging.warning('Publisher buffer is full, dropped %d alerts (%d dropped so far)', len(batch) - room, self.dropped)
+                batch = batch[len(batch) - room:]
+            self.buffer.extendleft(reversed(batch))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='Publisher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        with self.cond:
+            self.shutdown = True
+            self.cond.notify()
+        if self.thread:
+            self.thread.join(timeout)
+        if self.buffer:
+            logging.warning('Publisher stopped with %d alerts not sent', len(self.buffer))
@@ -0,0 +1,87 @@
+########################################
+#
+# rules.py - Indexed alert transform and blackout rules
+#
+########################################
+
+import heapq
+
+# Match values are compared with ==, so lists and dicts are indexed by an equivalent hashable value
+def hashable(value):
+
+    if isinstance(value, list):
+        return tuple(hashable(v) for v in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, hashable(v)) for k, v in value.items()))
+    return value
+
+# A rule matches an alert when every key in the rule's match is in the alert with an equal value,
+# and the first matching rule wins. Each rule is indexed on one of its match keys, the one with the
+# most distinct values across all rules, so finding a match only tests the rules whose indexed value
+# equals the alert's plus any rules that match everything. Candidates are tested in file order.
+class RuleIndex(object):
+
+    def __init__(self, conf):
+
+        self.rules = list() # (position, match, rule)
+        for position, rule in enumerate(conf or list()):
+            self.rules.append((position, tuple(rule['match'].items()), rule))
+
+        # Count the distinct values for each match key
+        values = dict()
+        for position, match, rule in self.rules:
+            for key, value in match:
+                try:
+                    values.setdefault(key, set()).add(hashable(value))
+                except TypeError:
+                    pass
+
+        self.index = dict() # key -> value -> rules in file order
+        self.unindexed = list() # rules with no indexable match key
+        for position, match, rule in self.rules:
+            indexable = [(len(values[key]), key, value) for key, value in match if key in values and self.is_hashable(value)]
+            if indexable:
+                count, key, value = max(indexable)
+                self.index.setdefault(key, dict()).setdefault(hashable(value), list()).append((position, match, rule))
+            else:
+                self.unindexed.append((position, match, rule))
+        self.keys = self.index.items()
+
+    def is_hashable(self, value):
+        try:
+            hash(hashable(value))
+        except TypeError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.rules)
+
+    def candidates(self, alert):
+
+        candidates = list()
+        if self.unindexed:
+            candidates.append(self.unindexed)
+        for key, buckets in self.keys:
+            if key in alert:
+                try:
+                    rules = buckets.get(hashable(alert[key]))
+                except TypeError:
+                    continue
+                if rules:
+                    candidates.append(rules)
+        return candidates
+
+    def match(self, alert):
+
+        candidates = self.candidates(alert)
+        if not candidates:
+            return None
+        elif len(candidates) == 1:
+            rules = candidates[0]
+        else:
+            rules = heapq.merge(*candidates)
+        for position, match, rule in rules:
+            if all(key in alert and alert[key] == value for key, value in match):
+                return rule
+        return None
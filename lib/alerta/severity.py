@@ -0,0 +1,29 @@
+########################################
+#
+# severity.py - Alert severity tables
+#
+########################################
+
+CRITICAL = 'CRITICAL'
+MAJOR    = 'MAJOR'
+MINOR    = 'MINOR'
+WARNING  = 'WARNING'
+NORMAL   = 'NORMAL'
+INFORM   = 'INFORM'
+DEBUG    = 'DEBUG'
+
+SEVERITY_CODE = {
+    # ITU RFC5674 -> Syslog RFC5424
+    CRITICAL:       1, # Alert
+    MAJOR:          2, # Crtical
+    MINOR:          3, # Error
+    WARNING:        4, # Warning
+    NORMAL:         5, # Notice
+    INFORM:         6, # Informational
+    DEBUG:          7, # Debug
+}
+
+# Most to least severe
+SEVERITIES = [ CRITICAL, MAJOR, MINOR, WARNING, NORMAL, INFORM, DEBUG ]
+
+STATUSES = [ 'OPEN', 'ACK', 'CLOSED', 'DELETED', 'EXPIRED' ]
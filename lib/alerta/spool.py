@@ -0,0 +1,256 @@
+########################################
+#
+# spool.py - Write-ahead journal of accepted alerts
+#
+########################################
+
+import os
+import time
+import zlib
+import threading
+import logging
+from collections import deque, OrderedDict
+
+SEGMENT_SIZE = 16 * 1024 * 1024 # bytes written to a segment file before starting a new one
+SYNC_WAIT = 0.002 # seconds to wait for more records so one fsync covers them all
+
+SEGMENT_FORMAT = 'spool-%010d.log'
+
+# Alerts are appended to the journal as they are accepted and marked done once they have been
+# processed. The journal is a series of append-only segment files of two kinds of record:
+#
+#   A <seq> <crc32> <length>\n<data>\n    an accepted alert
+#   D <seq>\n                             an alert that has been processed
+#
+# Records are buffered in memory and written by a single thread which fsyncs every segment it
+# has written to before advancing the synced sequence, so one fsync covers every record that
+# arrived while the previous one was in progress. A record for an alert is always written before
+# its done record, so segments are deleted from the oldest while every alert in them is done.
+# A crash can leave a partly written record at the end of a segment; it is ignored when the
+# journal is read back.
+class Spool(object):
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, sync_wait=SYNC_WAIT, metrics=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_wait = sync_wait
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.seq = 0 # last sequence number given out
+        self.synced = 0 # every record up to and including this sequence number is on disk
+        self.buffer = list() # (segment, record) waiting to be written
+        self.tags = deque() # (seq, tag) waiting for the record to be synced
+        self.segment = 0 # segment new records are written to
+        self.size = 0 # bytes written or buffered for the current segment
+        self.pending = OrderedDict() # segment -> number of alerts not done
+        self.outstanding = dict() # seq -> segment
+        self.files = dict() # segment -> open file descriptor
+        self.closing = False
+        self.thread = None
+
+    def path(self, segment):
+        return os.path.join(self.directory, SEGMENT_FORMAT % segment)
+
+    # Read every segment back and return (seq, data) for the alerts that were accepted but never
+    # marked done, in the order they were accepted. New records go to a new segment.
+    def open(self):
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        segments = list()
+        for name in os.listdir(self.directory):
+            if name.startswith('spool-') and name.endswith('.log'):
+                try:
+                    segments.append(int(name[6:-4]))
+                except ValueError:
+                    pass
+        segments.sort()
+
+        accepted = dict() # seq -> (segment, data)
+        for segment in segments:
+            for kind, seq, data in self.read(segment):
+                if kind == 'A':
+                    accepted[seq] = (segment, data)
+                else:
+                    accepted.pop(seq, None)
+                self.seq = max(self.seq, seq)
+        self.synced = self.seq
+
+        for segment in segments:
+            self.pending[segment] = 0
+        unprocessed = list()
+        for seq in sorted(accepted):
+            segment, data = accepted[seq]
+            self.pending[segment] += 1
+            self.outstanding[seq] = segment
+            unprocessed.append((seq, data))
+
+        self.segment = segments[-1] + 1 if segments else 0
+        self.pending[self.segment] = 0
+        self.truncate()
+
+        logging.info('Opened spool %s with %d segments, %d alerts to replay', self.directory, len(segments), len(unprocessed))
+        return unprocessed
+
+    # Yield (kind, seq, data) for each record in a segment up to the first incomplete or
+    # corrupt record
+    def read(self, segment):
+
+        f = open(self.path(segment), 'rb')
+        try:
+            while True:
+                header = f.readline()
+                if not header.endswith('\n'):
+                    break
+                fields = header.split()
+                try:
+                    if fields[0] == 'D' and len(fields) == 2:
+                        yield 'D', int(fields[1]), None
+                        continue
+                    if fields[0] != 'A' or len(fields) != 4:
+                        raise ValueError
+                    seq, crc, length = int(fields[1]), int(fields[2], 16), int(fields[3])
+                except (IndexError, ValueError):
+                    logging.warning('Ignoring corrupt record in %s', self.path(segment))
+                    break
+                data = f.read(length + 1)
+                if len(data) != length + 1 or data[-1] != '\n' or zlib.crc32(data[:-1]) & 0xffffffff != crc:
+                    logging.warning('Ignoring incomplete record %d in %s', seq, self.path(segment))
+                    break
+                yield 'A', seq, data[:-1]
+        finally:
+            f.close()
+
+    # Journal an alert and return its sequence number. The tag is handed back by durable()
+    # once the record has been synced.
+    def append(self, data, tag=None):
+
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        with self.lock:
+            self.seq += 1
+            record = 'A %d %08x %d\n%s\n' % (self.seq, zlib.crc32(data) & 0xffffffff, len(data), data)
+            self.buffer.append((self.segment, record))
+            self.pending[self.segment] += 1
+            self.outstanding[self.seq] = self.segment
+            if tag is not None:
+                self.tags.append((self.seq, tag))
+            self.size += len(record)
+            if self.size >= self.segment_size:
+                self.segment += 1
+                self.pending[self.segment] = 0
+                self.size = 0
+            self.cond.notify()
+            return self.seq
+
+    # Mark an alert as processed. Done records are synced with the next group of accepted alerts;
+    # if one is lost in a crash the alert is processed again.
+    def done(self, seq):
+
+        with self.lock:
+            segment = self.outstanding.pop(seq, None)
+            if segment is None:
+                return
+            self.pending[segment] -= 1
+            record = 'D %d\n' % seq
+            self.buffer.append((self.segment, record))
+            self.size += len(record)
+            self.cond.notify()
+
+    # Return the tags of alerts whose records have been synced since the last call
+    def durable(self):
+
+        tags = list()
+        with self.lock:
+            while self.tags and self.tags[0][0] <= self.synced:
+                tags.append(self.tags.popleft()[1])
+        return tags
+
+    def sync(self):
+
+        with self.lock:
+            buffer, self.buffer = self.buffer, list()
+            seq = self.seq
+        if not buffer:
+            return
+
+        start = time.time()
+        records = OrderedDict() # segment -> records, written with one call each
+        for segment, record in buffer:
+            records.setdefault(segment, list()).append(record)
+        try:
+            for segment in records:
+                if segment not in self.files:
+                    self.files[segment] = os.open(self.path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+                os.write(self.files[segment], ''.join(records[segment]))
+            for segment in records:
+                os.fsync(self.files[segment])
+        except (IOError, OSError):
+            with self.lock:
+                self.buffer[:0] = buffer
+            raise
+
+        with self.lock:
+            self.synced = seq
+            self.truncate()
+        if self.metrics:
+            self.metrics.timer("spool", "synced", "Spool sync rate and duration", "Time taken to write and fsync a group of journal records", int((time.time() - start) * 1000))
+
+    # Delete the oldest segments while every alert in them is done and nothing is still waiting
+    # to be written to them. Called with the lock held.
+    def truncate(self):
+
+        buffered = set(segment for segment, record in self.buffer)
+        while len(self.pending) > 1:
+            segment, count = self.pending.items()[0]
+            if count or segment == self.segment or segment in buffered:
+                break
+            del self.pending[segment]
+            if segment in self.files:
+                os.close(self.files.pop(segment))
+            try:
+                os.unlink(self.path(segment))
+            except OSError:
+                pass
+            logging.debug('Deleted spool segment %d', segment)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.closing:
+                    self.cond.wait()
+                if self.closing and not self.buffer:
+                    break
+            time.sleep(self.sync_wait)
+            try:
+                self.sync()
+            except (IOError, OSError), e:
+                logging.error('Failed to sync spool %s: %s', self.directory, e)
+                if self.closing:
+                    break
+                time.sleep(1)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='SpoolWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Sync anything still buffered. Segments left behind hold alerts that were not processed.
+    def stop(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        if self.thread:
+            self.thread.join()
+        self.sync()
+        for fd in self.files.values():
+            os.close(fd)
+        self.files = dict()
+        if not self.outstanding:
+            for segment in self.pending.keys():
+                try:
+                    os.unlink(self.path(segment))
+                except OSError:
+                    pass
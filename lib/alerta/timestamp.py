@@ -0,0 +1,70 @@
+########################################
+#
+# timestamp.py - ISO 8601 alert timestamps
+#
+########################################
+
+import datetime
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ' # eg. 2012-11-21T09:53:03.123Z
+
+CACHE_SIZE = 1024 # parsed timestamps kept, timestamps are often parsed more than once
+
+class UTC(datetime.tzinfo):
+
+    def utcoffset(self, dt):
+        return datetime.timedelta(0)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def __repr__(self):
+        return '<UTC>'
+
+utc = UTC()
+
+_cache = dict()
+
+# Format a datetime as an ISO 8601 timestamp with milliseconds. Timezone aware datetimes are
+# converted to UTC, naive datetimes are assumed to be UTC already.
+def format_date(dt):
+
+    if dt.tzinfo is not None and dt.tzinfo is not utc:
+        offset = dt.utcoffset()
+        if offset:
+            dt = dt - offset
+
+    # isoformat is several times faster than formatting each field, it leaves out the
+    # fraction when there are no microseconds and adds any UTC offset after it
+    value = dt.isoformat()
+    if dt.microsecond:
+        return value[:23] + 'Z'
+    return value[:19] + '.000Z'
+
+# Parse an ISO 8601 timestamp in DATE_FORMAT into a timezone aware UTC datetime
+def parse_date(value):
+
+    dt = _cache.get(value)
+    if dt is not None:
+        return dt
+
+    try:
+        if len(value) == 24 and value[4] == '-' and value[10] == 'T' and value[19] == '.' and value[23] == 'Z':
+            dt = datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                   int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                                   int(value[20:23]) * 1000, utc)
+        else:
+            dt = datetime.datetime.strptime(value, DATE_FORMAT).replace(tzinfo=utc)
+    except (TypeError, ValueError):
+        raise ValueError('time data %r does not match format %r' % (value, DATE_FORMAT))
+
+    if len(_cache) >= CACHE_SIZE:
+        _cache.clear()
+    _cache[value] = dt
+    return dt
+
+def utcnow():
+    return datetime.datetime.utcnow().replace(tzinfo=utc)
@@ -0,0 +1,147 @@
+########################################
+#
+# webapp.py - Shared state for the web API scripts
+#
+########################################
+
+import os
+import sys
+import threading
+import logging
+import yaml
+import pymongo
+import stomp
+
+from alerta.cache import etag_matches
+
+DATABASE = 'monitoring'
+
+# The web API scripts are run either as CGI, one process per request, or loaded once by a
+# long running WSGI server (see alerta.wsgi). Connections and config are created on first use
+# and kept for the life of the process, so with WSGI they are shared by every request and
+# every request thread.
+
+mongo = None
+broker = None
+lock = threading.Lock()
+broker_lock = threading.Lock()
+
+# MongoDB connections are pooled by pymongo and safe to share between threads
+def get_db():
+    global mongo
+
+    if mongo is None:
+        with lock:
+            if mongo is None:
+                mongo = pymongo.Connection()
+    return mongo[DATABASE]
+
+# Send a message to each destination over a broker connection that is kept open between
+# requests, reconnecting if it has been lost. Returns the (host, port) it was sent to.
+def send_to_broker(broker_list, body, headers, destinations):
+    global broker
+
+    with broker_lock:
+        if broker is None or not broker.is_connected():
+            if broker is not None:
+                try:
+                    broker.disconnect()
+                except Exception:
+                    pass
+            broker = stomp.Connection(broker_list)
+            broker.start()
+            broker.connect(wait=True)
+        for destination in destinations:
+            broker.send(body, headers, destination=destination)
+        return broker.get_host_and_port()
+
+# YAML config that is only read again when the file changes
+class ConfigFile(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.config = None
+        self.mtime = None
+
+    def get(self):
+        try:
+            mtime = os.stat(self.filename).st_mtime
+            if mtime != self.mtime:
+                self.config = yaml.load(open(self.filename, 'r'))
+                self.mtime = mtime
+        except (IOError, OSError), e:
+            logging.error('Failed to load config file %s: %s', self.filename, e)
+        return self.config
+
+RESPONSE_HEADERS = [
+    ('Expires', '-1'),
+    ('Cache-Control', 'no-cache'),
+    ('Pragma', 'no-cache'),
+]
+
+ETAG_KEY = 'alerta.etag' # handlers put the ETag of a cacheable response in the environment under this key
+
+def response_headers(content, etag=None):
+
+    headers = [('Content-Type', 'application/javascript; charset=utf-8'), ('Content-Length', str(len(content)))]
+    if etag:
+        headers.append(('ETag', etag))
+    headers.extend(RESPONSE_HEADERS)
+    return headers
+
+# True if the client already has the response, in which case it is sent 304 Not Modified and
+# no content. Handlers can check this before doing any work.
+def not_modified(environ):
+
+    etag = environ.get(ETAG_KEY)
+    return etag is not None and etag_matches(environ.get('HTTP_IF_NONE_MATCH'), etag)
+
+# Request handlers take the CGI/WSGI environment and the request body and return the response
+# content, so the same handler can be run either way.
+def run_cgi(handle):
+
+    body = None
+    if os.environ.get('REQUEST_METHOD') in ['PUT', 'POST']:
+        body = sys.stdin.read()
+    environ = dict(os.environ)
+    content = handle(environ, body)
+
+    if not_modified(environ):
+        print "Status: 304 Not Modified"
+        print "ETag: %s" % environ[ETAG_KEY]
+        print ""
+        return
+
+    for name, value in response_headers(content, environ.get(ETAG_KEY)):
+        print "%s: %s" % (name, value)
+    print ""
+    print content
+
+def wsgi_application(handle):
+
+    def application(environ, start_response):
+        body = None
+        if environ.get('REQUEST_METHOD') in ['PUT', 'POST']:
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            body = environ['wsgi.input'].read(length)
+        if 'REQUEST_URI' not in environ:
+            uri = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+            if environ.get('QUERY_STRING'):
+                uri += '?' + environ['QUERY_STRING']
+            environ['REQUEST_URI'] = uri
+        environ.setdefault('QUERY_STRING', '')
+
+        content = handle(environ, body)
+        if not_modified(environ):
+            start_response('304 Not Modified', [('ETag', environ[ETAG_KEY])])
+            return []
+
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        start_response('200 OK', response_headers(content, environ.get(ETAG_KEY)))
+        return [content]
+
+    return application
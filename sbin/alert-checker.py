@@ -22,6 +22,12 @@ import logging
 import uuid
 import re
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.alert import Alert
+from alerta.severity import SEVERITY_CODE
+from alerta.codec import dumps
+from alerta.timestamp import format_date
+
 __version__ = '1.1.5'
 
 BROKER_LIST  = [('monitoring.guprod.gnl', 61613),('localhost', 61613)] # list of brokers for failover
@@ -91,17 +97,6 @@ parser.add_option("-d",
 VALID_SEVERITY    = [ 'CRITICAL', 'MAJOR', 'MINOR', 'WARNING', 'NORMAL', 'INFORM', 'DEBUG' ]
 VALID_ENVIRONMENT = [ 'PROD', 'REL', 'QA', 'TEST', 'CODE', 'STAGE', 'DEV', 'LWP','INFRA' ]
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
-
 options, args = parser.parse_args()
 
 if not options.resource:
@@ -169,7 +164,7 @@ def main():
     headers['persistent']     = 'true'
     headers['expires']        = int(time.time() * 1000) + EXPIRATION_TIME * 1000
 
-    alert = dict()
+    alert = Alert()
     alert['id']            = alertid
     alert['resource']      = options.resource
     alert['event']         = options.event
@@ -183,13 +178,13 @@ def main():
     alert['type']          = 'exceptionAlert'
     alert['tags']          = options.tags
     alert['summary']       = '%s - %s %s is %s on %s %s' % (','.join(options.environment), severity, options.event, value, ','.join(options.service), options.resource)
-    alert['createTime']    = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    alert['createTime']    = format_date(createTime)
     alert['origin']        = 'alert-checker/%s' % os.uname()[1]
     alert['thresholdInfo'] = options.nagios
     alert['timeout']       = options.timeout
 
     logging.info('%s : Nagios plugin %s => %s (rc=%d)', alertid, options.nagios, text, rc)
-    logging.info('%s : %s', alertid, json.dumps(alert))
+    logging.info('%s : %s', alertid, dumps(alert))
 
     if (not options.dry_run):
         try:
@@ -201,7 +196,7 @@ def main():
             logging.error('Could not connect to broker %s', e)
             sys.exit(1)
         try:
-            conn.send(json.dumps(alert), headers, destination=ALERT_QUEUE)
+            conn.send(dumps(alert), headers, destination=ALERT_QUEUE)
         except Exception, e:
             print >>sys.stderr, "ERROR: Failed to send alert to broker - %s " % e
             logging.error('Failed to send alert to broker %s', e)
@@ -213,7 +208,7 @@ def main():
             print alertid
         sys.exit(0)
     else:
-        print "%s %s" % (json.dumps(headers, indent=4), json.dumps(alert, indent=4))
+        print "%s %s" % (json.dumps(headers, indent=4), dumps(alert, indent=4))
 
 if __name__ == '__main__':
     main()
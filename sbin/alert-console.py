@@ -22,6 +22,9 @@ import signal
 import datetime
 import pytz
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.timestamp import parse_date
+
 __title__ = 'Alert Console'
 __program__ = 'alert-console'
 __version__ = '1.0.2'
@@ -174,8 +177,7 @@ class Screen():
                 for column in ALERT_TABLE_COLUMNS:
                     width, align = column['width'], column['align']
                     if column['name'] == 'lastReceiveTime':
-                        lastReceiveTime = datetime.datetime.strptime(alert['lastReceiveTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                        lastReceiveTime = lastReceiveTime.replace(tzinfo=pytz.utc)
+                        lastReceiveTime = parse_date(alert['lastReceiveTime'])
                         value = lastReceiveTime.strftime('%T %d/%m/%y')
                     elif column['name'] == 'lastReceiveId':
                         value = alert['lastReceiveId'][0:8]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+########################################
+#
+# alert-index-advisor.py - Explain the alert query shapes
+#
+########################################
+
+import os
+import sys
+from optparse import OptionParser
+import datetime
+import pymongo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.indexes import INDEXES, QUERY_SHAPES, FULL_SCANS, ensure_indexes, fill_shape, explain_summary
+from alerta.timestamp import utcnow
+
+__version__ = '1.0.0'
+
+DATABASE = 'monitoring'
+
+def main():
+
+    parser = OptionParser(
+                      version="%prog " + __version__,
+                      description="Replay the query shapes used by the alerta daemons and web API and print explain output for each, flagging any that need a collection scan. Exits non-zero if a collection scan is found.",
+                      epilog="alert-index-advisor.py --create --verbose")
+    parser.add_option("-H",
+                      "--host",
+                      dest="host",
+                      default="localhost",
+                      help="MongoDB host (default: localhost)")
+    parser.add_option("-p",
+                      "--port",
+                      type="int",
+                      dest="port",
+                      default=27017,
+                      help="MongoDB port (default: 27017)")
+    parser.add_option("-d",
+                      "--database",
+                      dest="database",
+                      default=DATABASE,
+                      help="Database (default: %s)" % DATABASE)
+    parser.add_option("-c",
+                      "--create",
+                      action="store_true",
+                      default=False,
+                      help="Create any missing indexes before explaining")
+    parser.add_option("-v",
+                      "--verbose",
+                      action="store_true",
+                      default=False,
+                      help="Print the full explain output for each query")
+    options, args = parser.parse_args()
+
+    mongo = pymongo.Connection(options.host, options.port)
+    db = mongo[options.database]
+
+    if options.create:
+        ensure_indexes(db)
+
+    print "Indexes"
+    for collection, keys, name in INDEXES:
+        present = name in db[collection].index_information()
+        print "  %-12s %-28s %s" % (collection, name, 'ok' if present else 'MISSING')
+    print
+
+    # Take values for the query shapes from the most recent alert
+    sample = db.alerts.find_one(sort=[('lastReceiveTime', pymongo.DESCENDING)]) or dict()
+    sample.setdefault('_id', 'unknown')
+    sample.setdefault('environment', ['PROD'])
+    sample.setdefault('resource', 'localhost')
+    sample.setdefault('service', ['Unknown'])
+    sample.setdefault('event', 'Unknown')
+    sample.setdefault('severity', 'MAJOR')
+    sample.setdefault('lastReceiveTime', utcnow() - datetime.timedelta(hours=1))
+
+    scans = 0
+    print "%-28s %-36s %10s %8s %8s  %s" % ('query', 'index', 'scanned', 'returned', 'ms', '')
+    for name, collection, query, sort in QUERY_SHAPES:
+        query = fill_shape(query, sample)
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = cursor.explain()
+
+        indexes, collscan, scanned, returned, millis = explain_summary(explain)
+        if collscan and name not in FULL_SCANS:
+            flag = 'COLLSCAN'
+            scans += 1
+        else:
+            flag = ''
+        print "%-28s %-36s %10s %8s %8s  %s" % (name, ','.join(indexes) or '-', scanned, returned, millis, flag)
+        if options.verbose:
+            print "  query: %s sort: %s" % (query, sort)
+            print "  explain: %s" % explain
+
+    if scans:
+        print
+        print "%d query shape(s) need a collection scan" % scans
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,10 @@ import urllib2, urllib
 import operator
 import pytz
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.severity import SEVERITY_CODE
+from alerta.timestamp import format_date, parse_date
+
 __version__ = '1.3.2'
 
 SEV = {
@@ -30,17 +34,6 @@ SEV = {
     'DEBUG':    'Dbug',
 }
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
-
 COLOR = {
     'CRITICAL': '\033[91m',
     'MAJOR':    '\033[95m',
@@ -57,6 +50,54 @@ PGM='alert-query.py'
 SERVER = 'monitoring.guprod.gnl'
 TIMEZONE='Europe/London'
 DATE_FORMAT = '%d/%m/%y %H:%M:%S'
+PAGE_SIZE = 500 # alerts fetched per request when paging
+
+# The API matches a single value exactly unless it starts with '~' (see lib/alerta/filters.py). A
+# single value is sent as a case insensitive regular expression so that it matches anywhere in
+# the field, as it always has, unless --exact is given. Several values for a field match any of
+# them exactly.
+def match_values(field, values, exact=False):
+
+    if exact or len(values) != 1:
+        return [(field, value) for value in values]
+    return [(field, '~' + values[0])]
+
+# Yield the alerts for a query, either from a single response or a page at a time following the
+# next token so that they can be printed as they arrive. Status and severity counts are added up
+# in counts and the time spent waiting for the API in stats.
+def get_alerts(url, paged, reverse, counts, stats):
+
+    token = None
+    while True:
+        page_url = url
+        if token:
+            page_url += '&' + urllib.urlencode([('next', token)])
+        start = time.time()
+        try:
+            output = urllib2.urlopen(page_url).read()
+            response = json.loads(output)['response']
+        except urllib2.URLError, e:
+            print "ERROR: Alert query %s failed - %s" % (page_url, e)
+            sys.exit(1)
+        stats['time'] += time.time() - start
+        if response['status'] != 'ok':
+            print "ERROR: Alert query %s failed - %s" % (page_url, response.get('message'))
+            sys.exit(1)
+
+        for name in ['statusCounts', 'severityCounts']:
+            for key, value in response['alerts'][name].items():
+                counts[name][key] = counts[name].get(key, 0) + value
+
+        if reverse:
+            alertDetails = reversed(response['alerts']['alertDetails'])
+        else:
+            alertDetails = response['alerts']['alertDetails']
+        for alert in alertDetails:
+            yield alert
+
+        token = response.get('next')
+        if not paged or not token:
+            return
 
 def main():
 
@@ -209,6 +250,11 @@ def main():
                       action="store_true",
                       default=False,
                       help="Synonym for --show=color")
+    parser.add_option("-x",
+                      "--exact",
+                      action="store_true",
+                      default=False,
+                      help="Match values exactly instead of anywhere in the field ignoring case, faster as indexes can be used. Values can end in * to match a prefix.")
     parser.add_option("-d",
                       "--dry-run",
                       action="store_true",
@@ -227,7 +273,7 @@ def main():
     if options.minutes or options.hours or options.days:
         now = datetime.datetime.utcnow()
         fromTime = now - datetime.timedelta(days=options.days, minutes=options.minutes+options.hours*60)
-        query.append('from-date=%s' % fromTime.replace(microsecond=0).isoformat() + ".%03dZ" % (fromTime.microsecond//1000))
+        query.append('from-date=%s' % format_date(fromTime))
         now = now.replace(tzinfo=pytz.utc)
         fromTime = fromTime.replace(tzinfo=pytz.utc)
 
@@ -236,28 +282,22 @@ def main():
             query.append(('id', o))
 
     if options.environment:
-        for o in options.environment:
-            query.append(('environment', o))
+        query.extend(match_values('environment', options.environment, options.exact))
 
     if options.not_environment:
-        for o in options.not_environment:
-            query.append(('-environment', o))
+        query.extend(match_values('-environment', options.not_environment, options.exact))
 
     if options.service:
-        for o in options.service:
-            query.append(('service',o))
+        query.extend(match_values('service', options.service, options.exact))
 
     if options.not_service:
-        for o in options.not_service:
-            query.append(('-service', o))
+        query.extend(match_values('-service', options.not_service, options.exact))
 
     if options.resource:
-        for o in options.resource:
-            query.append(('resource', o))
+        query.extend(match_values('resource', options.resource, options.exact))
 
     if options.not_resource:
-        for o in options.not_resource:
-            query.append(('-resource', o))
+        query.extend(match_values('-resource', options.not_resource, options.exact))
 
     if options.severity:
         for o in options.severity:
@@ -279,59 +319,47 @@ def main():
 
     if options.status:
         for o in options.status:
-            query.append(('status',o))
+            query.append(('status', o.upper()))
 
     if options.not_status:
         for o in options.not_status:
-            query.append(('-status', o))
+            query.append(('-status', o.upper()))
 
     if options.event:
-        for o in options.event:
-            query.append(('event', o))
+        query.extend(match_values('event', options.event, options.exact))
 
     if options.not_event:
-        for o in options.not_event:
-            query.append(('-event', o))
+        query.extend(match_values('-event', options.not_event, options.exact))
 
     if options.group:
-        for o in options.group:
-            query.append(('group', o))
+        query.extend(match_values('group', options.group, options.exact))
 
     if options.not_group:
-        for o in options.not_group:
-            query.append(('-group', o))
+        query.extend(match_values('-group', options.not_group, options.exact))
 
     if options.value:
-        for o in options.value:
-            query.append(('value', o))
+        query.extend(match_values('value', options.value, options.exact))
 
     if options.not_value:
-        for o in options.not_value:
-            query.append(('-value', o))
+        query.extend(match_values('-value', options.not_value, options.exact))
 
     if options.origin:
-        for o in options.origin:
-            query.append(('origin', o))
+        query.extend(match_values('origin', options.origin, options.exact))
 
     if options.not_origin:
-        for o in options.not_origin:
-            query.append(('-origin', o))
+        query.extend(match_values('-origin', options.not_origin, options.exact))
 
     if options.tags:
-        for o in options.tags:
-            query.append(('tags', o))
+        query.extend(match_values('tags', options.tags, options.exact))
 
     if options.not_tags:
-        for o in options.not_tags:
-            query.append(('-tags', o))
+        query.extend(match_values('-tags', options.not_tags, options.exact))
 
     if options.text:
-        for o in options.text:
-            query.append(('text', o))
+        query.extend(match_values('text', options.text, options.exact))
 
     if options.not_text:
-        for o in options.not_text:
-            query.append(('-text', o))
+        query.extend(match_values('-text', options.not_text, options.exact))
 
     if options.sortby:
         query.append(('sort-by', options.sortby))
@@ -342,6 +370,12 @@ def main():
     if options.show == ['counts']:
         query.append(('hide-alert-details','true'))
 
+    # Page through alerts oldest first unless they are limited or sorted by something else
+    paged = options.sortby == 'lastReceiveTime' and not options.limit and options.show != ['counts']
+    if paged:
+        query.append(('page-size', PAGE_SIZE))
+        query.append(('order', 'asc'))
+
     url = "%s?%s" % (API_URL, urllib.urlencode(query))
 
     if options.dry_run:
@@ -406,26 +440,16 @@ def main():
         end_color = ENDC
 
     # Query API for alerts
-    start = time.time()
-    try:
-        output = urllib2.urlopen(url).read()
-        response = json.loads(output)['response']
-    except urllib2.URLError, e:
-        print "ERROR: Alert query %s failed - %s" % (url, e)
-        sys.exit(1)
-    end = time.time()
-
-    if options.sortby in ['createTime', 'receiveTime', 'lastReceiveTime']:
-        alertDetails = reversed(response['alerts']['alertDetails'])
-    else:
-        alertDetails = response['alerts']['alertDetails']
+    counts = { 'statusCounts': dict(), 'severityCounts': dict() }
+    stats = { 'time': 0.0 }
+    reverse = not paged and options.sortby in ['createTime', 'receiveTime', 'lastReceiveTime']
+    alertDetails = get_alerts(url, paged, reverse, counts, stats)
 
     count = 0
     for alert in alertDetails:
         alertid          = alert['id']
         correlatedEvents = alert.get('correlatedEvents', ['n/a'])
-        createTime       = datetime.datetime.strptime(alert['createTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-        createTime       = createTime.replace(tzinfo=pytz.utc)
+        createTime       = parse_date(alert['createTime'])
         environment      = alert['environment']
         event            = alert['event']
         graphs           = alert.get('graphs', ['n/a'])
@@ -447,16 +471,13 @@ def main():
 
         duplicateCount   = int(alert['duplicateCount'])
         if alert['expireTime'] is not None:
-            expireTime   = datetime.datetime.strptime(alert['expireTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-            expireTime   = expireTime.replace(tzinfo=pytz.utc)
+            expireTime   = parse_date(alert['expireTime'])
         else:
             expireTime   = None
         lastReceiveId    = alert['lastReceiveId']
-        lastReceiveTime  = datetime.datetime.strptime(alert['lastReceiveTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-        lastReceiveTime  = lastReceiveTime.replace(tzinfo=pytz.utc)
+        lastReceiveTime  = parse_date(alert['lastReceiveTime'])
         previousSeverity = alert['previousSeverity']
-        receiveTime      = datetime.datetime.strptime(alert['receiveTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-        receiveTime      = receiveTime.replace(tzinfo=pytz.utc)
+        receiveTime      = parse_date(alert['receiveTime'])
         repeat           = alert['repeat']
         delta            = receiveTime - createTime
         latency          = int(delta.days * 24 * 60 * 60 * 1000 + delta.seconds * 1000 + delta.microseconds / 1000)
@@ -527,11 +548,9 @@ def main():
             for hist in alert['history']:
                 if 'event' in hist:
                     alertid     = hist['id']
-                    createTime  = datetime.datetime.strptime(hist['createTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                    createTime  = createTime.replace(tzinfo=pytz.utc)
+                    createTime  = parse_date(hist['createTime'])
                     event       = hist['event']
-                    receiveTime = datetime.datetime.strptime(hist['receiveTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                    receiveTime = receiveTime.replace(tzinfo=pytz.utc)
+                    receiveTime = parse_date(hist['receiveTime'])
                     severity    = hist['severity']
                     value       = hist['value']
                     text        = hist['text']
@@ -544,8 +563,7 @@ def main():
                         value) + end_color)
                     print(line_color + '    |%s' % (text) + end_color)
                 if 'status' in hist:
-                    updateTime  = datetime.datetime.strptime(hist['updateTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                    updateTime  = updateTime.replace(tzinfo=pytz.utc)
+                    updateTime  = parse_date(hist['updateTime'])
                     status      = hist['status']
                     print(line_color + '    %s|%s' % (updateTime.astimezone(tz).strftime(DATE_FORMAT), status) + end_color)
 
@@ -554,23 +572,23 @@ def main():
         print('OPEN|ACK|CLOSED' + '  '),
         print('Crit|Majr|Minr|Warn|Norm|Info|Dbug')
         print(
-            '%4d' % response['alerts']['statusCounts']['open'] + ' ' +
-            '%3d' % response['alerts']['statusCounts']['ack'] + ' ' +
-            '%6d' % response['alerts']['statusCounts']['closed'] + '  '),
+            '%4d' % counts['statusCounts']['open'] + ' ' +
+            '%3d' % counts['statusCounts']['ack'] + ' ' +
+            '%6d' % counts['statusCounts']['closed'] + '  '),
         print(
-            COLOR['CRITICAL'] + '%4d' % response['alerts']['severityCounts']['critical'] + ENDC + ' ' +
-            COLOR['MAJOR']    + '%4d' % response['alerts']['severityCounts']['major']    + ENDC + ' ' +
-            COLOR['MINOR']    + '%4d' % response['alerts']['severityCounts']['minor']    + ENDC + ' ' +
-            COLOR['WARNING']  + '%4d' % response['alerts']['severityCounts']['warning']  + ENDC + ' ' +
-            COLOR['NORMAL']   + '%4d' % response['alerts']['severityCounts']['normal']   + ENDC + ' ' +
-            COLOR['INFORM']   + '%4d' % response['alerts']['severityCounts']['inform']   + ENDC + ' ' +
-            COLOR['DEBUG']    + '%4d' % response['alerts']['severityCounts']['debug']    + ENDC)
+            COLOR['CRITICAL'] + '%4d' % counts['severityCounts']['critical'] + ENDC + ' ' +
+            COLOR['MAJOR']    + '%4d' % counts['severityCounts']['major']    + ENDC + ' ' +
+            COLOR['MINOR']    + '%4d' % counts['severityCounts']['minor']    + ENDC + ' ' +
+            COLOR['WARNING']  + '%4d' % counts['severityCounts']['warning']  + ENDC + ' ' +
+            COLOR['NORMAL']   + '%4d' % counts['severityCounts']['normal']   + ENDC + ' ' +
+            COLOR['INFORM']   + '%4d' % counts['severityCounts']['inform']   + ENDC + ' ' +
+            COLOR['DEBUG']    + '%4d' % counts['severityCounts']['debug']    + ENDC)
 
     if not options.nofooter:
         now = datetime.datetime.utcnow()
         now = now.replace(tzinfo=pytz.utc)
         print
-        print "Total: %d (produced on %s at %s by %s,v%s on %s in %sms)" % (count, now.astimezone(tz).strftime("%d/%m/%y"), now.astimezone(tz).strftime("%H:%M:%S %Z"), PGM, __version__, os.uname()[1], int((end - start) * 1000))
+        print "Total: %d (produced on %s at %s by %s,v%s on %s in %sms)" % (count, now.astimezone(tz).strftime("%d/%m/%y"), now.astimezone(tz).strftime("%H:%M:%S %Z"), PGM, __version__, os.uname()[1], int(stats['time'] * 1000))
 
 if __name__ == '__main__':
     main()
@@ -24,6 +24,12 @@ import datetime
 import logging
 import uuid
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+from alerta.alert import Alert
+from alerta.severity import SEVERITY_CODE
+from alerta.codec import dumps
+from alerta.timestamp import format_date
+
 __program__ = 'alert-sender'
 __version__ = '1.1.3'
 
@@ -114,20 +120,9 @@ parser.add_option("-d",
 VALID_SEVERITY    = [ 'CRITICAL', 'MAJOR', 'MINOR', 'WARNING', 'NORMAL', 'INFORM', 'DEBUG' ]
 VALID_ENVIRONMENT = [ 'PROD', 'REL', 'QA', 'TEST', 'CODE', 'STAGE', 'DEV', 'LWP','INFRA' ]
 
-SEVERITY_CODE = {
-    # ITU RFC5674 -> Syslog RFC5424
-    'CRITICAL':       1, # Alert
-    'MAJOR':          2, # Crtical
-    'MINOR':          3, # Error
-    'WARNING':        4, # Warning
-    'NORMAL':         5, # Notice
-    'INFORM':         6, # Informational
-    'DEBUG':          7, # Debug
-}
-
 def send_message(alert, headers):
 
-    logging.info('%s : %s', alert['id'], json.dumps(alert))
+    logging.info('%s : %s', alert['id'], dumps(alert))
 
     if (not options.dry_run):
         try:
@@ -139,7 +134,7 @@ def send_message(alert, headers):
             logging.error('Could not connect to broker %s', e)
             sys.exit(1)
         try:
-            conn.send(json.dumps(alert), headers, destination=ALERT_QUEUE)
+            conn.send(dumps(alert), headers, destination=ALERT_QUEUE)
         except Exception, e:
             print >>sys.stderr, "ERROR: Failed to send alert to broker - %s " % e
             logging.error('Failed to send alert to broker %s', e)
@@ -151,7 +146,7 @@ def send_message(alert, headers):
             print alert['id']
         sys.exit(0)
     else:
-        print "%s %s" % (json.dumps(headers, indent=4), json.dumps(alert, indent=4))
+        print "%s %s" % (json.dumps(headers, indent=4), dumps(alert, indent=4))
     sys.exit(0)
 
 # main()
@@ -168,10 +163,10 @@ if options.heartbeat:
     headers['type']           = "heartbeat"
     headers['correlation-id'] = heartbeatid
 
-    heartbeat = dict()
+    heartbeat = Alert()
     heartbeat['id']         = heartbeatid
     heartbeat['type']       = "heartbeat"
-    heartbeat['createTime'] = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    heartbeat['createTime'] = format_date(createTime)
     heartbeat['origin']     = "%s/%s" % (options.origin,os.uname()[1])
     if options.tags:
         heartbeat['version'] = options.tags
@@ -228,7 +223,7 @@ else:
     headers['type']           = "exceptionAlert"
     headers['correlation-id'] = alertid
 
-    alert = dict()
+    alert = Alert()
     alert['id']            = alertid
     alert['resource']      = options.resource
     alert['event']         = options.event
@@ -244,7 +239,7 @@ else:
     alert['type']          = 'exceptionAlert'
     alert['tags']          = options.tags
     alert['summary']       = '%s - %s %s is %s on %s %s' % (','.join(options.environment), options.severity.upper(), options.event, options.value, ','.join(options.service), options.resource)
-    alert['createTime']    = createTime.replace(microsecond=0).isoformat() + ".%03dZ" % (createTime.microsecond//1000)
+    alert['createTime']    = format_date(createTime)
     alert['origin']        = "%s/%s" % (__program__, os.uname()[1])
     alert['thresholdInfo'] = 'n/a'
     alert['timeout']       = options.timeout
@@ -1,7 +1,13 @@
-// To mark timed out alerts as EXPIRED and delete CLOSED alerts older than 2 hours run this script from cron like so:
+// To delete CLOSED alerts older than 2 hours run this script from cron like so:
 // * * * * * /usr/bin/mongo --quiet monitoring /opt/alerta/sbin/removeExpiredAlerts.js
-now = new Date();
-db.alerts.update({ status: 'OPEN', expireTime: { $lt: now }}, { $set: { status: 'EXPIRED' }, $push: { history: {status: 'EXPIRED', updateTime: now }}}, false, true);
-
+// Timed out alerts are marked as EXPIRED by alerta.py
+// Deleted alert ids are kept in the deleted collection so API clients polling for changes remove them
 ago = new Date(new Date() - 2*60*60*1000);
-db.alerts.remove({ status: 'CLOSED', lastReceiveTime: { $lt: ago }});
+// Each alert is removed only if it is still CLOSED and old, in case it was reopened or updated
+// after the find, and a deleted id is only recorded for an alert that was actually removed
+db.alerts.find({ status: 'CLOSED', lastReceiveTime: { $lt: ago }}, { _id: 1 }).forEach(function(alert) {
+    removed = db.alerts.findAndModify({ query: { _id: alert._id, status: 'CLOSED', lastReceiveTime: { $lt: ago }}, fields: { _id: 1 }, remove: true });
+    if (removed) {
+        db.deleted.save({ _id: removed._id, modifyTime: new Date() });
+    }
+});